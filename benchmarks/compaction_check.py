@@ -0,0 +1,69 @@
+"""
+索引压缩回归检查：对每种 FAISS_INDEX_TYPE 建索引、删除一半向量（与墓碑压缩相同的 remove_vectors），
+再用存活向量本身检索，确认返回的ID仍指向原向量、已删除的ID不再出现。
+
+用法（在项目根目录执行）：
+    python -m benchmarks.compaction_check --vectors 2000 --types flat,ivfflat
+"""
+import argparse
+import json
+import logging
+import sys
+from typing import List, Optional
+
+import numpy as np
+
+from config import IVF_NLIST
+from utils.index_factory import INDEX_TYPES, apply_search_params, create_index, min_training_size, remove_vectors
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Check that searches stay correct after index compaction")
+    parser.add_argument("--types", default=",".join(INDEX_TYPES), help="索引类型，逗号分隔")
+    parser.add_argument("--vectors", type=int, default=2000, help="向量数量（不足训练样本时自动补足）")
+    parser.add_argument("--dimension", type=int, default=64, help="向量维度")
+    parser.add_argument("--first-id", type=int, default=1000, help="起始向量ID")
+    parser.add_argument("--seed", type=int, default=42, help="随机种子")
+    return parser.parse_args(argv)
+
+
+def check_index_type(index_type: str, count: int, dim: int, first_id: int, seed: int) -> dict:
+    rng = np.random.default_rng(seed)
+    count = max(count, min_training_size(index_type))
+    vectors = rng.standard_normal((count, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    ids = np.arange(first_id, first_id + count, dtype=np.int64)
+
+    index = create_index(dim, index_type, vectors)
+    index.add_with_ids(vectors, ids)
+    removed = ids[:count // 2]
+    index = remove_vectors(index, removed.tolist())
+    # 精确检查：IVF 探查全部聚类，HNSW 放宽搜索宽度，排除近似检索本身的召回误差
+    apply_search_params(index, nprobe=IVF_NLIST, ef_search=max(count, 16))
+
+    survivors = ids[count // 2:]
+    _, found = index.search(vectors[count // 2:], 1)
+    mismatched = int((found[:, 0] != survivors).sum())
+    resurrected = int(np.isin(found, removed).sum())
+    return {
+        "type": index_type,
+        "ntotal": int(index.ntotal),
+        "expected_ntotal": len(survivors),
+        "mismatched": mismatched,
+        "removed_ids_returned": resurrected,
+        "passed": index.ntotal == len(survivors) and mismatched == 0 and resurrected == 0
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    types = [index_type.strip() for index_type in args.types.split(",") if index_type.strip()]
+    results = [check_index_type(index_type, args.vectors, args.dimension, args.first_id, args.seed)
+               for index_type in types]
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+    return 0 if all(result["passed"] for result in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
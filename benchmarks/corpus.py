@@ -0,0 +1,163 @@
+"""
+合成基准语料：按给定数量与格式生成 TXT / DOCX / PDF 文件。
+
+内容由固定随机种子从领域词表中抽样生成，相同参数在任何机器上生成的文本完全一致，
+便于跨提交比较入库与检索性能。
+"""
+import os
+import random
+from typing import Dict, List, Sequence
+
+# 电力领域词表，保证 jieba 分词与关键词检索的行为接近真实语料
+VOCABULARY = [
+    "电力系统", "电力市场", "现货市场", "中长期交易", "辅助服务", "调峰", "调频", "备用容量",
+    "新能源", "光伏发电", "风电场", "储能电站", "抽水蓄能", "火电机组", "燃气轮机", "核电",
+    "输电线路", "配电网", "变电站", "负荷预测", "需求响应", "虚拟电厂", "电价机制", "节点电价",
+    "出清价格", "报价策略", "容量补偿", "碳排放", "绿色电力证书", "可再生能源消纳", "电网安全",
+    "潮流计算", "短路电流", "频率稳定", "电压稳定", "继电保护", "调度中心", "发电计划", "检修计划",
+    "市场主体", "售电公司", "电力用户", "偏差考核", "结算规则", "交易中心", "跨省跨区", "输配电价",
+]
+FILLER = ["的", "在", "对", "与", "以及", "通过", "实现", "提高", "降低", "分析", "研究", "影响", "优化"]
+FORMATS = ("txt", "docx", "pdf")
+
+
+def make_paragraph(rng: random.Random, sentences: int = 4) -> str:
+    """生成一个由若干句子组成的段落"""
+    parts = []
+    for _ in range(sentences):
+        words = [rng.choice(VOCABULARY) if rng.random() < 0.6 else rng.choice(FILLER) for _ in range(rng.randint(8, 16))]
+        parts.append("".join(words) + "。")
+    return "".join(parts)
+
+
+def make_document(rng: random.Random, paragraphs: int) -> List[str]:
+    return [make_paragraph(rng) for _ in range(paragraphs)]
+
+
+def make_queries(count: int, seed: int = 7) -> List[str]:
+    """生成互不相同的查询问题（避免结果被问题级缓存命中）"""
+    rng = random.Random(seed)
+    queries = []
+    seen = set()
+    while len(queries) < count:
+        a, b = rng.sample(VOCABULARY, 2)
+        question = f"{a}对{b}有什么影响？"
+        if question not in seen:
+            seen.add(question)
+            queries.append(question)
+    return queries
+
+
+def write_txt(path: str, paragraphs: Sequence[str]):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(paragraphs))
+
+
+def write_docx(path: str, paragraphs: Sequence[str], table_rows: int = 3):
+    """生成 DOCX：正文段落加一个表格（与提取逻辑一致，表格内容排在段落之后）"""
+    from docx import Document
+
+    document = Document()
+    for paragraph in paragraphs:
+        document.add_paragraph(paragraph)
+    if table_rows:
+        table = document.add_table(rows=table_rows, cols=2)
+        for i, row in enumerate(table.rows):
+            row.cells[0].text = VOCABULARY[i % len(VOCABULARY)]
+            row.cells[1].text = paragraphs[i % len(paragraphs)][:40]
+    document.save(path)
+
+
+def write_table_docx(path: str, rng: random.Random, tables: int = 50, rows: int = 40, cols: int = 6,
+                     merge_every: int = 5):
+    """
+    生成表格密集的 DOCX：每个表格每隔 merge_every 行做一次横向合并与纵向合并，
+    用于比较 DOCX 提取器在合并单元格上的耗时与输出大小。
+    """
+    from docx import Document
+
+    document = Document()
+    for _ in range(tables):
+        document.add_paragraph(make_paragraph(rng, sentences=2))
+        table = document.add_table(rows=rows, cols=cols)
+        for row in table.rows:
+            for cell in row.cells:
+                cell.text = "".join(rng.choice(VOCABULARY) for _ in range(rng.randint(1, 3)))
+        if merge_every:
+            for i in range(0, rows - 1, merge_every):
+                table.cell(i, 0).merge(table.cell(i, 1))  # 横向合并
+                table.cell(i, cols - 1).merge(table.cell(i + 1, cols - 1))  # 纵向合并
+    document.save(path)
+
+
+def write_pdf(path: str, paragraphs: Sequence[str], chars_per_line: int = 36, lines_per_page: int = 40):
+    """
+    生成 PDF：使用 PDF 标准预定义的 STSong-Light 中文字体（UniGB-UCS2-H 编码），
+    无需嵌入字体文件，pdfminer 可直接还原文本。
+    """
+    lines = []
+    for paragraph in paragraphs:
+        lines.extend(paragraph[i:i + chars_per_line] for i in range(0, len(paragraph), chars_per_line))
+    pages = [lines[i:i + lines_per_page] for i in range(0, len(lines), lines_per_page)] or [[]]
+
+    objects: Dict[int, bytes] = {
+        1: b"<< /Type /Catalog /Pages 2 0 R >>",
+        3: (b"<< /Type /Font /Subtype /Type0 /BaseFont /STSong-Light /Encoding /UniGB-UCS2-H "
+            b"/DescendantFonts [4 0 R] >>"),
+        4: (b"<< /Type /Font /Subtype /CIDFontType0 /BaseFont /STSong-Light "
+            b"/CIDSystemInfo << /Registry (Adobe) /Ordering (GB1) /Supplement 2 >> /FontDescriptor 5 0 R >>"),
+        5: (b"<< /Type /FontDescriptor /FontName /STSong-Light /Flags 6 /FontBBox [0 -200 1000 900] "
+            b"/ItalicAngle 0 /Ascent 880 /Descent -120 /CapHeight 880 /StemV 93 >>"),
+    }
+    page_ids = []
+    for number, page_lines in enumerate(pages):
+        page_id, content_id = 6 + 2 * number, 7 + 2 * number
+        text = [b"BT /F1 12 Tf 14 TL 50 800 Td"]
+        for line in page_lines:
+            text.append(b"<" + line.encode("utf-16-be").hex().upper().encode("ascii") + b"> Tj T*")
+        text.append(b"ET")
+        stream = b"\n".join(text)
+        objects[content_id] = b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream)
+        objects[page_id] = (b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_id)
+        page_ids.append(page_id)
+    kids = b" ".join(b"%d 0 R" % page_id for page_id in page_ids)
+    objects[2] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(page_ids))
+
+    output = bytearray(b"%PDF-1.4\n")
+    offsets = {}
+    for object_id in sorted(objects):
+        offsets[object_id] = len(output)
+        output += b"%d 0 obj\n%s\nendobj\n" % (object_id, objects[object_id])
+    xref = len(output)
+    size = max(objects) + 1
+    output += b"xref\n0 %d\n0000000000 65535 f \n" % size
+    for object_id in range(1, size):
+        output += b"%010d 00000 n \n" % offsets[object_id]
+    output += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (size, xref)
+    with open(path, "wb") as f:
+        f.write(bytes(output))
+
+
+_WRITERS = {"txt": write_txt, "docx": write_docx, "pdf": write_pdf}
+
+
+def generate_corpus(directory: str, documents: int, formats: Sequence[str] = FORMATS,
+                    paragraphs: int = 20, seed: int = 42) -> List[str]:
+    """
+    在目录下生成 documents 个文件，按 formats 轮流选择格式。
+    :return: 生成的文件路径列表
+    """
+    unknown = set(formats) - set(_WRITERS)
+    if unknown:
+        raise ValueError(f"Unsupported formats: {sorted(unknown)}")
+
+    os.makedirs(directory, exist_ok=True)
+    rng = random.Random(seed)
+    paths = []
+    for i in range(documents):
+        file_format = formats[i % len(formats)]
+        path = os.path.join(directory, f"bench_{i:06d}.{file_format}")
+        _WRITERS[file_format](path, make_document(rng, paragraphs))
+        paths.append(path)
+    return paths
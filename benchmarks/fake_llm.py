@@ -0,0 +1,143 @@
+"""
+本地 OpenAI / DeepSeek 兼容的假 LLM 服务，用于离线基准测试。
+
+只实现 POST /chat/completions：按固定延迟返回确定性的回答，
+关键词请求返回逗号分隔的关键词，问答请求返回固定长度的回答。
+请求带 stream=true 时按 SSE 逐段返回，段间隔由 token_interval 控制。
+同时检查问答请求的文档消息，统计把段落列表直接格式化为 Python 列表表示的请求。
+"""
+import asyncio
+import hashlib
+import json
+import re
+import socket
+import threading
+from typing import Optional
+
+from aiohttp import web
+
+from benchmarks.corpus import VOCABULARY
+
+# 文档消息以列表表示开头（如 "Document: ['..."），说明段落未拼接就被格式化进提示词
+_LIST_REPR_PATTERN = re.compile(r"^Document:\s*\[\s*['\"]")
+
+
+def _fake_answer(messages: list, answer_chars: int) -> str:
+    system = messages[0].get("content", "") if messages else ""
+    question = messages[-1].get("content", "") if messages else ""
+    seed = int(hashlib.md5(question.encode("utf-8")).hexdigest()[:8], 16)
+    if "关键词" in system:
+        words = [VOCABULARY[(seed + i * 7) % len(VOCABULARY)] for i in range(20)]
+        return "，".join(words)
+    return ("根据文档：" + "".join(VOCABULARY[(seed + i) % len(VOCABULARY)] for i in range(answer_chars)))[:answer_chars]
+
+
+def is_list_repr_prompt(messages: list) -> bool:
+    """问答请求的文档消息是否为段落列表的 repr"""
+    return any(_LIST_REPR_PATTERN.match(message.get("content", "")) for message in messages
+               if message.get("role") == "user")
+
+
+def _free_port(host: str) -> int:
+    """由系统分配一个空闲端口"""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind((host, 0))
+        return sock.getsockname()[1]
+
+
+class FakeLLMServer:
+    """在后台线程运行的假 LLM 服务"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.05, answer_chars: int = 200,
+                 token_chars: int = 8, token_interval: float = 0.01):
+        self.host = host
+        self.port = port or _free_port(host)
+        self.latency = latency
+        self.answer_chars = answer_chars
+        self.token_chars = token_chars
+        self.token_interval = token_interval
+        self.requests = 0
+        self.cancelled_streams = 0
+        self.malformed_prompts = 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._runner: Optional[web.AppRunner] = None
+        self._thread: Optional[threading.Thread] = None
+        self._started = threading.Event()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    async def _chat_completions(self, request: web.Request) -> web.Response:
+        payload = await request.json()
+        self.requests += 1
+        if is_list_repr_prompt(payload.get("messages", [])):
+            self.malformed_prompts += 1
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+        content = _fake_answer(payload.get("messages", []), self.answer_chars)
+        if payload.get("stream"):
+            return await self._stream(request, payload, content)
+        return web.json_response({
+            "id": f"fake-{self.requests}",
+            "object": "chat.completion",
+            "model": payload.get("model", "fake"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}]
+        })
+
+    async def _stream(self, request: web.Request, payload: dict, content: str) -> web.StreamResponse:
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        try:
+            for i in range(0, len(content), self.token_chars):
+                chunk = {
+                    "id": f"fake-{self.requests}",
+                    "object": "chat.completion.chunk",
+                    "model": payload.get("model", "fake"),
+                    "choices": [{"index": 0, "delta": {"content": content[i:i + self.token_chars]}}]
+                }
+                await response.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+                if self.token_interval > 0:
+                    await asyncio.sleep(self.token_interval)
+            await response.write(b"data: [DONE]\n\n")
+        except ConnectionResetError:
+            # 客户端提前断开
+            self.cancelled_streams += 1
+        except asyncio.CancelledError:
+            self.cancelled_streams += 1
+            raise
+        return response
+
+    async def _start(self):
+        app = web.Application()
+        app.router.add_post("/chat/completions", self._chat_completions)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_until_complete(self._start())
+        self._started.set()
+        self._loop.run_forever()
+        self._loop.run_until_complete(self._runner.cleanup())
+        self._loop.close()
+
+    def start(self) -> "FakeLLMServer":
+        self._thread = threading.Thread(target=self._run, name="fake-llm", daemon=True)
+        self._thread.start()
+        self._started.wait()
+        return self
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
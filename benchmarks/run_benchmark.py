@@ -0,0 +1,267 @@
+"""
+离线基准测试：入库吞吐与查询延迟
+
+在临时目录中生成合成语料，启动本地假 LLM 服务，使用确定性哈希模型（或真实模型）
+依次执行目录入库、无变化的增量同步与 /query 查询，输出机器可读的 JSON 结果，
+用于跨提交比较性能。
+
+用法（在项目根目录执行）：
+    python -m benchmarks.run_benchmark --documents 300 --queries 200 --output bench.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import List, Optional
+
+import numpy as np
+
+from benchmarks.corpus import FORMATS, generate_corpus, make_queries
+from benchmarks.fake_llm import FakeLLMServer
+
+logger = logging.getLogger("benchmark")
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="CogniSync ingestion and query benchmark")
+    parser.add_argument("--documents", type=int, default=60, help="合成文档数量")
+    parser.add_argument("--formats", default=",".join(FORMATS), help="文档格式，逗号分隔（txt,docx,pdf）")
+    parser.add_argument("--paragraphs", type=int, default=20, help="每个文档的段落数")
+    parser.add_argument("--seed", type=int, default=42, help="语料随机种子")
+    parser.add_argument("--queries", type=int, default=50, help="查询次数（问题互不相同）")
+    parser.add_argument("--warmup-queries", type=int, default=5, help="不计入统计的预热查询次数")
+    parser.add_argument("--concurrency", type=int, default=4, help="并发查询数")
+    parser.add_argument("--k", type=int, default=5, help="每次查询返回的文档数")
+    parser.add_argument("--model", choices=("stub", "real"), default="stub",
+                        help="stub：确定性哈希模型；real：配置中的 Sentence-BERT 模型")
+    parser.add_argument("--dimension", type=int, default=384, help="哈希模型的向量维度")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="假 LLM 每次响应的延迟（秒）")
+    parser.add_argument("--granularity", choices=("document", "chunk"), help="索引粒度（默认沿用配置）")
+    parser.add_argument("--index-type", help="FAISS 索引类型（默认沿用配置）")
+    parser.add_argument("--workdir", help="工作目录（默认使用临时目录并在结束后删除）")
+    parser.add_argument("--keep", action="store_true", help="保留工作目录")
+    parser.add_argument("--output", help="结果 JSON 输出路径（默认输出到标准输出）")
+    return parser.parse_args(argv)
+
+
+def configure_environment(args: argparse.Namespace, workdir: str, llm_base_url: str) -> str:
+    """
+    将所有存储路径指向工作目录。必须在导入 config 之前调用，
+    入库流水线的提取进程（spawn）也会继承这些环境变量。
+    """
+    storage = os.path.join(workdir, "data_storage")
+    files_path = os.path.join(storage, "files")
+    os.environ.update({
+        "DATA_STORAGE_PATH": storage,
+        "FILES_PATH": files_path,
+        "MAPPING_PATH": os.path.join(storage, "data.json"),
+        "MAPPING_DB_PATH": os.path.join(storage, "mappings.db"),
+        "FAISS_INDEX_PATH": os.path.join(storage, "faiss.index"),
+        "CHUNK_INDEX_PATH": os.path.join(storage, "chunk_faiss.index"),
+        "CHUNK_MAP_PATH": os.path.join(storage, "chunk_map.npz"),
+        "CONTENT_STORE_PATH": os.path.join(storage, "content"),
+        "COMMIT_LOG_PATH": os.path.join(storage, "commit.log"),
+        "BM25_INDEX_PATH": os.path.join(storage, "bm25.db"),
+        "QUERY_CACHE_DISK_PATH": "",
+        "LLM_BASE_URL": llm_base_url,
+    })
+    if args.granularity:
+        os.environ["INDEX_GRANULARITY"] = args.granularity
+    if args.index_type:
+        os.environ["FAISS_INDEX_TYPE"] = args.index_type
+    return files_path
+
+
+def peak_rss_mb() -> dict:
+    """当前进程与已结束子进程（提取进程池）的峰值常驻内存"""
+    try:
+        import resource
+    except ImportError:  # Windows
+        return {"self": None, "children": None}
+    # Linux 下 ru_maxrss 单位为 KB，macOS 下为字节
+    scale = 1024 ** 2 if sys.platform == "darwin" else 1024
+    return {
+        "self": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale, 1),
+        "children": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale, 1)
+    }
+
+
+def latency_summary(latencies: List[float]) -> dict:
+    if not latencies:
+        return {"count": 0}
+    values = np.array(latencies) * 1000
+    return {
+        "count": len(latencies),
+        "mean_ms": round(float(values.mean()), 2),
+        "p50_ms": round(float(np.percentile(values, 50)), 2),
+        "p95_ms": round(float(np.percentile(values, 95)), 2),
+        "p99_ms": round(float(np.percentile(values, 99)), 2),
+        "max_ms": round(float(values.max()), 2)
+    }
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_ingestion(files_path: str) -> dict:
+    from utils.load import FileIndexState, process_files_in_directory
+
+    start = time.perf_counter()
+    state = FileIndexState()
+    init_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    stats = process_files_in_directory(state, files_path) or {}
+    elapsed = time.perf_counter() - start
+
+    # 无变化的增量同步：衡量文件清单跳过的开销
+    start = time.perf_counter()
+    process_files_in_directory(state, files_path)
+    resync_seconds = time.perf_counter() - start
+
+    corpus_bytes = sum(os.path.getsize(os.path.join(files_path, name)) for name in os.listdir(files_path))
+    documents = stats.get("results", {}).get("success", 0)
+    return {
+        "state_init_seconds": round(init_seconds, 3),
+        "elapsed_seconds": round(elapsed, 3),
+        "documents_per_second": round(documents / elapsed, 2) if elapsed > 0 else 0.0,
+        "mb_per_second": round(corpus_bytes / 1024 ** 2 / elapsed, 3) if elapsed > 0 else 0.0,
+        "resync_seconds": round(resync_seconds, 3),
+        "results": stats.get("results", {}),
+        "stages": stats.get("stages", {}),
+        "peak_rss_mb": peak_rss_mb()
+    }
+
+
+async def run_queries(questions: List[str], warmup: List[str], concurrency: int, k: int) -> dict:
+    from routes.query import query
+    from utils.llm import close_llm_session
+
+    async def timed(question: str) -> tuple:
+        start = time.perf_counter()
+        try:
+            response = await query(question, openApiKey="benchmark", k=k)
+            return time.perf_counter() - start, response, None
+        except Exception as e:
+            return time.perf_counter() - start, None, str(e)
+
+    try:
+        for question in warmup:
+            await timed(question)
+
+        semaphore = asyncio.Semaphore(max(concurrency, 1))
+
+        async def bounded(question: str) -> tuple:
+            async with semaphore:
+                return await timed(question)
+
+        start = time.perf_counter()
+        outcomes = await asyncio.gather(*(bounded(question) for question in questions))
+        elapsed = time.perf_counter() - start
+    finally:
+        await close_llm_session()
+
+    latencies = [seconds for seconds, response, error in outcomes if error is None]
+    responses = [response for _, response, error in outcomes if error is None]
+    errors = [error for _, _, error in outcomes if error is not None]
+    return {
+        "elapsed_seconds": round(elapsed, 3),
+        "queries_per_second": round(len(questions) / elapsed, 2) if elapsed > 0 else 0.0,
+        "concurrency": concurrency,
+        "latency": latency_summary(latencies),
+        "errors": len(errors),
+        "first_error": errors[0] if errors else None,
+        "answer_cache_hits": sum(1 for response in responses if response.get("answer_cached")),
+        "empty_results": sum(1 for response in responses if not response.get("relevant_documents")),
+        "peak_rss_mb": peak_rss_mb()
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> dict:
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    formats = [fmt.strip() for fmt in args.formats.split(",") if fmt.strip()]
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="cognisync-bench-")
+    server = FakeLLMServer(latency=args.llm_latency).start()
+    try:
+        files_path = configure_environment(args, workdir, server.base_url)
+
+        start = time.perf_counter()
+        paths = generate_corpus(files_path, args.documents, formats, args.paragraphs, args.seed)
+        corpus_seconds = time.perf_counter() - start
+
+        # 以下模块读取 config，必须在设置环境变量之后导入
+        import config
+        if args.model == "stub":
+            from benchmarks.stub_model import install_stub_model
+            install_stub_model(args.dimension)
+        from utils.sentence_model import warmup_model
+        start = time.perf_counter()
+        warmup_model()
+        model_seconds = time.perf_counter() - start
+
+        ingestion = run_ingestion(files_path)
+        questions = make_queries(args.queries + args.warmup_queries, seed=args.seed)
+        queries = asyncio.run(run_queries(questions[args.warmup_queries:], questions[:args.warmup_queries],
+                                          args.concurrency, args.k))
+
+        result = {
+            "meta": {
+                "git_revision": git_revision(),
+                "timestamp": round(time.time(), 3),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+                "args": vars(args),
+                "config": {
+                    "index_granularity": config.INDEX_GRANULARITY,
+                    "chunker": config.CHUNKER,
+                    "embedding_backend": config.EMBEDDING_BACKEND,
+                    "faiss_index_type": config.FAISS_INDEX_TYPE,
+                    "hybrid_search": config.HYBRID_SEARCH,
+                    "embed_batch_size": config.EMBED_BATCH_SIZE,
+                    "extract_workers": config.INGEST_EXTRACT_WORKERS
+                }
+            },
+            "corpus": {
+                "documents": len(paths),
+                "formats": formats,
+                "bytes": sum(os.path.getsize(path) for path in paths),
+                "generate_seconds": round(corpus_seconds, 3)
+            },
+            "model": {"kind": args.model, "warmup_seconds": round(model_seconds, 3)},
+            "ingestion": ingestion,
+            "query": queries,
+            "llm_requests": server.requests,
+            # 应为 0：非零表示上下文段落以列表 repr 形式进入了提示词
+            "llm_malformed_prompts": server.malformed_prompts,
+            "peak_rss_mb": peak_rss_mb()
+        }
+    finally:
+        server.stop()
+        if not args.workdir and not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    output = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    else:
+        print(output)
+    return result
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""
+确定性的轻量嵌入模型，用于离线基准测试。
+
+对分词结果做特征哈希（带符号）后 L2 归一化：不需要下载模型权重，
+结果与机器无关，同时保留"共享词越多向量越相似"的性质，检索结果有意义。
+"""
+import hashlib
+import logging
+from typing import List
+
+import numpy as np
+
+from config import LOCAL_MODEL_PATH
+
+logger = logging.getLogger(__name__)
+
+
+class HashingEmbeddingModel:
+    """接口与 SentenceTransformer 中被本项目使用的部分保持一致"""
+
+    def __init__(self, dimension: int = 384):
+        self.dimension = dimension
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dimension
+
+    def encode(self, texts: List[str], **kwargs) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        for row, text in enumerate(texts):
+            # 输入已由 jieba 分词并以空格连接；未分词的文本退化为按字符哈希
+            tokens = text.split() if " " in text else list(text)
+            for token in tokens:
+                digest = int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "little")
+                vectors[row, digest % self.dimension] += 1.0 if digest >> 63 else -1.0
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    def parameters(self):
+        return []
+
+    def save(self, path: str):
+        pass
+
+
+def install_stub_model(dimension: int = 384, local_model_path: str = LOCAL_MODEL_PATH) -> HashingEmbeddingModel:
+    """将哈希模型注册到进程级模型注册表，后续 get_model() 直接返回它"""
+    from utils import sentence_model
+
+    model = HashingEmbeddingModel(dimension)
+    with sentence_model._registry_lock:
+        sentence_model._model_registry[local_model_path] = model
+        sentence_model._model_stats[local_model_path] = {"load_seconds": 0.0, "param_bytes": 0, "warmed_up": False}
+    logger.info(f"Installed hashing stub model (dimension={dimension}) for {local_model_path}")
+    return model
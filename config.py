@@ -6,12 +6,109 @@ load_dotenv()
 
 DATA_STORAGE_PATH = os.getenv("DATA_STORAGE_PATH", "./data_storage")  # 数据存储路径
 FILES_PATH = os.getenv("FILES_PATH", "./data_storage/files")  # 文件存储路径（原始文件存储）
-MAPPING_PATH = os.getenv("MAPPING_PATH", "./data_storage/data.json")  # 索引持久化路径
+MAPPING_PATH = os.getenv("MAPPING_PATH", "./data_storage/data.json")  # 旧版 JSON 映射路径（首次启动时导入映射存储）
+MAPPING_DB_PATH = os.getenv("MAPPING_DB_PATH", "./data_storage/mappings.db")  # 映射存储路径（SQLite）
 SIMILARITY_THRESHOLD = float(os.getenv("SIMILARITY_THRESHOLD", 0.1))  # 默认相似度阈值 10%
 FAISS_INDEX_PATH = os.getenv("FAISS_INDEX_PATH", "./data_storage/faiss.index")  # FAISS 索引路径
-MAX_CONTEXT_LENGTH = os.getenv("MAX_CONTEXT_LENGTH", 209715200)  # 文本最大长度
+FAISS_INDEX_TYPE = os.getenv("FAISS_INDEX_TYPE", "flat").lower()  # 索引类型：flat / hnsw / ivfflat / ivfpq
+HNSW_M = int(os.getenv("HNSW_M", 32))  # HNSW 每个节点的邻居数
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", 200))  # HNSW 建图搜索宽度
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", 64))  # HNSW 默认检索宽度
+IVF_NLIST = int(os.getenv("IVF_NLIST", 1024))  # IVF 聚类中心数
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", 16))  # IVF 默认检索的聚类数
+PQ_M = int(os.getenv("PQ_M", 16))  # PQ 子向量数（需整除向量维度）
+PQ_NBITS = int(os.getenv("PQ_NBITS", 8))  # PQ 每个子向量的编码位数
+INDEX_TRAIN_SAMPLE = int(os.getenv("INDEX_TRAIN_SAMPLE", 100000))  # 训练索引时的最大采样向量数
+CHUNK_INDEX_PATH = os.getenv("CHUNK_INDEX_PATH", "./data_storage/chunk_faiss.index")  # 块级 FAISS 索引路径
+CHUNK_MAP_PATH = os.getenv("CHUNK_MAP_PATH", "./data_storage/chunk_map.npz")  # 块级映射路径
+INDEX_GRANULARITY = os.getenv("INDEX_GRANULARITY", "document").lower()  # 索引粒度：document（文档均值向量）或 chunk（文本块向量）
+PASSAGE_CANDIDATE_FACTOR = int(os.getenv("PASSAGE_CANDIDATE_FACTOR", 4))  # 块级检索时候选数量相对 k 的倍数
+CHUNKER = os.getenv("CHUNKER", "sentence").lower()  # 分块方式：sentence（按句切分、模型分词器计数）或 whitespace（按空白分词的滑动窗口）
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", 96))  # 每块最大 token 数（按模型实际输入即 jieba 分词加空格后计数，同时不超过模型最大序列长度）
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", 16))  # 相邻块按整句重叠的 token 数
+CONTENT_STORE_PATH = os.getenv("CONTENT_STORE_PATH", "./data_storage/content")  # 提取文本存储路径
+CONTENT_CACHE_MAX_BYTES = int(os.getenv("CONTENT_CACHE_MAX_BYTES", 256 * 1024 * 1024))  # 文本内存缓存上限 256MB
+CONTENT_COMPRESS_LEVEL = int(os.getenv("CONTENT_COMPRESS_LEVEL", 6))  # 文本压缩级别（zlib 1-9）
+MAX_CONTEXT_LENGTH = int(os.getenv("MAX_CONTEXT_LENGTH", 200000))  # 组装上下文时单个文档参与切分的最大字符数（限制每次查询的切分与分词开销）
 LOCAL_MODEL_PATH = os.getenv("LOCAL_MODEL_PATH", "./local_model")  # 本地模型路径
 MODEL_NAME = os.getenv("MODEL_NAME", "paraphrase-multilingual-MiniLM-L12-v2")  # 本地模型
+MODEL_WARMUP_TEXT = os.getenv("MODEL_WARMUP_TEXT", "模型预热 warmup")  # 启动时预热模型使用的文本
+
+# 嵌入推理后端配置
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch").lower()  # torch（SentenceTransformer）或 onnx（ONNX Runtime，不可用时回退 torch）
+ONNX_MODEL_PATH = os.getenv("ONNX_MODEL_PATH", os.path.join(LOCAL_MODEL_PATH, "onnx"))  # 导出的 ONNX 模型目录
+ONNX_QUANTIZE = os.getenv("ONNX_QUANTIZE", "int8").lower()  # int8：动态量化权重；none：fp32
+ONNX_THREADS = int(os.getenv("ONNX_THREADS", 0))  # ONNX Runtime 算子内线程数，0 表示使用默认值（物理核数）
+ONNX_PARITY_MIN_COSINE = float(os.getenv("ONNX_PARITY_MIN_COSINE", 0.98))  # 一致性检查允许的最小余弦相似度
+
+# 嵌入批处理配置
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", 64))  # 每批编码的文本块数量
+EMBED_MAX_WAIT = float(os.getenv("EMBED_MAX_WAIT", 0.05))  # 凑批最长等待时间（秒）
+EMBED_MAX_PENDING_DOCS = int(os.getenv("EMBED_MAX_PENDING_DOCS", 32))  # 同时等待编码的最大文档数
+
+# 入库流水线配置
+INGEST_EXTRACT_WORKERS = int(os.getenv("INGEST_EXTRACT_WORKERS", os.cpu_count() or 1))  # 文本提取进程数
+INGEST_EXTRACT_QUEUE = int(os.getenv("INGEST_EXTRACT_QUEUE", 64))  # 同时提交给提取进程池的最大文件数
+INGEST_MP_START_METHOD = os.getenv("INGEST_MP_START_METHOD", "spawn")  # 提取进程启动方式（spawn/fork/forkserver）
+
+# LLM 接口配置（OpenAI 兼容接口）
+LLM_BASE_URL = os.getenv("LLM_BASE_URL", "https://api.deepseek.com")  # 接口地址
+LLM_MODEL = os.getenv("LLM_MODEL", "deepseek-chat")  # 模型名称
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", 120))  # 单次请求总超时（秒）
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", 10))  # 建立连接超时（秒）
+LLM_POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", 100))  # 连接池最大连接数
+LLM_KEEPALIVE_TIMEOUT = float(os.getenv("LLM_KEEPALIVE_TIMEOUT", 30))  # 空闲长连接保持时间（秒）
+
+# 查询路径线程池大小（分词、编码、检索等 CPU 密集步骤）
+QUERY_CPU_WORKERS = int(os.getenv("QUERY_CPU_WORKERS", 4))
+# 写操作线程池大小（/documents 的删除、更新、压缩），与查询线程池分开，避免写入占满查询线程
+WRITE_WORKERS = int(os.getenv("WRITE_WORKERS", 2))
+
+# 组提交配置（批量落盘索引与映射）
+COMMIT_LOG_PATH = os.getenv("COMMIT_LOG_PATH", "./data_storage/commit.log")  # 只追加提交日志路径
+COMMIT_EVERY_DOCS = int(os.getenv("COMMIT_EVERY_DOCS", 200))  # 累计多少个文档提交一次
+COMMIT_INTERVAL_SECONDS = float(os.getenv("COMMIT_INTERVAL_SECONDS", 10))  # 最长提交间隔（秒）
+COMMIT_LOG_FSYNC = os.getenv("COMMIT_LOG_FSYNC", "true").lower() == "true"  # 每条日志是否 fsync
+
+# 查询缓存配置
+KEYWORD_CACHE_SIZE = int(os.getenv("KEYWORD_CACHE_SIZE", 10000))  # 问题 -> 关键词缓存条目上限
+KEYWORD_CACHE_TTL = float(os.getenv("KEYWORD_CACHE_TTL", 24 * 3600))  # 关键词缓存过期时间（秒）
+VECTOR_CACHE_SIZE = int(os.getenv("VECTOR_CACHE_SIZE", 10000))  # 关键词 -> 查询向量缓存条目上限
+VECTOR_CACHE_TTL = float(os.getenv("VECTOR_CACHE_TTL", 7 * 24 * 3600))  # 查询向量缓存过期时间（秒）
+QUERY_CACHE_MAX_BYTES = int(os.getenv("QUERY_CACHE_MAX_BYTES", 64 * 1024 * 1024))  # 每个缓存的内存上限 64MB
+QUERY_CACHE_DISK_PATH = os.getenv("QUERY_CACHE_DISK_PATH", "")  # 磁盘缓存路径（SQLite），为空时不启用
+
+# 语义答案缓存配置
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", 0.95))  # 查询向量余弦相似度阈值
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", 5000))  # 缓存答案条目上限
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", 24 * 3600))  # 答案过期时间（秒）
+
+# 启动配置
+SERVER_WORKERS = int(os.getenv("SERVER_WORKERS", 1))  # 服务进程数，大于 1 时关闭热重载，各进程共享只读映射的索引快照
+INDEX_WRITER_LOCK_PATH = os.getenv("INDEX_WRITER_LOCK_PATH", os.path.join(DATA_STORAGE_PATH, "index_writer.lock"))  # 写入进程锁（只有持锁进程入库）
+FAISS_MMAP = os.getenv("FAISS_MMAP", "true").lower() == "true"  # 查询路径以只读 mmap 方式打开索引（按需加载页面）
+SYNC_ON_STARTUP = os.getenv("SYNC_ON_STARTUP", "true").lower() == "true"  # 启动后在后台同步本地知识库
+MANIFEST_FLUSH_EVERY = int(os.getenv("MANIFEST_FLUSH_EVERY", 500))  # 文件清单累计多少条写入一次
+
+# 文档删除与索引压缩配置
+COMPACT_MIN_TOMBSTONES = int(os.getenv("COMPACT_MIN_TOMBSTONES", 100))  # 触发压缩的最少墓碑数
+COMPACT_TOMBSTONE_RATIO = float(os.getenv("COMPACT_TOMBSTONE_RATIO", 0.1))  # 墓碑占索引向量的比例达到该值时压缩
+
+# 混合检索配置（BM25 倒排索引 + 向量检索）
+HYBRID_SEARCH = os.getenv("HYBRID_SEARCH", "false").lower() == "true"  # 是否构建倒排索引并与向量检索结果融合（开启后 distances 为融合得分）
+BM25_INDEX_PATH = os.getenv("BM25_INDEX_PATH", "./data_storage/bm25.db")  # 倒排索引路径（SQLite）
+BM25_K1 = float(os.getenv("BM25_K1", 1.2))  # BM25 词频饱和参数
+BM25_B = float(os.getenv("BM25_B", 0.75))  # BM25 文档长度归一化参数
+BM25_CACHE_MAX_BYTES = int(os.getenv("BM25_CACHE_MAX_BYTES", 64 * 1024 * 1024))  # 倒排列表内存缓存上限 64MB
+RRF_K = int(os.getenv("RRF_K", 60))  # 倒数排名融合常数
+
+# 批量查询配置
+BATCH_QUERY_MAX_SIZE = int(os.getenv("BATCH_QUERY_MAX_SIZE", 1000))  # 单次批量查询的最大问题数
+BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", 8))  # 批量查询中同时进行的 LLM 调用数
+
+# 上下文组装配置（送入 LLM 的文档内容）
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 6000))  # 上下文 token 预算
+CONTEXT_TOKENIZER = os.getenv("CONTEXT_TOKENIZER", "model").lower()  # token 计数方式：model（嵌入模型分词器）或 estimate（按字符估算）
 
 # 环境配置（development, production, or default）
 ENVIRONMENT = os.getenv("ENVIRONMENT", "default")
@@ -23,3 +120,11 @@ ENABLE_ENCRYPTION = os.getenv("ENABLE_ENCRYPTION", "true").lower() == "true"  #
 # 文件上传配置
 MAX_FILE_SIZE = int(os.getenv("MAX_FILE_SIZE", 50 * 1024 * 1024))  # 最大文件上传大小 50MB
 ALLOWED_FILE_TYPES = os.getenv("ALLOWED_FILE_TYPES", "pdf,docx").split(",")  # 支持的文件类型
+
+# DOCX 提取配置
+DOCX_EXTRACTOR = os.getenv("DOCX_EXTRACTOR", "stream").lower()  # stream：流式解析 document.xml；python-docx：构建完整对象模型
+
+# PDF 提取配置
+PDF_MAX_PAGES = int(os.getenv("PDF_MAX_PAGES", 0))  # 每个 PDF 最多提取的页数，0 表示不限制
+PDF_MAX_CHARS = int(os.getenv("PDF_MAX_CHARS", 0))  # 每个 PDF 最多提取的字符数（达到后保留已提取的整页），0 表示不限制
+PDF_SCAN_CHECK_PAGES = int(os.getenv("PDF_SCAN_CHECK_PAGES", 3))  # 判断扫描件时检查的前几页
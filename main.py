@@ -1,10 +1,15 @@
 import logging
+import threading
 import uvicorn
 from fastapi import FastAPI
-from config import ENVIRONMENT, FILES_PATH
+from config import (ENVIRONMENT, FILES_PATH, FAISS_INDEX_PATH, FAISS_MMAP, INDEX_GRANULARITY,
+                    CHUNK_INDEX_PATH, SYNC_ON_STARTUP, SERVER_WORKERS)
 from logging_set_up import configure_logging
-from routes import query
-from utils.load import process_files_in_directory, FileIndexState
+from routes import documents, health, metrics, query
+from utils import readiness
+from utils.executor import shutdown_executor
+from utils.llm import close_llm_session
+from utils.sentence_model import warmup_model
 
 
 # 环境判断函数
@@ -23,11 +28,43 @@ def initialize():
     logger = logging.getLogger(__name__)
     logger.info(get_environment_log())
 
-    # 初始化索引
-    state = FileIndexState()
 
-    # 加载本地知识库
-    process_files_in_directory(state,FILES_PATH)
+def warm_up_components():
+    """
+    在后台依次预热模型、映射与索引，然后同步本地知识库
+
+    服务在预热完成前即可接收请求，/readyz 报告各组件是否就绪。
+    faiss、jieba、文档解析库等重量级依赖在此处或首次使用时才导入。
+    """
+    with readiness.track("model"):
+        # 预热嵌入模型（进程内只加载一次）
+        warmup_model()
+
+    with readiness.track("mappings"):
+        from utils.mapping_utils import load_mappings
+        load_mappings()
+
+    with readiness.track("index"):
+        from utils.faiss_utils import load_faiss_index
+        index_path = CHUNK_INDEX_PATH if INDEX_GRANULARITY == "chunk" else FAISS_INDEX_PATH
+        load_faiss_index(index_path=index_path, mmap=FAISS_MMAP)
+
+    if not SYNC_ON_STARTUP:
+        readiness.set_state("sync", "disabled")
+        return
+
+    from utils.faiss_utils import acquire_writer_lock
+    if not acquire_writer_lock():
+        # 多进程部署：其他进程负责同步与写入，本进程只读映射索引快照
+        readiness.set_state("sync", "standby", detail="index writer runs in another worker")
+        return
+
+    with readiness.track("sync"):
+        from utils.load import process_files_in_directory, FileIndexState
+
+        # 初始化索引并加载本地知识库
+        state = FileIndexState()
+        process_files_in_directory(state, FILES_PATH)
 
 
 
@@ -36,6 +73,22 @@ app = FastAPI()
 
 # 包含路由
 app.include_router(query.router, tags=["AI Querying"])
+app.include_router(documents.router, tags=["Documents"])
+app.include_router(health.router, tags=["Health"])
+app.include_router(metrics.router, tags=["Metrics"])
+
+
+# 服务进程启动时在后台预热（uvicorn reload 模式下服务运行在子进程中），不阻塞端口监听
+@app.on_event("startup")
+def warmup_on_startup():
+    threading.Thread(target=warm_up_components, name="startup-warmup", daemon=True).start()
+
+
+# 服务停止时释放连接池与线程池
+@app.on_event("shutdown")
+async def release_resources():
+    await close_llm_session()
+    shutdown_executor()
 
 
 # 首页测试路由
@@ -49,8 +102,11 @@ def main():
     # 初始化配置
     initialize()
 
-    # 启动 FastAPI 应用
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
+    # 启动 FastAPI 应用（多进程时热重载不可用）
+    if SERVER_WORKERS > 1:
+        uvicorn.run("main:app", host="0.0.0.0", port=8000, workers=SERVER_WORKERS)
+    else:
+        uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
 
 
 # 启动 FastAPI 应用
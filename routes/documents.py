@@ -0,0 +1,75 @@
+import logging
+import os
+from pathlib import Path
+
+from fastapi import APIRouter, HTTPException
+
+from config import FILES_PATH
+from utils.executor import run_write
+
+logger = logging.getLogger(__name__)
+router = APIRouter()
+
+
+def _get_state():
+    from utils.load import FileIndexState, IndexWriterBusy  # 延迟导入，加快服务启动
+    try:
+        return FileIndexState()
+    except IndexWriterBusy:
+        # 多进程部署时写操作只能由持有写入锁的进程执行
+        raise HTTPException(status_code=503, detail="Index writer runs in another worker process, retry later",
+                            headers={"Retry-After": "1"})
+
+
+def _resolve_library_path(path: str) -> str:
+    """只允许操作知识库目录下的文件"""
+    library = Path(FILES_PATH).resolve()
+    resolved = Path(path).resolve()
+    if resolved != library and library not in resolved.parents:
+        raise HTTPException(status_code=400, detail=f"Path must be inside {FILES_PATH}")
+    # 与目录同步使用相同的路径形式，保证映射与文件清单可以对应
+    return os.path.join(FILES_PATH, os.path.relpath(resolved, library))
+
+
+@router.delete("/documents/{md5}")
+async def delete_document(md5: str, remove_file: bool = False):
+    """
+    删除文档。remove_file=True 时同时删除知识库中的源文件，
+    否则源文件仍在目录中时下次同步会重新入库。
+    """
+    from utils.load import delete_document as delete
+
+    state = await run_write(_get_state)
+    result = await run_write(delete, state, md5)
+    if result["status"] == "not_found":
+        raise HTTPException(status_code=404, detail=f"Document not found: {md5}")
+
+    if remove_file and result.get("file"):
+        file_path = _resolve_library_path(result["file"])
+        if os.path.exists(file_path):
+            os.remove(file_path)
+            logger.info(f"Removed source file {file_path}")
+        result["file_removed"] = True
+    return result
+
+
+@router.post("/documents/update")
+async def update_document(path: str):
+    """重新入库单个文件：内容变化时替换旧版本，文件已删除时删除对应文档"""
+    from utils.load import update_document as update
+
+    file_path = _resolve_library_path(path)
+    state = await run_write(_get_state)
+    result = await run_write(update, state, file_path)
+    if result["status"] == "error":
+        raise HTTPException(status_code=500, detail=result.get("reason", "Update failed"))
+    return result
+
+
+@router.post("/documents/compact")
+async def compact_index():
+    """立即从索引中移除所有已删除文档的向量"""
+    from utils.load import compact_index as compact
+
+    state = await run_write(_get_state)
+    return await run_write(compact, state)
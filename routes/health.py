@@ -0,0 +1,28 @@
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+
+from utils import readiness
+
+router = APIRouter()
+
+
+@router.get("/healthz")
+async def healthz():
+    """存活检查：进程可以响应即返回 200，同时报告各组件预热状态"""
+    return {
+        "status": "ok",
+        "uptime_seconds": readiness.uptime_seconds(),
+        "components": readiness.snapshot()
+    }
+
+
+@router.get("/readyz")
+async def readyz():
+    """就绪检查：模型、映射与索引均已预热时返回 200，否则返回 503"""
+    ready = readiness.is_ready()
+    body = {
+        "status": "ready" if ready else "starting",
+        "uptime_seconds": readiness.uptime_seconds(),
+        "components": readiness.snapshot()
+    }
+    return JSONResponse(status_code=200 if ready else 503, content=body)
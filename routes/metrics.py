@@ -0,0 +1,14 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from utils.executor import run_blocking
+from utils.metrics import registry
+
+router = APIRouter()
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus 文本格式指标：查询各阶段耗时、缓存命中、入库结果、索引大小与内存"""
+    body = await run_blocking(registry.render)
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4; charset=utf-8")
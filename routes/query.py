@@ -1,58 +1,468 @@
+import asyncio
+import json
 import logging
 from fastapi import APIRouter, HTTPException
-from typing import List
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 import numpy as np
 import os
-import jieba
+import time
 
-from config import MAX_FILE_SIZE
-from utils.faiss_utils import load_faiss_index
-from utils.mapping_utils import load_mappings
-from utils.sentence_model import get_model, encode_text
-from utils.llm import call_llm, call_llm_query
+from config import (INDEX_GRANULARITY, FAISS_INDEX_PATH, CHUNK_INDEX_PATH, PASSAGE_CANDIDATE_FACTOR,
+                    FAISS_MMAP, HYBRID_SEARCH, BATCH_QUERY_MAX_SIZE, BATCH_LLM_CONCURRENCY)
+from utils.bm25_index import get_bm25_index, tokenize_terms, reciprocal_rank_fusion
+from utils.chunk_map import load_chunk_map
+from utils.context_builder import build_context, document_candidates, passage_candidates
+from utils.content_store import ContentStore
+from utils.executor import run_blocking
+from utils.mapping_utils import lookup_documents, lookup_paths, load_tombstones
+from utils.metrics import QUERY_SECONDS, QUERY_STAGE_SECONDS, stage_timer
+from utils.sentence_model import get_model, encode_texts
+from utils.llm import call_llm, call_llm_query, stream_llm
+from utils.answer_cache import answer_cache
+from utils.query_cache import keyword_cache, vector_cache, vector_cache_key, normalize_question
 from utils.text_processing import extract_file_content
 
+# faiss、jieba 等重量级依赖在首次使用时导入，缩短服务冷启动时间
+
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
 
 @router.post("/query")
-async def query(query: str,openApiKey:str, k: int = 5):
+async def query(query: str,openApiKey:str, k: int = 5,
+                nprobe: Optional[int] = None, ef_search: Optional[int] = None):
+    start = time.perf_counter()
+    status = "error"
     try:
-        # 将问题直接解析为相关联得关键词
-        keyword = call_llm_query(query,openApiKey)
-        file_id_map, file_path_map = load_mappings()
-        index = load_faiss_index()
-        logger.info(f"Loaded FAISS index with {index.ntotal} vectors")
-        model = get_model()
-
-        tokenized_query = " ".join(jieba.cut(keyword))
-        query_vector = encode_text(model, tokenized_query)
-        logger.debug(f"Generated query vector with shape: {query_vector.shape}")
-
-        query_array = np.array(query_vector, dtype=np.float32).reshape(1, -1)
-        distances, indices = index.search(query_array, k)  # 直接查询k个结果
-        logger.debug(f"Search results: indices={indices}, distances={distances}")
-
-        valid_docs = _filter_results(indices[0], distances[0], k, file_id_map, file_path_map)
-        documents_content = _load_documents_content(valid_docs)
-        answer = call_llm(query, documents_content[:MAX_FILE_SIZE],openApiKey) if documents_content else "No relevant documents found."
-        # answer =  ""
-
-        return {
-            "answer": answer,
-            "relevant_documents": valid_docs,
-            "distances": distances[0].tolist()
-        }
+        query_array, retrieval = await _prepare_query(query, openApiKey, k, nprobe, ef_search)
+        response = await _answer(query, openApiKey, query_array, retrieval)
+        status = "ok"
+        return response
+
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        logger.error(f"Query processing failed: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Internal server error")
+    finally:
+        QUERY_SECONDS.observe(time.perf_counter() - start, endpoint="query", status=status)
+
 
+@router.post("/query/stream")
+async def query_stream(query: str, openApiKey: str, k: int = 5,
+                       nprobe: Optional[int] = None, ef_search: Optional[int] = None):
+    """
+    流式问答（Server-Sent Events）：检索完成后立即推送 retrieval 事件，
+    随后逐段转发 LLM 生成的 token 事件，最后以 done 事件（附上下文组装统计）结束。
+    客户端断开时取消上游 LLM 请求。
+    """
+    start = time.perf_counter()
+    try:
+        query_array, retrieval = await _prepare_query(query, openApiKey, k, nprobe, ef_search)
     except HTTPException as e:
         raise e
     except Exception as e:
         logger.error(f"Query processing failed: {str(e)}", exc_info=True)
+        QUERY_SECONDS.observe(time.perf_counter() - start, endpoint="stream", status="error")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+    return StreamingResponse(
+        _stream_events(query, openApiKey, query_array, retrieval, start),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+class BatchQueryRequest(BaseModel):
+    questions: List[str]
+    openApiKey: str
+    k: int = 5
+    nprobe: Optional[int] = None
+    ef_search: Optional[int] = None
+
+
+@router.post("/query/batch")
+async def query_batch(request: BatchQueryRequest):
+    """
+    批量问答：所有问题一次编码、一次矩阵检索、批量点查映射，
+    LLM 调用（关键词扩展与回答）按 BATCH_LLM_CONCURRENCY 限制并发。
+    结果按输入顺序返回，单个问题失败不影响其他问题。
+    """
+    questions = request.questions
+    if not questions:
+        raise HTTPException(status_code=400, detail="questions must not be empty")
+    if len(questions) > BATCH_QUERY_MAX_SIZE:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_QUERY_MAX_SIZE} questions per batch")
+
+    start = time.perf_counter()
+    status = "error"
+    semaphore = asyncio.Semaphore(max(BATCH_LLM_CONCURRENCY, 1))
+
+    async def limited(coroutine):
+        async with semaphore:
+            return await coroutine
+
+    try:
+        results: List[Optional[dict]] = [None] * len(questions)
+        keywords = await asyncio.gather(*(limited(_expand_keywords(question, request.openApiKey))
+                                          for question in questions), return_exceptions=True)
+        valid = []
+        for i, keyword in enumerate(keywords):
+            if isinstance(keyword, Exception) or keyword.startswith("Error calling LLM"):
+                results[i] = _batch_error(i, questions[i], f"Keyword expansion failed: {keyword}")
+            else:
+                valid.append(i)
+
+        if valid:
+            query_matrix = await run_blocking(_encode_queries, [keywords[i] for i in valid])
+            texts = [f"{questions[i]} {keywords[i]}" for i in valid]
+            retrievals = await _retrieve(texts, query_matrix, request.k, request.nprobe, request.ef_search)
+            answers = await asyncio.gather(*(
+                limited(_answer(questions[i], request.openApiKey, query_matrix[row:row + 1], retrievals[row]))
+                for row, i in enumerate(valid)
+            ), return_exceptions=True)
+            for i, answer in zip(valid, answers):
+                if isinstance(answer, Exception):
+                    logger.error(f"Batch item {i} failed: {str(answer)}")
+                    results[i] = _batch_error(i, questions[i], str(answer))
+                elif answer["answer"].startswith("Error calling LLM"):
+                    results[i] = _batch_error(i, questions[i], answer["answer"])
+                else:
+                    results[i] = {"index": i, "question": questions[i], "status": "ok", **answer}
+
+        failed = sum(1 for result in results if result["status"] == "error")
+        status = "ok"
+        return {"results": results, "succeeded": len(results) - failed, "failed": failed}
+
+    except Exception as e:
+        logger.error(f"Batch query processing failed: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail="Internal server error")
+    finally:
+        QUERY_SECONDS.observe(time.perf_counter() - start, endpoint="batch", status=status)
+
+
+def _batch_error(index: int, question: str, detail: str) -> dict:
+    return {"index": index, "question": question, "status": "error", "detail": detail}
+
+
+async def _stream_events(query: str, openApiKey: str, query_array: np.ndarray, retrieval: dict,
+                         start: float) -> AsyncIterator[str]:
+    """生成 SSE 事件流"""
+    status = "error"
+    try:
+        yield _sse_event("retrieval", _retrieval_response(retrieval))
+
+        answer = answer_cache.lookup(query_array, retrieval["md5s"]) if retrieval["md5s"] else None
+        context_report = None
+        if answer is not None:
+            yield _sse_event("answer", {"answer": answer, "answer_cached": True})
+        else:
+            context, context_report = await _load_context(retrieval)
+            if not context:
+                yield _sse_event("answer", {"answer": "No relevant documents found.", "answer_cached": False})
+            else:
+                parts = []
+                llm_start = time.perf_counter()
+                with stage_timer("answer_llm"):
+                    async for delta in stream_llm(query, context, openApiKey):
+                        if not parts:
+                            QUERY_STAGE_SECONDS.observe(time.perf_counter() - llm_start, stage="answer_llm_first_token")
+                        parts.append(delta)
+                        yield _sse_event("token", {"text": delta})
+                _remember_answer(query_array, retrieval["md5s"], "".join(parts).strip())
+
+        yield _sse_event("done", {"context": context_report})
+        status = "ok"
+    except asyncio.CancelledError:
+        # 客户端断开：StreamingResponse 取消本生成器，上游响应随 stream_llm 退出而关闭
+        status = "disconnected"
+        logger.info(f"Client disconnected during streaming query: {query}")
+        raise
+    except Exception as e:
+        logger.error(f"Streaming query failed: {str(e)}", exc_info=True)
+        yield _sse_event("error", {"detail": f"Error calling LLM: {str(e)}"})
+    finally:
+        QUERY_SECONDS.observe(time.perf_counter() - start, endpoint="stream", status=status)
+
+
+def _sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def _prepare_query(query: str, openApiKey: str, k: int,
+                         nprobe: Optional[int] = None, ef_search: Optional[int] = None) -> Tuple[np.ndarray, dict]:
+    """关键词扩展、编码与检索，返回 (查询向量, 检索结果)"""
+    # 将问题直接解析为相关联得关键词
+    keyword = await _expand_keywords(query, openApiKey)
+
+    # 分词、编码与检索均为 CPU 密集操作，放入线程池执行
+    query_array = await run_blocking(_encode_query, keyword)
+    retrievals = await _retrieve([f"{query} {keyword}"], query_array, k, nprobe, ef_search)
+    return query_array, retrievals[0]
+
+
+async def _answer(query: str, openApiKey: str, query_array: np.ndarray, retrieval: dict) -> dict:
+    """根据检索结果生成答案（优先复用语义缓存），返回响应内容"""
+    # 相同文档集合下的相似问题直接复用答案
+    answer = answer_cache.lookup(query_array, retrieval["md5s"]) if retrieval["md5s"] else None
+    answer_cached = answer is not None
+    context_report = None
+    if not answer_cached:
+        context, context_report = await _load_context(retrieval)
+        with stage_timer("answer_llm"):
+            answer = await call_llm(query, context, openApiKey) if context else "No relevant documents found."
+        _remember_answer(query_array, retrieval["md5s"], answer)
+
+    return {"answer": answer, "answer_cached": answer_cached, **_retrieval_response(retrieval),
+            "context": context_report}
+
+
+async def _retrieve(texts: List[str], query_matrix: np.ndarray, k: int,
+                    nprobe: Optional[int] = None, ef_search: Optional[int] = None) -> List[dict]:
+    """
+    检索一个或多个查询：一次矩阵检索，映射按所有查询的命中ID批量点查
+    :param texts: 每个查询的 "问题 关键词"，用于关键词检索与上下文排序
+    :return: 与 texts 顺序一致的检索结果
+    """
+    if INDEX_GRANULARITY == "chunk":
+        retrievals = await _retrieve_passages(texts, query_matrix, k, nprobe, ef_search)
+    else:
+        retrievals = await _retrieve_documents(texts, query_matrix, k, nprobe, ef_search)
+    for retrieval, text in zip(retrievals, texts):
+        # 组装上下文时用于给文档窗口排序
+        retrieval["query_text"] = text
+    return retrievals
+
+
+async def _retrieve_documents(texts: List[str], query_matrix: np.ndarray, k: int,
+                              nprobe: Optional[int] = None, ef_search: Optional[int] = None) -> List[dict]:
+    """文档级检索：返回每个查询的命中文档"""
+    rows = await run_blocking(_search_index, query_matrix, k, None, nprobe, ef_search)  # 直接查询k个结果
+    if HYBRID_SEARCH:
+        rows = await run_blocking(_fuse_lexical_rows, texts, rows, k)
+
+    # 只点查命中ID的映射，无需加载全部映射
+    with stage_timer("mapping_lookup"):
+        ids = list(dict.fromkeys(int(i) for _, indices in rows for i in indices if i >= 0))
+        file_id_map, file_path_map = await run_blocking(lookup_documents, ids)
+        hits_rows = [await run_blocking(_filter_results, indices, distances, k, file_id_map, file_path_map)
+                     for distances, indices in rows]
+
+    return [{
+        "hits": hits,
+        "md5s": [md5 for md5, _ in hits],
+        "relevant_documents": [path for _, path in hits],
+        "distances": distances.tolist()
+    } for hits, (distances, _) in zip(hits_rows, rows)]
 
 
-def _filter_results(indices, distances, k, file_id_map, file_path_map) -> List[str]:
+async def _expand_keywords(query: str, openApiKey: str) -> str:
+    """将问题解析为关键词，相同问题命中缓存时跳过 LLM 调用"""
+    cache_key = normalize_question(query)
+    keyword = keyword_cache.get(cache_key)
+    if keyword is not None:
+        logger.debug(f"Keyword cache hit: {cache_key}")
+        return keyword
+
+    with stage_timer("keyword_llm"):
+        keyword = await call_llm_query(query, openApiKey)
+    if not keyword.startswith("Error calling LLM"):  # 不缓存失败结果
+        keyword_cache.put(cache_key, keyword)
+    return keyword
+
+
+def _encode_query(keyword: str) -> np.ndarray:
+    """对关键词分词并编码为 (1, d) 查询向量，命中缓存时跳过模型计算"""
+    return _encode_queries([keyword])
+
+
+def _encode_queries(keywords: List[str]) -> np.ndarray:
+    """批量编码为 (n, d) 查询矩阵：命中缓存的直接复用，其余一次 encode_texts 调用完成"""
+    rows: List[Optional[np.ndarray]] = []
+    missing: Dict[str, List[int]] = {}
+    for i, keyword in enumerate(keywords):
+        cached = vector_cache.get(vector_cache_key(keyword))
+        rows.append(cached)
+        if cached is None:
+            missing.setdefault(keyword, []).append(i)
+
+    if missing:
+        with stage_timer("tokenize"):
+            import jieba
+            tokenized = [" ".join(jieba.cut(keyword)) for keyword in missing]
+
+        with stage_timer("encode"):
+            vectors = np.asarray(encode_texts(get_model(), tokenized), dtype=np.float32)
+        logger.debug(f"Generated {len(vectors)} query vectors with shape: {vectors.shape}")
+        for (keyword, positions), vector in zip(missing.items(), vectors):
+            query_array = vector.reshape(1, -1)
+            vector_cache.put(vector_cache_key(keyword), query_array)
+            for i in positions:
+                rows[i] = query_array
+    return np.vstack(rows)
+
+
+def _search_index(query_array: np.ndarray, k: int, index_path: str = None,
+                  nprobe: Optional[int] = None, ef_search: Optional[int] = None) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """
+    加载（缓存的）FAISS 索引并检索，可按请求指定 nprobe / efSearch
+
+    query_array 为 (n, d) 查询矩阵，一次 index.search 完成全部查询，返回每个查询的 (distances, ids)。
+    已删除但尚未压缩的向量（墓碑）不计入 top-k：按墓碑数量多取候选后过滤。
+    """
+    from utils.faiss_utils import load_faiss_index
+    from utils.index_factory import build_search_params
+
+    with stage_timer("index_load"):
+        index = load_faiss_index(index_path=index_path or FAISS_INDEX_PATH, mmap=FAISS_MMAP)
+    logger.info(f"Loaded FAISS index with {index.ntotal} vectors")
+    tombstones = load_tombstones(INDEX_GRANULARITY)
+    fetch_k = k + len(tombstones)
+
+    params = build_search_params(index, nprobe, ef_search)
+    with stage_timer("search"):
+        if params is not None:
+            distances, indices = index.search(query_array, fetch_k, params=params)
+        else:
+            distances, indices = index.search(query_array, fetch_k)
+
+    rows = []
+    for row_distances, row_indices in zip(distances, indices):
+        if tombstones:
+            live = [i for i, doc_id in enumerate(row_indices) if doc_id not in tombstones][:k]
+            row_distances, row_indices = row_distances[live], row_indices[live]
+        rows.append((row_distances, row_indices))
+    logger.debug(f"Search results: {rows}")
+    return rows
+
+
+def _fuse_lexical_rows(texts: List[str], rows: List[Tuple[np.ndarray, np.ndarray]],
+                      k: int) -> List[Tuple[np.ndarray, np.ndarray]]:
+    return [_fuse_lexical(text, distances, indices, k) for text, (distances, indices) in zip(texts, rows)]
+
+
+def _fuse_lexical(text: str, distances: np.ndarray, indices: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    混合检索：BM25 关键词检索结果与单个查询的向量检索结果按倒数排名融合（RRF）
+
+    返回与输入形式相同的 (scores, ids)，scores 为融合得分（越大越相关）。
+    """
+    with stage_timer("lexical"):
+        lexical = get_bm25_index(INDEX_GRANULARITY)
+        tombstones = load_tombstones(INDEX_GRANULARITY)
+        lexical_ids = [doc_id for doc_id, _ in lexical.search(tokenize_terms(text), k + len(tombstones))
+                       if doc_id not in tombstones][:k]
+    vector_ids = [int(doc_id) for doc_id, distance in zip(indices, distances) if doc_id >= 0 and distance >= 0]
+    fused = reciprocal_rank_fusion([vector_ids, lexical_ids])[:k]
+    logger.debug(f"Hybrid retrieval: {len(vector_ids)} vector hits, {len(lexical_ids)} lexical hits")
+
+    scores = np.array([score for _, score in fused], dtype=np.float32)
+    ids = np.array([doc_id for doc_id, _ in fused], dtype=np.int64)
+    return scores, ids
+
+
+async def _retrieve_passages(texts: List[str], query_matrix: np.ndarray, k: int,
+                             nprobe: Optional[int] = None, ef_search: Optional[int] = None) -> List[dict]:
+    """块级检索：返回每个查询最相关的文本段落及其所属文档"""
+    candidates = k * PASSAGE_CANDIDATE_FACTOR
+    rows = await run_blocking(_search_index, query_matrix, candidates, CHUNK_INDEX_PATH, nprobe, ef_search)
+    if HYBRID_SEARCH:
+        rows = await run_blocking(_fuse_lexical_rows, texts, rows, candidates)
+    with stage_timer("mapping_lookup"):
+        chunk_map = await run_blocking(load_chunk_map)
+        md5s = list(dict.fromkeys(md5 for _, indices in rows for md5 in _chunk_md5s(indices, chunk_map)))
+        file_path_map = await run_blocking(lookup_paths, md5s)
+
+    retrievals = []
+    with stage_timer("content"):
+        for distances, indices in rows:
+            passages = await run_blocking(_collect_passages, indices, distances, k, chunk_map, file_path_map)
+            retrievals.append({
+                "md5s": [passage["md5"] for passage in passages],
+                "relevant_documents": list(dict.fromkeys(passage["file"] for passage in passages)),
+                "passages": passages,
+                "distances": [passage["score"] for passage in passages]
+            })
+    return retrievals
+
+
+async def _load_context(retrieval: dict) -> Tuple[List[str], dict]:
+    """
+    在 token 预算内组装送入 LLM 的上下文，返回 (上下文段落, 组装统计)
+
+    块级检索直接使用命中段落；文档级检索将命中文档切分为窗口后按相关性排序。
+    """
+    if "passages" in retrieval:
+        with stage_timer("context"):
+            return await run_blocking(build_context, passage_candidates(retrieval["passages"]))
+
+    with stage_timer("content"):
+        documents = await run_blocking(_load_documents, retrieval["hits"])
+    with stage_timer("context"):
+        candidates = await run_blocking(document_candidates, documents, retrieval["query_text"])
+        return await run_blocking(build_context, candidates)
+
+
+def _retrieval_response(retrieval: dict) -> dict:
+    """检索结果中返回给客户端的字段"""
+    response = {"relevant_documents": retrieval["relevant_documents"]}
+    if "passages" in retrieval:
+        response["passages"] = retrieval["passages"]
+    response["distances"] = retrieval["distances"]
+    response["retrieval"] = "hybrid" if HYBRID_SEARCH else "vector"
+    return response
+
+
+def _remember_answer(query_array: np.ndarray, md5s: List[str], answer: str):
+    """缓存成功生成的答案（不缓存失败与无结果的情况）"""
+    if md5s and not answer.startswith("Error calling LLM"):
+        answer_cache.store(query_array, md5s, answer)
+
+
+def _chunk_md5s(indices, chunk_map) -> List[str]:
+    """取出检索命中的文本块所属文档MD5"""
+    return [entry[0] for entry in (chunk_map.lookup(int(i)) for i in indices if i >= 0) if entry]
+
+
+def _collect_passages(indices, distances, k, chunk_map, file_path_map) -> List[dict]:
+    """将块级检索结果映射为段落，同一请求内每个文档只读取一次"""
+    passages = []
+    contents: Dict[str, str] = {}
+    for chunk_id, distance in zip(indices, distances):
+        if chunk_id < 0 or distance < 0:
+            continue
+
+        entry = chunk_map.lookup(int(chunk_id))
+        if entry is None:
+            logger.warning(f"Invalid chunk ID: {chunk_id}")
+            continue
+        md5, offset, length = entry
+
+        path = file_path_map.get(md5)
+        if not path or not os.path.exists(path):
+            logger.warning(f"File not found for chunk {chunk_id}: {path}")
+            continue
+
+        if md5 not in contents:
+            contents[md5] = _get_document_content(md5, path)
+        passages.append({
+            "file": path,
+            "md5": md5,
+            "chunk_id": int(chunk_id),
+            "offset": offset,
+            "length": length,
+            "score": float(distance),
+            "text": contents[md5][offset:offset + length]
+        })
+        if len(passages) >= k:
+            break
+    return passages
+
+
+def _filter_results(indices, distances, k, file_id_map, file_path_map) -> List[Tuple[str, str]]:
+    """过滤检索结果，返回 (md5, 文件路径) 列表"""
     valid_docs = []
     for doc_id, distance in zip(indices, distances):
         if distance < 0:
@@ -61,7 +471,7 @@ def _filter_results(indices, distances, k, file_id_map, file_path_map) -> List[s
         logger.debug(f"Checking doc {doc_id} with distance {distance}")
         if (md5 := file_id_map.get(int(doc_id))) and (path := file_path_map.get(md5)):
             if os.path.exists(path):
-                valid_docs.append(path)
+                valid_docs.append((md5, path))
                 if len(valid_docs) >= k:  # 关键优化点2：提前终止循环
                     break
             else:
@@ -71,5 +481,23 @@ def _filter_results(indices, distances, k, file_id_map, file_path_map) -> List[s
     return valid_docs
 
 
-def _load_documents_content(file_paths: List[str]) -> List[str]:
-    return [extract_file_content(path) for path in file_paths if os.path.exists(path)]
\ No newline at end of file
+def _load_documents(hits: List[Tuple[str, str]]) -> List[Tuple[str, str]]:
+    """按检索排名读取命中文档，返回 (md5, 文档全文)"""
+    return [(md5, _get_document_content(md5, path)) for md5, path in hits if os.path.exists(path)]
+
+
+def _get_document_content(md5: str, path: str) -> str:
+    """优先从文本存储读取，缺失时回退到解析原始文件并回填"""
+    from utils.load import calculate_md5_from_text
+
+    content_store = ContentStore()
+    content = content_store.get(md5)
+    if content is None:
+        logger.info(f"Content store miss for {md5}, extracting {path}")
+        content = extract_file_content(path)
+        # 文件在入库后被修改时内容与MD5不再对应，不回填
+        if calculate_md5_from_text(content) == md5:
+            content_store.put(md5, content)
+        else:
+            logger.warning(f"File changed since ingestion: {path}")
+    return content
\ No newline at end of file
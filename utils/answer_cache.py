@@ -0,0 +1,125 @@
+import itertools
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Set
+
+import numpy as np
+
+from config import ANSWER_CACHE_THRESHOLD, ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL
+
+# 获取日志记录器
+logger = logging.getLogger(__name__)
+
+
+class SemanticAnswerCache:
+    """
+    语义答案缓存
+
+    命中条件：检索到的文档MD5集合完全相同，且查询向量余弦相似度不低于阈值。
+    文档被重新入库或删除时，按MD5反向索引使相关答案失效。
+    """
+
+    def __init__(self, threshold: float = ANSWER_CACHE_THRESHOLD,
+                 max_entries: int = ANSWER_CACHE_SIZE, ttl: float = ANSWER_CACHE_TTL):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._ids = itertools.count()
+        self._entries: "OrderedDict[int, dict]" = OrderedDict()
+        self._by_docs: Dict[frozenset, Set[int]] = {}
+        self._by_md5: Dict[str, Set[int]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def lookup(self, query_vector: np.ndarray, md5s: Iterable[str]) -> Optional[str]:
+        """查找相同文档集合下语义相近问题的答案"""
+        doc_key = frozenset(md5s)
+        query = _normalize(query_vector)
+        now = time.time()
+
+        with self._lock:
+            candidates = [entry_id for entry_id in self._by_docs.get(doc_key, ())
+                          if self._entries[entry_id]["expires_at"] > now]
+            if candidates:
+                vectors = np.vstack([self._entries[entry_id]["vector"] for entry_id in candidates])
+                similarities = vectors @ query
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    entry_id = candidates[best]
+                    self._entries.move_to_end(entry_id)
+                    self.hits += 1
+                    logger.debug(f"Answer cache hit (similarity={similarities[best]:.4f})")
+                    return self._entries[entry_id]["answer"]
+            self.misses += 1
+        return None
+
+    def store(self, query_vector: np.ndarray, md5s: Iterable[str], answer: str):
+        """缓存答案"""
+        doc_key = frozenset(md5s)
+        with self._lock:
+            entry_id = next(self._ids)
+            self._entries[entry_id] = {
+                "vector": _normalize(query_vector),
+                "docs": doc_key,
+                "answer": answer,
+                "expires_at": time.time() + self.ttl
+            }
+            self._by_docs.setdefault(doc_key, set()).add(entry_id)
+            for md5 in doc_key:
+                self._by_md5.setdefault(md5, set()).add(entry_id)
+
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate_documents(self, md5s: Iterable[str]) -> int:
+        """使引用了任一给定文档的答案失效，返回失效条目数"""
+        removed = 0
+        with self._lock:
+            for md5 in md5s:
+                for entry_id in list(self._by_md5.get(md5, ())):
+                    self._remove(entry_id)
+                    removed += 1
+            self.invalidations += removed
+        if removed:
+            logger.info(f"Answer cache invalidated {removed} entries")
+        return removed
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+    def _remove(self, entry_id: int):
+        entry = self._entries.pop(entry_id, None)
+        if entry is None:
+            return
+        doc_ids = self._by_docs.get(entry["docs"])
+        if doc_ids is not None:
+            doc_ids.discard(entry_id)
+            if not doc_ids:
+                del self._by_docs[entry["docs"]]
+        for md5 in entry["docs"]:
+            md5_ids = self._by_md5.get(md5)
+            if md5_ids is not None:
+                md5_ids.discard(entry_id)
+                if not md5_ids:
+                    del self._by_md5[md5]
+
+
+def _normalize(vector: np.ndarray) -> np.ndarray:
+    vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+# 进程内共享的答案缓存
+answer_cache = SemanticAnswerCache()
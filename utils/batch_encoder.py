@@ -0,0 +1,162 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import List
+
+import jieba
+import numpy as np
+
+from config import EMBED_BATCH_SIZE, EMBED_MAX_WAIT
+from utils.sentence_model import get_model, encode_texts
+
+# 获取日志记录器
+logger = logging.getLogger(__name__)
+
+# 停止信号
+_STOP = object()
+
+
+def tokenize_for_model(text: str) -> str:
+    """对中文文本进行分词，作为模型输入"""
+    return " ".join(jieba.cut(text))
+
+
+def l2_normalize(vectors: np.ndarray) -> np.ndarray:
+    """对整个矩阵按行进行 L2 归一化（向量化实现）"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors.reshape(1, -1)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0  # 避免零向量除零
+    return vectors / norms
+
+
+def encode_chunks(chunks: List[str], batch_size: int = EMBED_BATCH_SIZE) -> np.ndarray:
+    """
+    批量编码文本块并进行 L2 归一化
+
+    参数：
+    - chunks: 文本块列表
+    - batch_size: 每次送入模型的文本块数量
+
+    返回：
+    - 形状为 (len(chunks), d) 的 float32 矩阵
+    """
+    model = get_model()
+    tokenized = [tokenize_for_model(chunk) for chunk in chunks]
+    batches = [
+        np.asarray(encode_texts(model, tokenized[i:i + batch_size]), dtype=np.float32)
+        for i in range(0, len(tokenized), batch_size)
+    ]
+    return l2_normalize(np.vstack(batches))
+
+
+class _EmbeddingJob:
+    """单个文档的编码任务，收齐所有块后完成 Future"""
+
+    def __init__(self, future: Future, size: int):
+        self.future = future
+        self.rows: List[np.ndarray] = [None] * size
+        self.remaining = size
+
+    def fill(self, position: int, vector: np.ndarray):
+        self.rows[position] = vector
+        self.remaining -= 1
+        if self.remaining == 0 and not self.future.done():
+            self.future.set_result(np.vstack(self.rows))
+
+
+class ChunkEmbeddingBatcher:
+    """
+    跨文档微批处理编码器
+
+    多个文档提交的文本块在后台线程中合并为固定大小的批次，
+    每个批次只调用一次 encode_texts。批次凑满 batch_size 或
+    等待超过 max_wait 秒后立即编码。
+    """
+
+    def __init__(self, batch_size: int = EMBED_BATCH_SIZE, max_wait: float = EMBED_MAX_WAIT):
+        if batch_size < 1:
+            raise ValueError("batch_size must be >= 1")
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self._queue: queue.Queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="chunk-embedding-batcher", daemon=True)
+        self._closed = False
+        self.batches = 0
+        self.chunks = 0
+        self.busy_seconds = 0.0
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def submit(self, chunks: List[str]) -> Future:
+        """提交一个文档的所有文本块，返回结果为归一化矩阵的 Future"""
+        if self._closed:
+            raise RuntimeError("Batcher is closed")
+
+        future = Future()
+        if not chunks:
+            future.set_exception(ValueError("No chunks to encode"))
+            return future
+
+        job = _EmbeddingJob(future, len(chunks))
+        for position, chunk in enumerate(chunks):
+            self._queue.put((job, position, chunk))
+        return future
+
+    def close(self):
+        """处理完队列中剩余的文本块后停止后台线程"""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+
+            batch = [item]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=max(remaining, 0)) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            self._encode_batch(batch)
+
+    def _encode_batch(self, batch: list):
+        start = time.perf_counter()
+        try:
+            vectors = encode_chunks([chunk for _, _, chunk in batch], batch_size=self.batch_size)
+        except Exception as e:
+            logger.error(f"Batch encoding failed ({len(batch)} chunks): {str(e)}", exc_info=True)
+            for job, _, _ in batch:
+                if not job.future.done():
+                    job.future.set_exception(e)
+            return
+        finally:
+            self.busy_seconds += time.perf_counter() - start
+
+        self.batches += 1
+        self.chunks += len(batch)
+        for (job, position, _), vector in zip(batch, vectors):
+            if not job.future.done():
+                job.fill(position, vector)
+        logger.debug(f"Encoded batch of {len(batch)} chunks")
@@ -0,0 +1,408 @@
+import logging
+import math
+import re
+import sqlite3
+import threading
+import zlib
+from collections import Counter, OrderedDict
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from config import BM25_INDEX_PATH, BM25_K1, BM25_B, BM25_CACHE_MAX_BYTES, RRF_K
+
+# 获取日志记录器
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS postings (
+    scope TEXT NOT NULL,
+    term TEXT NOT NULL,
+    df INTEGER NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (scope, term)
+);
+CREATE TABLE IF NOT EXISTS doc_lengths (
+    scope TEXT NOT NULL,
+    id INTEGER NOT NULL,
+    length INTEGER NOT NULL,
+    PRIMARY KEY (scope, id)
+);
+CREATE TABLE IF NOT EXISTS doc_terms (
+    scope TEXT NOT NULL,
+    id INTEGER NOT NULL,
+    terms BLOB NOT NULL,
+    PRIMARY KEY (scope, id)
+);
+CREATE TABLE IF NOT EXISTS stats (
+    scope TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value INTEGER NOT NULL,
+    PRIMARY KEY (scope, key)
+);
+"""
+
+# 只保留包含字母、数字或汉字的词，过滤空白与标点
+_TERM_PATTERN = re.compile(r'\w')
+# SQLite 单条语句的参数数量上限较低，批量查询时分段
+_QUERY_BATCH = 500
+# 词频上限（postings 中以 uint16 存储）
+_MAX_TF = 65535
+
+_indexes: Dict[Tuple[str, str], "BM25Index"] = {}
+_indexes_lock = threading.Lock()
+
+
+def tokenize_terms(text: str) -> Dict[str, int]:
+    """使用与模型输入相同的 jieba 分词，返回 词 -> 词频"""
+    import jieba  # 延迟导入，加快服务启动
+
+    return dict(Counter(token.lower() for token in jieba.cut(text) if _TERM_PATTERN.search(token)))
+
+
+def encode_postings(ids: np.ndarray, tfs: np.ndarray) -> bytes:
+    """倒排列表编码：ID 差值（uint32）+ 词频（uint16），整体 deflate 压缩"""
+    deltas = np.diff(np.asarray(ids, dtype=np.int64), prepend=0).astype('<u4')
+    tfs = np.minimum(np.asarray(tfs, dtype=np.int64), _MAX_TF).astype('<u2')
+    return zlib.compress(deltas.tobytes() + tfs.tobytes(), 1)
+
+
+def decode_postings(data: bytes) -> Tuple[np.ndarray, np.ndarray]:
+    """倒排列表解码，返回 (升序ID, 词频)"""
+    raw = zlib.decompress(data)
+    count = len(raw) // 6
+    ids = np.cumsum(np.frombuffer(raw, dtype='<u4', count=count), dtype=np.int64)
+    tfs = np.frombuffer(raw, dtype='<u2', offset=count * 4, count=count).astype(np.float32)
+    return ids, tfs
+
+
+def _encode_terms(terms: Sequence[str]) -> bytes:
+    """文档词表编码：换行分隔（分词结果不含空白），deflate 压缩"""
+    return zlib.compress("\n".join(terms).encode("utf-8"), 1)
+
+
+def _decode_terms(data: bytes) -> List[str]:
+    text = zlib.decompress(data).decode("utf-8")
+    return text.split("\n") if text else []
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[int]], k: int = RRF_K) -> List[Tuple[int, float]]:
+    """倒数排名融合：score(id) = Σ 1 / (k + rank)，返回按融合得分降序的 (id, score)"""
+    scores: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, 1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+class BM25Index:
+    """
+    磁盘倒排索引（SQLite，WAL 模式），按 BM25 打分
+
+    - postings:    (scope, 词) -> 文档频率 + 压缩倒排列表
+    - doc_lengths: (scope, 向量ID) -> 文档词数
+    - doc_terms:   (scope, 向量ID) -> 文档包含的词（删除文档时只改写这些词的倒排列表）
+    - stats:       文档总数、总词数、已落盘的最大ID、回填标记
+
+    scope 与向量索引粒度一致（document / chunk），倒排列表中的ID即向量ID，
+    可以直接与 FAISS 检索结果融合。入库时新增文档先缓存在内存，
+    由组提交检查点统一落盘；查询时解码后的倒排列表按字节预算 LRU 缓存。
+    """
+
+    def __init__(self, scope: str, db_path: str = BM25_INDEX_PATH,
+                 cache_max_bytes: int = BM25_CACHE_MAX_BYTES):
+        self.scope = scope
+        self.db_path = db_path
+        self.cache_max_bytes = cache_max_bytes
+        self._local = threading.local()
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        with self._connection() as conn:
+            conn.executescript(_SCHEMA)
+
+        # 写入缓冲：词 -> [(ID, 词频)]，文档长度 -> [(ID, 长度)]，文档词表 -> [(ID, 词列表)]
+        self._pending_postings: Dict[str, List[Tuple[int, int]]] = {}
+        self._pending_lengths: List[Tuple[int, int]] = []
+        self._pending_terms: List[Tuple[int, List[str]]] = []
+        self._write_lock = threading.Lock()
+        # 倒排列表"读取-合并-写回"的互斥（落盘与删除文档之间），不依赖调用方的状态锁
+        self._merge_lock = threading.Lock()
+
+        # 查询侧缓存
+        self._cache: "OrderedDict[str, tuple]" = OrderedDict()
+        self._cache_bytes = 0
+        self._cache_lock = threading.Lock()
+        self._version: Optional[int] = None
+        self._lengths = np.zeros(0, dtype=np.float32)
+        self._lengths_max_id = -1
+        self._doc_count = 0
+        self._avg_length = 0.0
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _stat(self, key: str) -> int:
+        row = self._connection().execute("SELECT value FROM stats WHERE scope = ? AND key = ?",
+                                         (self.scope, key)).fetchone()
+        return row[0] if row else 0
+
+    def max_id(self) -> int:
+        """已落盘的最大ID（未入库时为 -1）"""
+        return self._stat('max_id') - 1
+
+    def doc_count(self) -> int:
+        return self._stat('doc_count')
+
+    def is_backfilled(self) -> bool:
+        """是否已从存量文档回填过（即使没有可回填的内容也会记录）"""
+        return self._stat('backfilled') > 0
+
+    def mark_backfilled(self):
+        conn = self._connection()
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO stats (scope, key, value) VALUES (?, 'backfilled', 1)",
+                         (self.scope,))
+
+    # ---------- 写入 ----------
+
+    def add(self, ids: Sequence[int], term_counts: Sequence[Dict[str, int]]):
+        """缓存新增文档的词频（ids 与 term_counts 一一对应，ID 需递增）"""
+        flushed_max = self.max_id()
+        with self._write_lock:
+            for doc_id, counts in zip(ids, term_counts):
+                doc_id = int(doc_id)
+                if doc_id <= flushed_max:
+                    # 检查点后崩溃回放的文档已经落盘
+                    continue
+                for term, tf in counts.items():
+                    self._pending_postings.setdefault(term, []).append((doc_id, tf))
+                self._pending_lengths.append((doc_id, sum(counts.values())))
+                self._pending_terms.append((doc_id, list(counts)))
+
+    def flush(self):
+        """将缓冲的倒排列表合并写入磁盘（由检查点调用）"""
+        with self._write_lock:
+            postings, self._pending_postings = self._pending_postings, {}
+            lengths, self._pending_lengths = self._pending_lengths, []
+            doc_terms, self._pending_terms = self._pending_terms, []
+        if not lengths:
+            return
+        with self._merge_lock:
+            self._flush_locked(postings, lengths, doc_terms)
+
+    def _flush_locked(self, postings: Dict[str, List[Tuple[int, int]]], lengths: List[Tuple[int, int]],
+                      doc_terms: List[Tuple[int, List[str]]]):
+        conn = self._connection()
+        existing = dict(self._select_postings(list(postings)))
+
+        rows = []
+        for term, entries in postings.items():
+            new_ids = np.array([doc_id for doc_id, _ in entries], dtype=np.int64)
+            new_tfs = np.array([tf for _, tf in entries], dtype=np.int64)
+            if term in existing:
+                old_ids, old_tfs = decode_postings(existing[term])
+                new_ids = np.concatenate([old_ids, new_ids])
+                new_tfs = np.concatenate([old_tfs.astype(np.int64), new_tfs])
+            rows.append((self.scope, term, len(new_ids), encode_postings(new_ids, new_tfs)))
+
+        with conn:
+            conn.executemany("INSERT OR REPLACE INTO postings (scope, term, df, data) VALUES (?, ?, ?, ?)", rows)
+            conn.executemany("INSERT OR REPLACE INTO doc_lengths (scope, id, length) VALUES (?, ?, ?)",
+                             [(self.scope, doc_id, length) for doc_id, length in lengths])
+            conn.executemany("INSERT OR REPLACE INTO doc_terms (scope, id, terms) VALUES (?, ?, ?)",
+                             [(self.scope, doc_id, _encode_terms(terms)) for doc_id, terms in doc_terms])
+            self._bump_stats(conn, doc_count=len(lengths), total_length=sum(length for _, length in lengths))
+            conn.execute("INSERT INTO stats (scope, key, value) VALUES (?, 'max_id', ?) "
+                         "ON CONFLICT (scope, key) DO UPDATE SET value = MAX(value, excluded.value)",
+                         (self.scope, max(doc_id for doc_id, _ in lengths) + 1))
+        logger.info(f"BM25 index flushed {len(lengths)} documents ({len(rows)} terms)")
+
+    def remove_documents(self, ids: Iterable[int]) -> int:
+        """
+        从倒排列表中移除给定ID（索引压缩时调用）
+
+        按 doc_terms 只改写被删除文档包含的词，开销与删除文档的词数成正比；
+        早于 doc_terms 入库、没有词表记录的文档回退为扫描全部倒排列表。
+        """
+        ids = np.asarray(sorted(set(int(i) for i in ids)), dtype=np.int64)
+        if len(ids) == 0:
+            return 0
+        with self._merge_lock:
+            return self._remove_documents_locked(ids)
+
+    def _remove_documents_locked(self, ids: np.ndarray) -> int:
+        conn = self._connection()
+        removed_lengths = list(self._select_lengths(ids.tolist()))
+        doc_terms = dict(self._select_doc_terms(ids.tolist()))
+        if any(doc_id not in doc_terms for doc_id, _ in removed_lengths):
+            postings = conn.execute("SELECT term, data FROM postings WHERE scope = ?", (self.scope,))
+        else:
+            postings = self._select_postings(sorted(set(term for terms in doc_terms.values() for term in terms)))
+
+        updates, deletes = [], []
+        for term, data in postings:
+            term_ids, tfs = decode_postings(data)
+            keep = ~np.isin(term_ids, ids)
+            if keep.all():
+                continue
+            if keep.any():
+                updates.append((int(keep.sum()), encode_postings(term_ids[keep], tfs[keep]), self.scope, term))
+            else:
+                deletes.append((self.scope, term))
+
+        with conn:
+            conn.executemany("UPDATE postings SET df = ?, data = ? WHERE scope = ? AND term = ?", updates)
+            conn.executemany("DELETE FROM postings WHERE scope = ? AND term = ?", deletes)
+            conn.executemany("DELETE FROM doc_lengths WHERE scope = ? AND id = ?",
+                             [(self.scope, doc_id) for doc_id, _ in removed_lengths])
+            conn.executemany("DELETE FROM doc_terms WHERE scope = ? AND id = ?",
+                             [(self.scope, doc_id) for doc_id in doc_terms])
+            self._bump_stats(conn, doc_count=-len(removed_lengths),
+                             total_length=-sum(length for _, length in removed_lengths))
+        logger.info(f"BM25 index removed {len(removed_lengths)} documents ({len(updates) + len(deletes)} terms)")
+        return len(removed_lengths)
+
+    def _select_postings(self, terms: List[str]):
+        conn = self._connection()
+        for i in range(0, len(terms), _QUERY_BATCH):
+            batch = terms[i:i + _QUERY_BATCH]
+            yield from conn.execute(
+                f"SELECT term, data FROM postings WHERE scope = ? AND term IN ({','.join('?' * len(batch))})",
+                [self.scope] + batch)
+
+    def _select_doc_terms(self, ids: List[int]):
+        conn = self._connection()
+        for i in range(0, len(ids), _QUERY_BATCH):
+            batch = ids[i:i + _QUERY_BATCH]
+            for doc_id, data in conn.execute(
+                    f"SELECT id, terms FROM doc_terms WHERE scope = ? AND id IN ({','.join('?' * len(batch))})",
+                    [self.scope] + batch):
+                yield doc_id, _decode_terms(data)
+
+    def _select_lengths(self, ids: List[int]):
+        conn = self._connection()
+        for i in range(0, len(ids), _QUERY_BATCH):
+            batch = ids[i:i + _QUERY_BATCH]
+            yield from conn.execute(
+                f"SELECT id, length FROM doc_lengths WHERE scope = ? AND id IN ({','.join('?' * len(batch))})",
+                [self.scope] + batch)
+
+    def _bump_stats(self, conn: sqlite3.Connection, **deltas):
+        for key, delta in list(deltas.items()) + [('version', 1)]:
+            conn.execute("INSERT INTO stats (scope, key, value) VALUES (?, ?, ?) "
+                         "ON CONFLICT (scope, key) DO UPDATE SET value = value + excluded.value",
+                         (self.scope, key, delta))
+
+    # ---------- 查询 ----------
+
+    def search(self, terms: Iterable[str], k: int) -> List[Tuple[int, float]]:
+        """BM25 检索，返回按得分降序的 (ID, score)"""
+        self._refresh()
+        if self._doc_count == 0:
+            return []
+
+        all_ids, all_scores = [], []
+        for term in set(terms):
+            postings = self._postings(term)
+            if postings is None:
+                continue
+            ids, tfs = postings
+            if ids[-1] > self._lengths_max_id:
+                # 刷新与读取倒排列表之间有检查点落盘：重新加载文档长度，仍未加载的ID本次跳过
+                self._refresh()
+                keep = ids <= self._lengths_max_id
+                if not keep.all():
+                    ids, tfs = ids[keep], tfs[keep]
+                    if len(ids) == 0:
+                        continue
+            idf = math.log(1 + (self._doc_count - len(ids) + 0.5) / (len(ids) + 0.5))
+            lengths = self._lengths[ids]
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths / (self._avg_length or 1.0))
+            all_ids.append(ids)
+            all_scores.append(idf * tfs * (BM25_K1 + 1) / (tfs + norm))
+        if not all_ids:
+            return []
+
+        unique_ids, inverse = np.unique(np.concatenate(all_ids), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(all_scores))
+        top = np.argsort(-scores)[:k] if len(scores) <= k else np.argpartition(-scores, k)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(unique_ids[i]), float(scores[i])) for i in top]
+
+    def _refresh(self):
+        """索引版本变化时清空倒排缓存，并增量加载新文档的长度"""
+        version = self._stat('version')
+        if version == self._version:
+            return
+
+        with self._cache_lock:
+            self._cache.clear()
+            self._cache_bytes = 0
+            rows = self._connection().execute(
+                "SELECT id, length FROM doc_lengths WHERE scope = ? AND id > ? ORDER BY id",
+                (self.scope, self._lengths_max_id)).fetchall()
+            if rows:
+                ids = np.array([row[0] for row in rows], dtype=np.int64)
+                if ids[-1] >= len(self._lengths):
+                    grown = np.zeros(max(int(ids[-1]) + 1, 2 * len(self._lengths)), dtype=np.float32)
+                    grown[:len(self._lengths)] = self._lengths
+                    self._lengths = grown
+                self._lengths[ids] = [row[1] for row in rows]
+                self._lengths_max_id = int(ids[-1])
+
+            self._doc_count = self._stat('doc_count')
+            total_length = self._stat('total_length')
+            self._avg_length = total_length / self._doc_count if self._doc_count else 0.0
+            self._version = version
+
+    def _postings(self, term: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        with self._cache_lock:
+            cached = self._cache.get(term)
+            if cached is not None:
+                self._cache.move_to_end(term)
+                return cached
+
+        row = self._connection().execute("SELECT data FROM postings WHERE scope = ? AND term = ?",
+                                         (self.scope, term)).fetchone()
+        if row is None:
+            return None
+        postings = decode_postings(row[0])
+
+        size = postings[0].nbytes + postings[1].nbytes
+        if size <= self.cache_max_bytes:
+            with self._cache_lock:
+                if term not in self._cache:
+                    self._cache[term] = postings
+                    self._cache_bytes += size
+                while self._cache_bytes > self.cache_max_bytes:
+                    _, (ids, tfs) = self._cache.popitem(last=False)
+                    self._cache_bytes -= ids.nbytes + tfs.nbytes
+        return postings
+
+    def stats(self) -> dict:
+        self._refresh()
+        return {
+            "documents": self._doc_count,
+            "avg_length": round(self._avg_length, 2),
+            "cached_terms": len(self._cache),
+            "cached_bytes": self._cache_bytes
+        }
+
+
+def get_bm25_index(scope: str, db_path: str = BM25_INDEX_PATH) -> BM25Index:
+    """获取进程内共享的倒排索引实例"""
+    key = (db_path, scope)
+    index = _indexes.get(key)
+    if index is None:
+        with _indexes_lock:
+            index = _indexes.get(key)
+            if index is None:
+                index = BM25Index(scope, db_path)
+                _indexes[key] = index
+    return index
@@ -0,0 +1,163 @@
+import logging
+import os
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from config import CHUNK_MAP_PATH
+
+# 获取日志记录器
+logger = logging.getLogger(__name__)
+
+# 内存缓存变量
+_chunk_map_cache: Optional["ChunkMap"] = None
+_cache_mtime: Optional[float] = None
+
+
+class ChunkMap:
+    """
+    文本块映射：chunk_id -> (文档MD5, 字符偏移, 字符长度)
+
+    chunk_id 即文本块的稳定ID，等于其追加到映射中的顺序位置。为保持紧凑，
+    每个块只存三个定长整数，文档MD5通过下标引用 md5 表。
+    文档删除后其文本块标记为失效（doc_idx = -1），位置保留以保证ID不复用。
+    """
+
+    def __init__(self):
+        self.md5s: List[str] = []
+        self._md5_index: Dict[str, int] = {}
+        self._size = 0
+        self._doc_idx = np.empty(0, dtype=np.int32)
+        self._offsets = np.empty(0, dtype=np.int64)
+        self._lengths = np.empty(0, dtype=np.int32)
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def doc_idx(self) -> np.ndarray:
+        return self._doc_idx[:self._size]
+
+    @property
+    def offsets(self) -> np.ndarray:
+        return self._offsets[:self._size]
+
+    @property
+    def lengths(self) -> np.ndarray:
+        return self._lengths[:self._size]
+
+    def __contains__(self, md5: str) -> bool:
+        return md5 in self._md5_index
+
+    def add(self, md5: str, spans: Sequence[Tuple[int, int]]) -> int:
+        """追加一个文档的所有文本块，返回第一个块的 chunk_id"""
+        if md5 not in self._md5_index:
+            self._md5_index[md5] = len(self.md5s)
+            self.md5s.append(md5)
+
+        spans = np.asarray(spans, dtype=np.int64).reshape(-1, 2)
+        first_id = self._size
+        end = first_id + len(spans)
+        self._reserve(end)
+        self._doc_idx[first_id:end] = self._md5_index[md5]
+        self._offsets[first_id:end] = spans[:, 0]
+        self._lengths[first_id:end] = spans[:, 1] - spans[:, 0]
+        self._size = end
+        return first_id
+
+    def _reserve(self, capacity: int):
+        """按倍增策略扩容，避免逐文档拷贝整个数组"""
+        if capacity <= len(self._doc_idx):
+            return
+        new_capacity = max(capacity, 2 * len(self._doc_idx), 1024)
+        for name in ('_doc_idx', '_offsets', '_lengths'):
+            old = getattr(self, name)
+            grown = np.empty(new_capacity, dtype=old.dtype)
+            grown[:self._size] = old[:self._size]
+            setattr(self, name, grown)
+
+    def lookup(self, chunk_id: int) -> Optional[Tuple[str, int, int]]:
+        """查询单个文本块，返回 (md5, offset, length)，已删除的块返回 None"""
+        if chunk_id < 0 or chunk_id >= len(self) or self.doc_idx[chunk_id] < 0:
+            return None
+        return self.md5s[self.doc_idx[chunk_id]], int(self.offsets[chunk_id]), int(self.lengths[chunk_id])
+
+    def ids_for(self, md5: str) -> np.ndarray:
+        """返回文档当前有效的全部 chunk_id"""
+        if md5 not in self._md5_index:
+            return np.empty(0, dtype=np.int64)
+        return np.flatnonzero(self.doc_idx == self._md5_index[md5]).astype(np.int64)
+
+    def discard(self, md5: str) -> np.ndarray:
+        """将文档的全部文本块标记为失效，返回被删除的 chunk_id"""
+        ids = self.ids_for(md5)
+        self._doc_idx[ids] = -1
+        self._md5_index.pop(md5, None)
+        return ids
+
+    def discard_ids(self, chunk_ids):
+        """按 chunk_id 标记失效（启动时应用尚未压缩的墓碑）"""
+        chunk_ids = np.asarray([i for i in chunk_ids if 0 <= i < len(self)], dtype=np.int64)
+        if len(chunk_ids) == 0:
+            return
+        self._doc_idx[chunk_ids] = -1
+        self._rebuild_md5_index()
+
+    def _rebuild_md5_index(self):
+        """只为仍有有效文本块的文档建立 md5 -> 下标索引"""
+        live = np.unique(self.doc_idx[self.doc_idx >= 0])
+        self._md5_index = {self.md5s[i]: int(i) for i in live}
+
+    def save(self, path: str = CHUNK_MAP_PATH):
+        """原子化保存到磁盘"""
+        target = Path(path)
+        temp_path = target.with_suffix('.tmp.npz')
+        try:
+            np.savez(
+                temp_path,
+                md5s=np.asarray(self.md5s, dtype='U32'),
+                doc_idx=self.doc_idx,
+                offsets=self.offsets,
+                lengths=self.lengths
+            )
+            os.replace(temp_path, target)
+        except Exception as e:
+            logger.error(f"Chunk map save failed: {str(e)}")
+            if temp_path.exists():
+                os.remove(temp_path)
+            raise
+
+    @classmethod
+    def load(cls, path: str = CHUNK_MAP_PATH) -> "ChunkMap":
+        """从磁盘加载，文件不存在时返回空映射"""
+        chunk_map = cls()
+        if not Path(path).exists():
+            return chunk_map
+
+        with np.load(path) as data:
+            chunk_map.md5s = data['md5s'].tolist()
+            chunk_map._doc_idx = data['doc_idx'].astype(np.int32)
+            chunk_map._offsets = data['offsets'].astype(np.int64)
+            chunk_map._lengths = data['lengths'].astype(np.int32)
+        chunk_map._size = len(chunk_map._doc_idx)
+        chunk_map._rebuild_md5_index()
+        return chunk_map
+
+
+def load_chunk_map(path: str = CHUNK_MAP_PATH) -> ChunkMap:
+    """加载文本块映射，文件未变化时复用内存缓存"""
+    global _chunk_map_cache, _cache_mtime
+
+    current_mtime = os.path.getmtime(path) if Path(path).exists() else None
+    if _chunk_map_cache is not None and current_mtime == _cache_mtime:
+        return _chunk_map_cache
+
+    try:
+        _chunk_map_cache = ChunkMap.load(path)
+        _cache_mtime = current_mtime
+        logger.info(f"Chunk map loaded ({len(_chunk_map_cache)} chunks)")
+    except Exception as e:
+        logger.error(f"Chunk map loading failed: {str(e)}")
+        return ChunkMap()
+    return _chunk_map_cache
@@ -0,0 +1,272 @@
+import argparse
+import json
+import logging
+import os
+import re
+import sys
+import threading
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from config import CHUNK_MAX_TOKENS, CHUNK_OVERLAP_TOKENS, LOCAL_MODEL_PATH
+from utils.context_builder import TokenCounter
+
+# 获取日志记录器
+logger = logging.getLogger(__name__)
+
+# 句子结束位置：中文句末标点（含其后的引号、括号）、后接空白或结尾的英文句末标点、换行
+_SENTENCE_END = re.compile(r'[。！？；…]+[”’」』）)]*|[.!?;]+["\')\]]*(?=\s|$)|\n')
+# 分段计数时每段的最大字符数（分词器一次处理一段，内存与段长成正比）
+_SEGMENT_CHARS = 65536
+
+# 每个进程只加载一次分块分词器（提取子进程中不加载整个嵌入模型）
+_counter: Optional[Tuple[TokenCounter, Optional[int]]] = None
+_counter_lock = threading.Lock()
+
+
+class ModelInputCounter(TokenCounter):
+    """
+    按模型实际输入计数：入库编码前文本块经 jieba 分词并以空格连接（batch_encoder.tokenize_for_model），
+    在该形式上分词计数，再把 token 偏移映射回原文，保证块长度与送入模型的 token 数一致
+    """
+
+    def offsets(self, text: str) -> List[Tuple[int, int]]:
+        joined, positions = _model_input(text)
+        return [(int(positions[start]), int(positions[end - 1]) + 1) for start, end in super().offsets(joined)]
+
+
+def sentence_chunk_spans(text: str, max_tokens: Optional[int] = None,
+                         overlap_tokens: int = CHUNK_OVERLAP_TOKENS,
+                         counter: Optional[TokenCounter] = None) -> List[Tuple[int, int]]:
+    """
+    按句子边界分块，返回每个块在原文中的字符区间 (start, end)
+
+    - 句子按中英文句末标点与换行切分，用嵌入模型的分词器在模型输入形式（jieba 分词加空格）上
+      统计每句 token 数（分词器不可用时按原文估算）；
+    - 按整句贪心装入窗口，窗口不超过 max_tokens，相邻块按整句重叠至少 overlap_tokens 个 token；
+    - 超过窗口的单句在 token 边界处硬切分。
+    整篇文档只做一次正则切句，分词按段批量进行，装箱使用累积和二分查找。
+    """
+    if counter is None:
+        counter, model_limit = get_chunk_counter()
+        max_tokens = max_tokens or effective_max_tokens(model_limit)
+    max_tokens = max(max_tokens or CHUNK_MAX_TOKENS, 1)
+    overlap_tokens = min(max(overlap_tokens, 0), max_tokens - 1)
+
+    starts, ends = _sentence_spans(text)
+    if len(starts) == 0:
+        return [(0, 0)]
+    counts = _token_counts(text, starts, ends, counter)
+    starts, ends, counts = _split_long_sentences(text, starts, ends, counts, max_tokens, counter)
+
+    cumulative = np.concatenate(([0], np.cumsum(counts)))
+    spans = []
+    first = 0
+    total = len(counts)
+    while first < total:
+        # 最多装入使累计 token 数不超过窗口的句子（至少一句）
+        last = int(np.searchsorted(cumulative, cumulative[first] + max_tokens, side="right")) - 1
+        last = max(last, first + 1)
+        spans.append((int(starts[first]), int(ends[last - 1])))
+        if last >= total:
+            break
+        # 下一块从覆盖末尾 overlap_tokens 个 token 的整句开始（重叠向上取整到整句）
+        next_first = int(np.searchsorted(cumulative, cumulative[last] - overlap_tokens, side="right")) - 1
+        next_first = min(max(next_first, first + 1), last)
+        # 从该句开始装不下任何新句子时不重叠，避免产生被上一块完全包含的块
+        next_last = int(np.searchsorted(cumulative, cumulative[next_first] + max_tokens, side="right")) - 1
+        first = next_first if next_last > last else last
+
+    return [span for span in (_strip_span(text, start, end) for start, end in spans) if span] or [(0, 0)]
+
+
+def get_chunk_counter() -> Tuple[TokenCounter, Optional[int]]:
+    """
+    返回 (分块计数器, 模型最大序列长度)
+
+    本进程已加载嵌入模型时直接使用其分词器；否则（如入库提取子进程）只从本地模型目录加载分词器；
+    都不可用时按字符类别估算，长度上限未知。
+    """
+    global _counter
+    if _counter is not None:
+        return _counter
+
+    with _counter_lock:
+        if _counter is None:
+            from utils.sentence_model import get_loaded_model
+
+            model = get_loaded_model()
+            if model is not None:
+                tokenizer = getattr(model, "tokenizer", None)
+                max_length = getattr(model, "max_seq_length", None)
+            else:
+                tokenizer, max_length = _load_tokenizer(LOCAL_MODEL_PATH)
+            if tokenizer is None or not getattr(tokenizer, "is_fast", False):
+                logger.info("No fast tokenizer available for chunking, estimating tokens")
+                _counter = (TokenCounter(), max_length)
+            else:
+                _counter = (ModelInputCounter(tokenizer), max_length)
+    return _counter
+
+
+def effective_max_tokens(model_limit: Optional[int]) -> int:
+    """窗口大小：CHUNK_MAX_TOKENS，且不超过模型最大序列长度（扣除首尾特殊 token）"""
+    if model_limit:
+        return max(min(CHUNK_MAX_TOKENS, model_limit - 2), 1)
+    return CHUNK_MAX_TOKENS
+
+
+def _load_tokenizer(local_model_path: str):
+    """从本地 Sentence-BERT 模型目录加载分词器与最大序列长度"""
+    if not os.path.isdir(local_model_path):
+        return None, None
+    try:
+        from transformers import AutoTokenizer  # 延迟导入
+
+        tokenizer = AutoTokenizer.from_pretrained(local_model_path, use_fast=True)
+    except Exception as e:
+        logger.warning(f"Failed to load tokenizer from {local_model_path}: {str(e)}")
+        return None, None
+
+    max_length = None
+    try:
+        with open(os.path.join(local_model_path, "sentence_bert_config.json"), encoding="utf-8") as f:
+            max_length = json.load(f).get("max_seq_length")
+    except (OSError, ValueError):
+        pass
+    return tokenizer, max_length
+
+
+def _model_input(text: str) -> Tuple[str, np.ndarray]:
+    """
+    返回模型输入形式（与 tokenize_for_model 相同）及其每个字符在原文中的偏移；
+    插入的空格映射到前一个词的末字符（分词器不会以空白作为 token 起点）
+    """
+    import jieba  # 延迟导入
+
+    pieces = list(jieba.cut(text))
+    if not pieces:
+        return "", np.zeros(0, dtype=np.int64)
+    # 第 k 个词（连同其前面插入的空格）在连接后的文本中整体右移 k 个字符
+    blocks = np.fromiter((len(piece) for piece in pieces), dtype=np.int64, count=len(pieces))
+    blocks[1:] += 1
+    joined = " ".join(pieces)
+    positions = np.arange(len(joined), dtype=np.int64) - np.repeat(np.arange(len(pieces), dtype=np.int64), blocks)
+    return joined, positions
+
+
+def _sentence_spans(text: str) -> Tuple[np.ndarray, np.ndarray]:
+    """整篇文档一次正则切句，返回每句的 (起始, 结束) 字符偏移数组（去除纯空白句）"""
+    boundaries = [match.end() for match in _SENTENCE_END.finditer(text)]
+    if not boundaries or boundaries[-1] != len(text):
+        boundaries.append(len(text))
+    ends = np.asarray(boundaries, dtype=np.int64)
+    starts = np.concatenate(([0], ends[:-1]))
+    keep = [bool(text[start:end].strip()) for start, end in zip(starts, ends)]
+    return starts[keep], ends[keep]
+
+
+def _token_counts(text: str, starts: np.ndarray, ends: np.ndarray, counter: TokenCounter) -> np.ndarray:
+    """按段（若干整句，约 _SEGMENT_CHARS 字符）批量分词，按 token 起始位置归属到句子"""
+    counts = np.zeros(len(starts), dtype=np.int64)
+    first = 0
+    while first < len(starts):
+        last = int(np.searchsorted(ends, starts[first] + _SEGMENT_CHARS, side="right"))
+        last = max(last, first + 1)
+        segment_start = int(starts[first])
+        offsets = counter.offsets(text[segment_start:int(ends[last - 1])])
+        token_starts = np.fromiter((start for start, _ in offsets), dtype=np.int64, count=len(offsets))
+        positions = np.searchsorted(token_starts + segment_start, ends[first:last], side="left")
+        counts[first:last] = np.diff(np.concatenate(([0], positions)))
+        first = last
+    return counts
+
+
+def _split_long_sentences(text: str, starts: np.ndarray, ends: np.ndarray, counts: np.ndarray,
+                          max_tokens: int, counter: TokenCounter):
+    """超过窗口的句子在 token 边界处切成不超过 max_tokens 的片段"""
+    long_sentences = np.flatnonzero(counts > max_tokens)
+    if len(long_sentences) == 0:
+        return starts, ends, counts
+
+    new_starts, new_ends, new_counts = [], [], []
+    previous = 0
+    for i in long_sentences:
+        new_starts.append(starts[previous:i])
+        new_ends.append(ends[previous:i])
+        new_counts.append(counts[previous:i])
+        start = int(starts[i])
+        offsets = counter.offsets(text[start:int(ends[i])])
+        pieces = range(0, len(offsets), max_tokens)
+        new_starts.append(np.asarray([start + (offsets[j][0] if j else 0) for j in pieces], dtype=np.int64))
+        new_ends.append(np.asarray([start + offsets[min(j + max_tokens, len(offsets)) - 1][1] for j in pieces],
+                                   dtype=np.int64))
+        new_counts.append(np.asarray([min(max_tokens, len(offsets) - j) for j in pieces], dtype=np.int64))
+        previous = i + 1
+    new_starts.append(starts[previous:])
+    new_ends.append(ends[previous:])
+    new_counts.append(counts[previous:])
+    return np.concatenate(new_starts), np.concatenate(new_ends), np.concatenate(new_counts)
+
+
+def _strip_span(text: str, start: int, end: int) -> Optional[Tuple[int, int]]:
+    """去掉区间首尾空白，空区间返回 None"""
+    while start < end and text[start].isspace():
+        start += 1
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    return (start, end) if end > start else None
+
+
+def chunk_length_report(paths: Iterable[str], counter: Optional[TokenCounter] = None,
+                        max_length: Optional[int] = None) -> dict:
+    """
+    用真实分词器检查分块结果：每个块按入库方式转换为模型输入（tokenize_for_model）后
+    计入首尾特殊 token，统计超过模型最大序列长度（会被截断尾部）的块
+    """
+    from utils.batch_encoder import tokenize_for_model  # 延迟导入避免循环依赖
+    from utils.load import chunk_text_with_spans
+    from utils.text_processing import extract_file_content
+
+    paths = list(paths)
+    if counter is None:
+        counter, max_length = get_chunk_counter()
+    if counter.tokenizer is None or not max_length:
+        raise RuntimeError("Chunk length check needs the embedding model's tokenizer and max_seq_length")
+
+    lengths, oversized = [], []
+    for path in paths:
+        chunks = chunk_text_with_spans(extract_file_content(path), chunker="sentence")[0]
+        for number, chunk in enumerate(chunks):
+            length = len(counter.tokenizer(tokenize_for_model(chunk), verbose=False)["input_ids"])
+            lengths.append(length)
+            if length > max_length:
+                oversized.append({"file": path, "chunk": number, "tokens": length})
+    return {
+        "files": len(paths),
+        "chunks": len(lengths),
+        "max_seq_length": max_length,
+        "window_tokens": effective_max_tokens(max_length),
+        "max_tokens": max(lengths, default=0),
+        "mean_tokens": round(float(np.mean(lengths)), 2) if lengths else 0.0,
+        "oversized": oversized,
+        "passed": not oversized
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check that no sentence chunk exceeds the model's max_seq_length")
+    parser.add_argument("paths", nargs="+", help="documents or directories to chunk")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    files = []
+    for path in args.paths:
+        if os.path.isdir(path):
+            files.extend(os.path.join(root, name) for root, _, names in os.walk(path) for name in sorted(names))
+        else:
+            files.append(path)
+    result = chunk_length_report(files)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    sys.exit(0 if result["passed"] else 1)
@@ -0,0 +1,158 @@
+import base64
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Optional
+
+import numpy as np
+
+from config import COMMIT_LOG_PATH, COMMIT_EVERY_DOCS, COMMIT_INTERVAL_SECONDS, COMMIT_LOG_FSYNC
+
+# 获取日志记录器
+logger = logging.getLogger(__name__)
+
+
+class CommitScheduler:
+    """
+    入库组提交调度器
+
+    每个新文档先追加到只追加日志（append-only log），索引与映射文件
+    只在累计 every_docs 个文档或距上次提交超过 interval 秒时整体落盘一次。
+    进程在两次检查点之间崩溃时，重启后回放日志即可恢复未落盘的文档。
+
+    append/_checkpoint_locked 由持有 state._lock 的调用方执行，
+    checkpoint/maybe_checkpoint 会自行获取该锁。
+    """
+
+    def __init__(self, state,
+                 log_path: str = COMMIT_LOG_PATH,
+                 every_docs: int = COMMIT_EVERY_DOCS,
+                 interval: float = COMMIT_INTERVAL_SECONDS,
+                 fsync: bool = COMMIT_LOG_FSYNC):
+        self.state = state
+        self.log_path = Path(log_path)
+        self.every_docs = max(every_docs, 1)
+        self.interval = interval
+        self.fsync = fsync
+        self.pending = 0
+        self.checkpoints = 0
+        self._last_commit = time.monotonic()
+        self._log_file = None
+        self._timer: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def append(self, file_md5: str, file_path: str, vectors: np.ndarray, spans=None, first_id: Optional[int] = None):
+        """追加一条入库记录到日志（调用方持有 state._lock）"""
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        record = {
+            "md5": file_md5,
+            "path": file_path,
+            "first_id": first_id,
+            "shape": list(vectors.shape),
+            "vectors": base64.b64encode(vectors.tobytes()).decode('ascii')
+        }
+        if spans is not None:
+            record["spans"] = [[int(start), int(end)] for start, end in spans]
+
+        log_file = self._open_log()
+        log_file.write(json.dumps(record) + "\n")
+        log_file.flush()
+        if self.fsync:
+            os.fsync(log_file.fileno())
+
+        self.pending += 1
+        self._ensure_timer()
+
+    def maybe_checkpoint(self):
+        """达到文档数或时间阈值时执行检查点"""
+        if self.pending >= self.every_docs or (
+                self.pending and time.monotonic() - self._last_commit >= self.interval):
+            self.checkpoint()
+
+    def checkpoint(self, force: bool = False):
+        """将索引与映射整体落盘并清空日志（force=True 时即使没有新文档也落盘）"""
+        with self.state._lock:
+            self._checkpoint_locked(force)
+
+    def _checkpoint_locked(self, force: bool = False):
+        if self.pending == 0 and not force:
+            return
+
+        start = time.perf_counter()
+        self.state.persist()
+        self._truncate_log()
+        logger.info(f"Checkpoint committed {self.pending} documents in {time.perf_counter() - start:.2f}s")
+
+        self.pending = 0
+        self.checkpoints += 1
+        self._last_commit = time.monotonic()
+
+    def replay(self, apply: Callable[[dict, np.ndarray], bool]) -> int:
+        """
+        回放上次检查点之后的日志记录（调用方持有 state._lock）
+
+        :param apply: 写入单条记录的函数，返回 False 表示记录已存在被跳过
+        :return: 实际回放的记录数
+        """
+        if not self.log_path.exists():
+            return 0
+
+        replayed = 0
+        with open(self.log_path, 'r', encoding='utf-8') as f:
+            for line_no, line in enumerate(f, 1):
+                try:
+                    record = json.loads(line)
+                    vectors = np.frombuffer(base64.b64decode(record["vectors"]), dtype=np.float32)
+                    vectors = vectors.reshape(record["shape"])
+                except (json.JSONDecodeError, KeyError, ValueError) as e:
+                    # 崩溃时最后一行可能只写了一半
+                    logger.warning(f"Stopping commit log replay at line {line_no}: {str(e)}")
+                    break
+                if apply(record, vectors):
+                    replayed += 1
+
+        if replayed:
+            logger.info(f"Replayed {replayed} documents from commit log")
+            self.pending = replayed
+            self._checkpoint_locked()
+        else:
+            self._truncate_log()
+        return replayed
+
+    def close(self):
+        """停止定时线程并提交剩余文档"""
+        self._stop.set()
+        self.checkpoint()
+        if self._log_file is not None:
+            self._log_file.close()
+            self._log_file = None
+
+    def _open_log(self):
+        if self._log_file is None:
+            self.log_path.parent.mkdir(parents=True, exist_ok=True)
+            self._log_file = open(self.log_path, 'a', encoding='utf-8')
+        return self._log_file
+
+    def _truncate_log(self):
+        if self._log_file is not None:
+            self._log_file.close()
+            self._log_file = None
+        if self.log_path.exists():
+            open(self.log_path, 'w').close()
+
+    def _ensure_timer(self):
+        """启动定时线程，保证低写入速率时也能按时间阈值提交"""
+        if self._timer is not None and self._timer.is_alive():
+            return
+        self._timer = threading.Thread(target=self._timer_loop, name="commit-scheduler", daemon=True)
+        self._timer.start()
+
+    def _timer_loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.maybe_checkpoint()
+            except Exception as e:
+                logger.error(f"Scheduled checkpoint failed: {str(e)}", exc_info=True)
@@ -0,0 +1,126 @@
+import logging
+import os
+import sys
+import tempfile
+import threading
+import zlib
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+from config import CONTENT_STORE_PATH, CONTENT_CACHE_MAX_BYTES, CONTENT_COMPRESS_LEVEL
+
+# 获取日志记录器
+logger = logging.getLogger(__name__)
+
+
+class ContentStore:
+    """
+    文档文本存储（单例）
+
+    以文档MD5为键保存提取后的文本：磁盘上按 zlib 压缩存放，
+    内存中维护一个按字节预算淘汰的 LRU 缓存，查询路径无需重新解析原始文件。
+    """
+    _instance = None
+    _lock = threading.Lock()
+
+    def __new__(cls):
+        with cls._lock:
+            if cls._instance is None:
+                cls._instance = super().__new__(cls)
+                cls._instance._initialize()
+            return cls._instance
+
+    def _initialize(self):
+        self.root = Path(CONTENT_STORE_PATH)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.memory_budget = CONTENT_CACHE_MAX_BYTES
+        self._cache: "OrderedDict[str, str]" = OrderedDict()
+        self._cache_bytes = 0
+        self._cache_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _path_for(self, md5: str) -> Path:
+        return self.root / md5[:2] / f"{md5}.zz"
+
+    def contains(self, md5: str) -> bool:
+        return md5 in self._cache or self._path_for(md5).exists()
+
+    def put(self, md5: str, text: str):
+        """保存文档文本（已存在时跳过写盘）"""
+        path = self._path_for(md5)
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # 每个写入方使用独立的临时文件（入库与查询侧回填、多个服务进程可能同时写同一文档）
+            with tempfile.NamedTemporaryFile(dir=path.parent, prefix=f"{md5}.", suffix=".tmp", delete=False) as f:
+                temp_path = Path(f.name)
+            try:
+                temp_path.write_bytes(zlib.compress(text.encode('utf-8'), CONTENT_COMPRESS_LEVEL))
+                os.replace(temp_path, path)
+            except Exception as e:
+                if temp_path.exists():
+                    os.remove(temp_path)
+                if isinstance(e, OSError) and path.exists():
+                    # 替换竞争失败（如 Windows 上目标被占用）：其他写入方已发布相同内容
+                    logger.debug(f"Content store entry {md5} published concurrently")
+                else:
+                    logger.error(f"Content store write failed for {md5}: {str(e)}")
+                    raise
+        self._remember(md5, text)
+
+    def get(self, md5: str) -> Optional[str]:
+        """读取文档文本，内存未命中时从磁盘解压"""
+        with self._cache_lock:
+            text = self._cache.get(md5)
+            if text is not None:
+                self._cache.move_to_end(md5)
+                self.hits += 1
+                return text
+            self.misses += 1
+
+        path = self._path_for(md5)
+        if not path.exists():
+            return None
+        try:
+            text = zlib.decompress(path.read_bytes()).decode('utf-8')
+        except Exception as e:
+            logger.error(f"Content store read failed for {md5}: {str(e)}")
+            return None
+        self._remember(md5, text)
+        return text
+
+    def remove(self, md5: str):
+        """删除文档文本"""
+        with self._cache_lock:
+            text = self._cache.pop(md5, None)
+            if text is not None:
+                self._cache_bytes -= sys.getsizeof(text)
+        path = self._path_for(md5)
+        if path.exists():
+            os.remove(path)
+
+    def stats(self) -> dict:
+        return {
+            "cached_documents": len(self._cache),
+            "cached_bytes": self._cache_bytes,
+            "memory_budget": self.memory_budget,
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+    def _remember(self, md5: str, text: str):
+        """放入 LRU 缓存，超出内存预算时淘汰最久未使用的文档"""
+        size = sys.getsizeof(text)
+        if size > self.memory_budget:
+            return
+
+        with self._cache_lock:
+            previous = self._cache.pop(md5, None)
+            if previous is not None:
+                self._cache_bytes -= sys.getsizeof(previous)
+            self._cache[md5] = text
+            self._cache_bytes += size
+            while self._cache_bytes > self.memory_budget and self._cache:
+                _, evicted = self._cache.popitem(last=False)
+                self._cache_bytes -= sys.getsizeof(evicted)
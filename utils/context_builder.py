@@ -0,0 +1,222 @@
+import logging
+import math
+import re
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from config import CONTEXT_TOKEN_BUDGET, CONTEXT_TOKENIZER, MAX_CONTEXT_LENGTH, RRF_K
+from utils.bm25_index import reciprocal_rank_fusion, tokenize_terms
+
+# 获取日志记录器
+logger = logging.getLogger(__name__)
+
+# 无分词器时的估算：每个汉字、每段连续字母数字、每个其他符号各计一个 token
+_ESTIMATE_PATTERN = re.compile(r'[\u4e00-\u9fff]|[A-Za-z0-9]+|[^\sA-Za-z0-9\u4e00-\u9fff]')
+
+
+class TokenCounter:
+    """
+    基于分词器的 token 计数与截断
+
+    优先使用嵌入模型自带的分词器（HuggingFace fast tokenizer，提供字符偏移）；
+    模型没有分词器或配置为 estimate 时按字符类别估算。
+    """
+
+    def __init__(self, tokenizer=None):
+        self.tokenizer = tokenizer
+        self.name = "model" if tokenizer is not None else "estimate"
+
+    def offsets(self, text: str) -> List[Tuple[int, int]]:
+        """每个 token 在文本中的 (起始, 结束) 字符偏移"""
+        if self.tokenizer is not None:
+            encoded = self.tokenizer(text, add_special_tokens=False, return_offsets_mapping=True, verbose=False)
+            return [(start, end) for start, end in encoded["offset_mapping"] if end > start]
+        return [match.span() for match in _ESTIMATE_PATTERN.finditer(text)]
+
+    def count(self, text: str) -> int:
+        return len(self.offsets(text))
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """截取不超过 max_tokens 个 token 的前缀（在 token 边界处截断）"""
+        if max_tokens <= 0:
+            return ""
+        offsets = self.offsets(text)
+        if len(offsets) <= max_tokens:
+            return text
+        return text[:offsets[max_tokens - 1][1]]
+
+
+def get_token_counter() -> TokenCounter:
+    """按配置返回计数器：model 使用嵌入模型分词器（不可用时回退估算），estimate 直接估算"""
+    if CONTEXT_TOKENIZER == "model":
+        from utils.sentence_model import get_model
+
+        tokenizer = getattr(get_model(), "tokenizer", None)
+        if tokenizer is not None and getattr(tokenizer, "is_fast", False):
+            return TokenCounter(tokenizer)
+        logger.debug("Embedding model has no fast tokenizer, estimating context tokens")
+    return TokenCounter()
+
+
+def document_candidates(documents: Sequence[Tuple[str, str]], query_text: str,
+                        max_tokens: int = 128) -> List[dict]:
+    """
+    文档级检索的候选段落：将每个命中文档按入库时的分块方式切分，
+    按"文档检索排名"与"窗口内查询词命中"两个排名做倒数排名融合后排序。
+    :param documents: 按检索排名排列的 (md5, 文档全文)
+    """
+    from utils.load import document_chunk_spans  # 延迟导入避免循环依赖
+
+    terms = [term for term in tokenize_terms(query_text) if len(term) > 1 or not term.isascii()]
+    windows = []
+    for md5, content in documents:
+        content = content[:MAX_CONTEXT_LENGTH]
+        for start, end in document_chunk_spans(content, max_tokens):
+            windows.append({"md5": md5, "start": start, "text": content[start:end]})
+
+    # 窗口内查询词出现次数（对数饱和），只参与排名，不直接作为得分返回
+    lexical_scores = [sum(math.log1p(window["text"].count(term)) for term in terms) for window in windows]
+    document_order = list(range(len(windows)))
+    lexical_order = sorted((i for i, score in enumerate(lexical_scores) if score > 0),
+                           key=lambda i: lexical_scores[i], reverse=True)
+    fused = reciprocal_rank_fusion([document_order, lexical_order], k=RRF_K)
+    return [windows[i] for i, _ in fused]
+
+
+def passage_candidates(passages: Sequence[dict]) -> List[dict]:
+    """块级检索的候选段落（已按检索得分排序）"""
+    return [{"md5": passage["md5"], "start": passage["offset"], "text": passage["text"]} for passage in passages]
+
+
+def build_context(candidates: Sequence[dict], budget: int = CONTEXT_TOKEN_BUDGET,
+                  counter: Optional[TokenCounter] = None) -> Tuple[List[str], dict]:
+    """
+    按排名顺序在 token 预算内装填上下文
+
+    - 同一文档中重叠的窗口只计入未覆盖的部分，完全被覆盖的窗口跳过；
+    - 预算不足时在 token 边界截断最后一段并停止；
+    - 同一文档相邻或重叠的片段合并为一段，按其中最高排名排序。
+    :param candidates: 按相关性排序的 {"md5", "start", "text"}
+    :return: (上下文段落列表, 统计报告)
+    """
+    counter = counter or get_token_counter()
+    covered: Dict[str, List[Tuple[int, int]]] = {}
+    pieces: List[Tuple[str, int, int, str]] = []  # (md5, 起始偏移, 排名, 文本)
+    used_tokens = 0
+    duplicates = 0
+    considered = 0
+    truncated = False
+
+    for rank, candidate in enumerate(candidates):
+        if used_tokens >= budget:
+            truncated = True
+            break
+        considered += 1
+        md5, start, text = candidate["md5"], candidate["start"], candidate["text"]
+        gaps = _uncovered(covered.get(md5, []), start, start + len(text))
+        if not gaps:
+            duplicates += 1
+            continue
+
+        for gap_start, gap_end in gaps:
+            piece = text[gap_start - start:gap_end - start]
+            tokens = counter.count(piece)
+            if used_tokens + tokens > budget:
+                piece = counter.truncate(piece, budget - used_tokens)
+                tokens = budget - used_tokens
+                truncated = True
+            if piece:
+                pieces.append((md5, gap_start, rank, piece))
+                _cover(covered.setdefault(md5, []), gap_start, gap_start + len(piece))
+                used_tokens += tokens
+            if truncated:
+                break
+        if truncated:
+            break
+
+    context = _assemble(pieces)
+    source_chars = sum(end - start for intervals in _spans_by_document(candidates).values()
+                       for start, end in intervals)
+    context_chars = sum(len(piece) for _, _, _, piece in pieces)
+    report = {
+        "tokenizer": counter.name,
+        "budget_tokens": budget,
+        "used_tokens": used_tokens,
+        "candidates": len(candidates),
+        "candidates_used": considered - duplicates,
+        "duplicate_candidates": duplicates,
+        "dropped_candidates": len(candidates) - considered,
+        "truncated": truncated,
+        "source_chars": source_chars,
+        "context_chars": context_chars,
+        "truncated_chars": max(source_chars - context_chars, 0)
+    }
+    logger.info(f"Context assembled: {report}")
+    return context, report
+
+
+def _uncovered(intervals: List[Tuple[int, int]], start: int, end: int) -> List[Tuple[int, int]]:
+    """[start, end) 中尚未被已选区间（有序、不相交）覆盖的部分"""
+    gaps = []
+    cursor = start
+    for covered_start, covered_end in intervals:
+        if covered_end <= cursor:
+            continue
+        if covered_start >= end:
+            break
+        if covered_start > cursor:
+            gaps.append((cursor, covered_start))
+        cursor = max(cursor, covered_end)
+    if cursor < end:
+        gaps.append((cursor, end))
+    return gaps
+
+
+def _merge(intervals: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """合并有序区间中重叠或相接的部分"""
+    merged = [intervals[0]]
+    for start, end in intervals[1:]:
+        if start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def _cover(intervals: List[Tuple[int, int]], start: int, end: int):
+    """将 [start, end) 并入有序区间列表（就地合并）"""
+    intervals.append((start, end))
+    intervals.sort()
+    intervals[:] = _merge(intervals)
+
+
+def _spans_by_document(candidates: Sequence[dict]) -> Dict[str, List[Tuple[int, int]]]:
+    """各文档候选区间的并集"""
+    spans: Dict[str, List[Tuple[int, int]]] = {}
+    for candidate in candidates:
+        spans.setdefault(candidate["md5"], []).append(
+            (candidate["start"], candidate["start"] + len(candidate["text"])))
+    return {md5: _merge(sorted(intervals)) for md5, intervals in spans.items()}
+
+
+def _assemble(pieces: List[Tuple[str, int, int, str]]) -> List[str]:
+    """同一文档中首尾相接的片段拼接为一段，段落按最高排名排序"""
+    by_document: Dict[str, List[Tuple[int, int, str]]] = {}
+    for md5, start, rank, piece in pieces:
+        by_document.setdefault(md5, []).append((start, rank, piece))
+
+    segments = []  # (最高排名, 文本)
+    for document_pieces in by_document.values():
+        document_pieces.sort()
+        current_end, best_rank, texts = None, None, []
+        for start, rank, piece in document_pieces:
+            if current_end is not None and start != current_end:
+                segments.append((best_rank, "".join(texts)))
+                best_rank, texts = None, []
+            texts.append(piece)
+            best_rank = rank if best_rank is None else min(best_rank, rank)
+            current_end = start + len(piece)
+        if texts:
+            segments.append((best_rank, "".join(texts)))
+
+    segments.sort(key=lambda segment: segment[0])
+    return [" ".join(text.split()) for _, text in segments]
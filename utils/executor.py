@@ -0,0 +1,33 @@
+import asyncio
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from config import QUERY_CPU_WORKERS, WRITE_WORKERS
+
+# 获取日志记录器
+logger = logging.getLogger(__name__)
+
+# 查询路径 CPU 密集步骤（分词、编码、FAISS检索、文本读取）使用的有界线程池
+_executor = ThreadPoolExecutor(max_workers=QUERY_CPU_WORKERS, thread_name_prefix="query-cpu")
+# 写操作（状态初始化、删除、更新、压缩）使用独立线程池，长时间写入不占用查询线程
+_write_executor = ThreadPoolExecutor(max_workers=WRITE_WORKERS, thread_name_prefix="index-write")
+
+
+async def run_blocking(func, *args, **kwargs):
+    """在有界线程池中执行阻塞函数，避免阻塞事件循环"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+
+
+async def run_write(func, *args, **kwargs):
+    """在写操作线程池中执行阻塞的索引写入"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_write_executor, functools.partial(func, *args, **kwargs))
+
+
+def shutdown_executor():
+    """关闭线程池（服务停止时调用）"""
+    _executor.shutdown(wait=False)
+    _write_executor.shutdown(wait=False)
+    logger.info("Query and write executors shut down")
@@ -3,64 +3,94 @@ import faiss
 import portalocker
 import os
 from pathlib import Path
-from typing import Optional
-from config import FAISS_INDEX_PATH
+from typing import Dict
+from config import FAISS_INDEX_PATH, FAISS_INDEX_TYPE, INDEX_WRITER_LOCK_PATH
+from utils.index_factory import create_index, apply_search_params, requires_training
 import time
 
 # 获取日志记录器
 logger = logging.getLogger(__name__)
 
-# 内存缓存变量
-_faiss_index_cache: Optional[faiss.Index] = None
-_cache_metadata: dict = {}
+# 内存缓存变量（按索引路径区分）
+_faiss_index_cache: Dict[str, faiss.Index] = {}
+_cache_metadata: Dict[str, dict] = {}
+# 本进程持有的写入锁（锁文件路径 -> 文件句柄），进程退出时由系统释放
+_writer_locks: Dict[str, object] = {}
 
 
-def load_faiss_index(use_cache: bool = True) -> faiss.Index:
-    """安全加载FAISS索引，支持内存缓存和自动恢复"""
-    global _faiss_index_cache, _cache_metadata
+class IndexCorrupted(RuntimeError):
+    """索引文件存在但无法读取（不以空索引代替，避免查询返回空结果或写入方覆盖原快照）"""
 
-    if use_cache and _faiss_index_cache is not None:
-        if _validate_cache():
-            return _faiss_index_cache
+
+def load_faiss_index(use_cache: bool = True, index_path: str = FAISS_INDEX_PATH, mmap: bool = False) -> faiss.Index:
+    """
+    安全加载FAISS索引，支持内存缓存和自动恢复
+
+    mmap=True 时以只读内存映射方式打开，页面按需加载，适用于查询路径；
+    返回的索引不可写入，写入方需使用 mmap=False 加载独立副本。
+    多个服务进程映射同一快照文件时共享操作系统页缓存，物理内存只占一份。
+
+    写入方发布新代（generation）后，缓存的索引在下次调用时整体替换；
+    新快照读取失败时继续返回已缓存的旧快照，不会退回空索引。
+    只有索引文件不存在时才创建新索引；文件存在但无法读取且没有可用缓存时抛出 IndexCorrupted。
+    """
+    cache_key = _cache_key(index_path, mmap)
+    cached = _faiss_index_cache.get(cache_key) if use_cache else None
+    if cached is not None and _validate_cache(index_path, cache_key):
+        return cached
 
     try:
-        index_path = Path(FAISS_INDEX_PATH)
+        # 先读取代号再读文件：读取期间发布的新快照会在下次调用时再次替换
+        generation = get_index_generation(index_path)
+        index_path = Path(index_path)
         if not index_path.exists():
+            if cached is not None:
+                logger.warning(f"FAISS index {index_path} missing, keeping cached snapshot")
+                return cached
             logger.warning("FAISS index not found, creating new index")
             return _create_new_index()
 
         # 加载索引
-        index = faiss.read_index(str(index_path))
-        current_mtime = os.path.getmtime(index_path)
+        current_mtime = os.stat(index_path).st_mtime_ns
+        try:
+            index = _read_index(index_path, mmap)
+        except Exception as e:
+            raise IndexCorrupted(f"FAISS index {index_path} exists but cannot be read: {str(e)}") from e
 
         # 验证索引完整性
         if index.ntotal < 0:
-            raise RuntimeError("Invalid index structure detected")
+            raise IndexCorrupted(f"Invalid index structure detected in {index_path}")
+
+        # 部署级默认检索参数（nprobe / efSearch）
+        apply_search_params(index)
 
         # 更新缓存
         if use_cache:
-            _faiss_index_cache = index
-            _cache_metadata = {
+            _faiss_index_cache[cache_key] = index
+            _cache_metadata[cache_key] = {
+                'generation': generation,
                 'mtime': current_mtime,
                 'size': index.ntotal
             }
+            if cached is not None:
+                logger.info(f"FAISS index {index_path} swapped to generation {generation} ({index.ntotal} vectors)")
         return index
 
     except Exception as e:
         logger.error(f"Index loading failed: {str(e)}")
-        # 捕获一般异常，而不是 faiss.FaissException
-        if isinstance(e, RuntimeError):
-            logger.warning("Attempting index recovery...")
-            return _handle_corrupted_index()
+        if cached is not None:
+            logger.warning("Keeping previously loaded index snapshot")
+            return cached
         raise
 
 
-def load_faiss_index_with_retry(use_cache: bool = True, max_retries: int = 3) -> faiss.Index:
+def load_faiss_index_with_retry(use_cache: bool = True, max_retries: int = 3,
+                                index_path: str = FAISS_INDEX_PATH, mmap: bool = False) -> faiss.Index:
     """尝试加载FAISS索引，处理文件锁问题并进行重试"""
     retries = 0
     while retries < max_retries:
         try:
-            return load_faiss_index(use_cache)
+            return load_faiss_index(use_cache, index_path, mmap)
         except portalocker.LockException as e:
             retries += 1
             logger.warning(f"Lock acquisition failed, retrying {retries}/{max_retries}...")
@@ -68,18 +98,59 @@ def load_faiss_index_with_retry(use_cache: bool = True, max_retries: int = 3) ->
     logger.critical("Failed to acquire lock after multiple attempts")
     raise RuntimeError("Failed to load FAISS index due to file lock issues")
 
-def save_faiss_index(index: faiss.Index):
+def save_faiss_index(index: faiss.Index, index_path: str = FAISS_INDEX_PATH) -> int:
+    """
+    原子化保存索引快照并发布新代号，返回新代号
+
+    先完整写入同目录临时文件并 fsync，再 os.replace 覆盖正式文件：
+    读取方要么看到旧快照、要么看到新快照，不会读到半写文件或找不到文件；
+    已映射旧快照的进程继续使用旧文件内容，直到检测到新代号后切换。
+    """
+    index_path = Path(index_path)
+    temp_path = index_path.with_name(f"{index_path.name}.tmp-{os.getpid()}")
     try:
-        index_path = Path(FAISS_INDEX_PATH)
-        # 删除备份文件
-        if index_path.exists():
-            os.remove(index_path)
-            logger.info(f"Old {index_path} removed")
-        faiss.write_index(index, str(index_path))
+        faiss.write_index(index, str(temp_path))
+        _fsync_file(temp_path)
+        os.replace(temp_path, index_path)
+        generation = _publish_generation(index_path)
+        logger.info(f"Index {index_path} saved as generation {generation} ({index.ntotal} vectors)")
+        return generation
     except Exception as e:
         logger.error(f"Index save failed: {e}", exc_info=True)
+        if temp_path.exists():
+            os.remove(temp_path)
         raise
 
+
+def get_index_generation(index_path: str = FAISS_INDEX_PATH) -> int:
+    """索引快照的当前代号（从未通过 save_faiss_index 保存过时为 0）"""
+    try:
+        with open(_generation_path(index_path), encoding="utf-8") as f:
+            return int(f.read().strip() or 0)
+    except (OSError, ValueError):
+        return 0
+
+
+def acquire_writer_lock(lock_path: str = INDEX_WRITER_LOCK_PATH) -> bool:
+    """
+    非阻塞获取索引写入锁，成功后本进程持有至退出
+
+    多个服务进程共享同一份索引文件时只有一个进程负责入库、删除与压缩，
+    其余进程只读映射快照。同一进程重复调用直接返回 True。
+    """
+    if lock_path in _writer_locks:
+        return True
+    Path(lock_path).parent.mkdir(parents=True, exist_ok=True)
+    handle = open(lock_path, "a")
+    try:
+        portalocker.lock(handle, portalocker.LOCK_EX | portalocker.LOCK_NB)
+    except portalocker.LockException:
+        handle.close()
+        return False
+    _writer_locks[lock_path] = handle
+    logger.info(f"Acquired index writer lock {lock_path} (pid={os.getpid()})")
+    return True
+
 def _create_new_index() -> faiss.Index:
     """创建新索引时动态获取维度"""
     from utils.sentence_model import get_model  # 延迟导入避免循环依赖
@@ -87,31 +158,95 @@ def _create_new_index() -> faiss.Index:
         model = get_model()
         sample_vector = model.encode(["sample text"])[0]
         dimension = len(sample_vector)
-        index = faiss.IndexFlatIP(dimension)
-        logger.info(f"Created new FAISS index (dim={dimension})")
-        return index
+        if requires_training(FAISS_INDEX_TYPE):
+            # 空库无训练样本，先使用精确索引，积累数据后通过 index_factory 离线迁移
+            logger.warning(f"Index type {FAISS_INDEX_TYPE} needs training data, starting with flat index")
+            return create_index(dimension, "flat")
+        return create_index(dimension, FAISS_INDEX_TYPE)
     except Exception as e:
         logger.error("Failed to create new index", exc_info=True)
         raise
 
 
-def _validate_cache() -> bool:
-    """验证缓存有效性"""
-    global _cache_metadata
+def _cache_key(index_path: str, mmap: bool) -> str:
+    """只读映射与可写副本分别缓存，避免写入方拿到只读索引"""
+    cache_key = str(Path(index_path))
+    return f"{cache_key}#mmap" if mmap else cache_key
+
+
+def _read_index(index_path: Path, mmap: bool) -> faiss.Index:
+    """读取索引文件，mmap 不受支持时回退为完整读取"""
+    if mmap:
+        # IO_FLAG_MMAP_IFC 使精确索引的向量数据也按需映射（旧版 faiss 无此标志）
+        flags = faiss.IO_FLAG_MMAP | getattr(faiss, "IO_FLAG_MMAP_IFC", 0) | faiss.IO_FLAG_READ_ONLY
+        try:
+            return faiss.read_index(str(index_path), flags)
+        except RuntimeError as e:
+            logger.warning(f"Memory-mapped load failed for {index_path}, reading into memory: {str(e)}")
+    return faiss.read_index(str(index_path))
+
+
+def get_cache_metadata() -> Dict[str, dict]:
+    """返回已缓存索引的元数据（缓存键 -> 代号、mtime、向量数）"""
+    return {key: dict(metadata) for key, metadata in _cache_metadata.items()}
+
 
-    if not Path(FAISS_INDEX_PATH).exists():
+def _validate_cache(index_path: str, cache_key: str) -> bool:
+    """
+    验证缓存有效性：代号与文件 mtime 均未变化
+
+    代号由 save_faiss_index 发布，不受文件系统时间精度影响；
+    mtime 用于发现未经 save_faiss_index 替换的文件（如离线迁移）。
+    """
+    try:
+        current_mtime = os.stat(index_path).st_mtime_ns
+    except OSError:
         return False
 
-    current_mtime = os.path.getmtime(FAISS_INDEX_PATH)
-    current_size = _faiss_index_cache.ntotal if _faiss_index_cache else 0
+    cached_index = _faiss_index_cache.get(cache_key)
+    metadata = _cache_metadata.get(cache_key, {})
+    current_size = cached_index.ntotal if cached_index else 0
 
     return (
-            _cache_metadata.get('mtime') == current_mtime and
-            _cache_metadata.get('size') == current_size
+            metadata.get('generation') == get_index_generation(index_path) and
+            metadata.get('mtime') == current_mtime and
+            metadata.get('size') == current_size
     )
 
 
-def _handle_corrupted_index() -> faiss.Index:
-    """处理索引损坏情况"""
-    logger.error("No backup available, creating new index")
-    return _create_new_index()
\ No newline at end of file
+def _generation_path(index_path) -> Path:
+    index_path = Path(index_path)
+    return index_path.with_name(f"{index_path.name}.generation")
+
+
+def _publish_generation(index_path: Path) -> int:
+    """代号加一并原子写入（快照文件替换完成后调用，读取方看到新代号时新快照必然已就位）"""
+    generation = get_index_generation(index_path) + 1
+    path = _generation_path(index_path)
+    temp_path = path.with_name(f"{path.name}.tmp-{os.getpid()}")
+    with open(temp_path, "w", encoding="utf-8") as f:
+        f.write(str(generation))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+    _fsync_directory(path.parent)
+    return generation
+
+
+def _fsync_file(path: Path):
+    with open(path, "rb") as f:
+        os.fsync(f.fileno())
+
+
+def _fsync_directory(directory: Path):
+    """持久化目录项（重命名），不支持打开目录的平台上跳过"""
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
@@ -0,0 +1,137 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+from typing import Callable, Iterable, List, Optional, Tuple
+
+from config import MANIFEST_FLUSH_EVERY
+from utils.mapping_store import get_mapping_store
+
+# 获取日志记录器
+logger = logging.getLogger(__name__)
+
+# 流式哈希的读取块大小
+_HASH_BLOCK_SIZE = 1024 * 1024
+# mtime 距离检查时刻过近时，同一时间粒度内的再次修改无法被 mtime 识别，
+# 此类条目不记录 mtime，下次同步时强制比较原始字节哈希
+_RACY_WINDOW_NS = 2 * 10 ** 9
+
+
+def file_signature(file_path: str) -> Tuple[int, int]:
+    """返回文件 (大小, mtime_ns)"""
+    stat = os.stat(file_path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def hash_file(file_path: str) -> str:
+    """流式计算文件原始字节的 BLAKE2b 哈希"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(_HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def fingerprint(file_path: str) -> dict:
+    """计算文件指纹（先取 stat 再读内容，期间被修改时下次同步会重新检测）"""
+    checked_ns = time.time_ns()
+    size, mtime_ns = file_signature(file_path)
+    return {"size": size, "mtime_ns": mtime_ns, "raw_hash": hash_file(file_path), "checked_ns": checked_ns}
+
+
+class FileManifest:
+    """
+    文件清单：path -> (大小, mtime_ns, 原始字节哈希, 文本MD5)
+
+    目录同步时先比对清单，大小与 mtime 均未变化的文件直接跳过；
+    仅 mtime 变化时再比较原始字节哈希，内容未变则只刷新 mtime。
+    只有新增或内容变化的文件才进入提取、编码流程。
+    清单仅用于跳过重复工作，丢失条目只会导致文件被重新提取。
+    """
+
+    def __init__(self, store=None, flush_every: int = MANIFEST_FLUSH_EVERY):
+        self.store = store or get_mapping_store()
+        self.flush_every = max(flush_every, 1)
+        self._pending: List[tuple] = []
+        self._lock = threading.Lock()
+
+    def changed_files(self, file_paths: Iterable[str], is_indexed: Callable[[str], bool]) -> List[str]:
+        """返回需要重新处理的文件（新增、内容变化或对应文档不在索引中）"""
+        file_paths = list(file_paths)
+        stored = self.store.get_manifest(file_paths)
+        changed = []
+        touched = []
+
+        for file_path in file_paths:
+            entry = stored.get(file_path)
+            if entry is None:
+                changed.append(file_path)
+                continue
+
+            size, mtime_ns, raw_hash, md5 = entry
+            if md5 and not is_indexed(md5):
+                changed.append(file_path)
+                continue
+
+            try:
+                current_size, current_mtime_ns = file_signature(file_path)
+                if (current_size, current_mtime_ns) == (size, mtime_ns):
+                    continue
+                if current_size == size and hash_file(file_path) == raw_hash:
+                    touched.append((file_path, size, self._stable_mtime(current_mtime_ns, time.time_ns()),
+                                    raw_hash, md5))
+                    continue
+            except OSError as e:
+                logger.warning(f"Failed to check {file_path}: {str(e)}")
+            changed.append(file_path)
+
+        if touched:
+            self._write(touched)
+        logger.info(f"Manifest check: {len(changed)} changed, {len(file_paths) - len(changed)} unchanged")
+        return changed
+
+    def missing_paths(self, directory_path: str, file_paths: Iterable[str]) -> List[str]:
+        """清单中位于目录下、但已不存在的文件"""
+        prefix = os.path.join(directory_path, "")
+        existing = set(file_paths)
+        return [path for path in self.store.manifest_paths() if path.startswith(prefix) and path not in existing]
+
+    def forget(self, file_paths: Iterable[str]):
+        """删除清单条目"""
+        file_paths = list(file_paths)
+        if file_paths:
+            self.store.delete_manifest(file_paths)
+
+    def record(self, file_path: str, file_fingerprint: Optional[dict], md5: Optional[str]):
+        """记录处理完成的文件，累计到阈值后批量写入"""
+        if not file_fingerprint:
+            return
+        entry = (file_path, file_fingerprint["size"],
+                 self._stable_mtime(file_fingerprint["mtime_ns"], file_fingerprint["checked_ns"]),
+                 file_fingerprint["raw_hash"], md5)
+        with self._lock:
+            self._pending.append(entry)
+            if len(self._pending) < self.flush_every:
+                return
+            entries, self._pending = self._pending, []
+        self._write(entries)
+
+    def flush(self):
+        """写入所有未落盘的清单条目"""
+        with self._lock:
+            entries, self._pending = self._pending, []
+        if entries:
+            self._write(entries)
+
+    def _write(self, entries: List[tuple]):
+        # 清单写入失败不影响入库结果，只会导致下次重新提取
+        try:
+            self.store.upsert_manifest(entries)
+        except Exception as e:
+            logger.warning(f"Manifest write failed ({len(entries)} entries): {str(e)}")
+
+    @staticmethod
+    def _stable_mtime(mtime_ns: int, checked_ns: int) -> int:
+        """检查时刻与 mtime 过近时记录 0，强制下次比较哈希"""
+        return 0 if checked_ns - mtime_ns < _RACY_WINDOW_NS else mtime_ns
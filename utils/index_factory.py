@@ -0,0 +1,241 @@
+import argparse
+import logging
+import os
+from typing import Optional
+
+import faiss
+import numpy as np
+
+from config import (FAISS_INDEX_TYPE, HNSW_M, HNSW_EF_CONSTRUCTION, HNSW_EF_SEARCH,
+                    IVF_NLIST, IVF_NPROBE, PQ_M, PQ_NBITS, INDEX_TRAIN_SAMPLE)
+
+# 获取日志记录器
+logger = logging.getLogger(__name__)
+
+# 支持的索引类型（均使用内积，向量已做 L2 归一化，等价于余弦相似度）
+INDEX_TYPES = ("flat", "hnsw", "ivfflat", "ivfpq")
+
+
+def requires_training(index_type: str) -> bool:
+    """IVF 类索引在添加向量前需要训练"""
+    return index_type in ("ivfflat", "ivfpq")
+
+
+def min_training_size(index_type: str, nlist: int = IVF_NLIST, nbits: int = PQ_NBITS) -> int:
+    """训练所需的最少向量数"""
+    if index_type == "ivfflat":
+        return nlist
+    if index_type == "ivfpq":
+        return max(nlist, 2 ** nbits)
+    return 0
+
+
+def create_index(dim: int, index_type: str = FAISS_INDEX_TYPE,
+                 train_vectors: Optional[np.ndarray] = None) -> faiss.Index:
+    """
+    按类型创建 FAISS 索引。
+
+    :param dim: 向量维度
+    :param index_type: flat / hnsw / ivfflat / ivfpq
+    :param train_vectors: IVF 类索引的训练样本 (N, D)
+    :return: 已训练、可直接添加向量的空索引（外层为 IndexIDMap2，使用 add_with_ids 写入稳定ID）
+    """
+    index_type = index_type.lower()
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unsupported index type: {index_type}, expected one of {INDEX_TYPES}")
+
+    if index_type == "flat":
+        index = faiss.IndexFlatIP(dim)
+    elif index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    else:
+        quantizer = faiss.IndexFlatIP(dim)
+        if index_type == "ivfflat":
+            index = faiss.IndexIVFFlat(quantizer, dim, IVF_NLIST, faiss.METRIC_INNER_PRODUCT)
+        else:
+            if dim % PQ_M != 0:
+                raise ValueError(f"Vector dimension {dim} is not divisible by PQ_M={PQ_M}")
+            index = faiss.IndexIVFPQ(quantizer, dim, IVF_NLIST, PQ_M, PQ_NBITS, faiss.METRIC_INNER_PRODUCT)
+        train_index(index, index_type, train_vectors)
+
+    index = faiss.IndexIDMap2(index)
+    apply_search_params(index)
+    logger.info(f"Created FAISS index (type={index_type}, dim={dim})")
+    return index
+
+
+def has_id_map(index: faiss.Index) -> bool:
+    """索引是否使用显式ID（IndexIDMap / IndexIDMap2）"""
+    return isinstance(faiss.downcast_index(index), (faiss.IndexIDMap, faiss.IndexIDMap2))
+
+
+def index_ids(index: faiss.Index) -> np.ndarray:
+    """按存储位置顺序返回索引中全部向量的ID（旧版索引的ID即位置）"""
+    if has_id_map(index):
+        return faiss.vector_to_array(faiss.downcast_index(index).id_map).astype(np.int64)
+    return np.arange(index.ntotal, dtype=np.int64)
+
+
+def ensure_id_map(index: faiss.Index) -> faiss.Index:
+    """
+    将旧版按位置编号的索引包装为 IndexIDMap2，原位置即作为稳定ID，映射无需修改。
+    已训练的 IVF 索引通过克隆保留训练结果。
+    """
+    if has_id_map(index):
+        return index
+
+    vectors = reconstruct_all(index)
+    base = faiss.clone_index(index)
+    base.reset()
+    wrapped = faiss.IndexIDMap2(base)
+    if len(vectors):
+        wrapped.add_with_ids(vectors, np.arange(len(vectors), dtype=np.int64))
+    apply_search_params(wrapped)
+    logger.info(f"Wrapped legacy index with IndexIDMap2 ({wrapped.ntotal} vectors)")
+    return wrapped
+
+
+def remove_vectors(index: faiss.Index, ids) -> faiss.Index:
+    """
+    从索引中删除给定ID的向量，返回删除后的索引。
+
+    只有 Flat 索引原地 remove_ids（按顺序压缩存储，与 IndexIDMap2 的 id_map 保持对齐）；
+    IVF 类索引在倒排列表内用末尾元素填补删除位置，IndexIDMap2 外层的标签会与 id_map 错位，
+    HNSW 不支持删除，二者都重建为仅含存活向量的新索引（ID 不变，IVF 保留训练结果）。
+    """
+    ids = np.asarray(sorted(ids), dtype=np.int64)
+    if len(ids) == 0:
+        return index
+
+    if isinstance(faiss.downcast_index(_base_index(index)), faiss.IndexFlat):
+        removed = index.remove_ids(faiss.IDSelectorBatch(ids))
+        logger.info(f"Removed {removed} vectors from index")
+        return index
+    logger.info(f"Rebuilding index without {len(ids)} vectors")
+
+    all_ids = index_ids(index)
+    keep = ~np.isin(all_ids, ids)
+    vectors = reconstruct_all(index)[keep]
+    base = faiss.clone_index(_base_index(index))
+    base.reset()
+    rebuilt = faiss.IndexIDMap2(base)
+    if len(vectors):
+        rebuilt.add_with_ids(vectors, all_ids[keep])
+    apply_search_params(rebuilt)
+    return rebuilt
+
+
+def train_index(index: faiss.Index, index_type: str, vectors: Optional[np.ndarray]):
+    """使用向量样本训练索引"""
+    required = min_training_size(index_type)
+    if vectors is None or len(vectors) < required:
+        available = 0 if vectors is None else len(vectors)
+        raise ValueError(f"Index type {index_type} needs at least {required} training vectors, got {available}")
+
+    sample = sample_training_vectors(vectors)
+    logger.info(f"Training {index_type} index on {len(sample)} vectors")
+    index.train(sample)
+
+
+def sample_training_vectors(vectors: np.ndarray, max_samples: int = INDEX_TRAIN_SAMPLE, seed: int = 42) -> np.ndarray:
+    """从已有向量中随机抽取训练样本"""
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    if len(vectors) <= max_samples:
+        return vectors
+    rng = np.random.default_rng(seed)
+    return vectors[np.sort(rng.choice(len(vectors), max_samples, replace=False))]
+
+
+def apply_search_params(index: faiss.Index, nprobe: int = IVF_NPROBE, ef_search: int = HNSW_EF_SEARCH):
+    """设置部署级默认检索参数（nprobe / efSearch）"""
+    ivf = _extract_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = nprobe
+    hnsw = _extract_hnsw(index)
+    if hnsw is not None:
+        hnsw.hnsw.efSearch = ef_search
+
+
+def build_search_params(index: faiss.Index, nprobe: Optional[int] = None,
+                        ef_search: Optional[int] = None) -> Optional[faiss.SearchParameters]:
+    """
+    构造单次请求的检索参数，不修改共享索引对象，可在并发请求间安全使用。
+    索引类型不支持对应参数时返回 None。
+    """
+    if nprobe is not None and _extract_ivf(index) is not None:
+        return faiss.SearchParametersIVF(nprobe=nprobe)
+    if ef_search is not None and _extract_hnsw(index) is not None:
+        return faiss.SearchParametersHNSW(efSearch=ef_search)
+    return None
+
+
+def reconstruct_all(index: faiss.Index, start: int = 0) -> np.ndarray:
+    """取出索引中从存储位置 start 起的全部向量（按存储位置顺序，与 index_ids 一一对应）"""
+    index = _base_index(index)
+    if index.ntotal <= start:
+        return np.empty((0, index.d), dtype=np.float32)
+    if _extract_ivf(index) is not None:
+        faiss.extract_index_ivf(index).make_direct_map()
+    return index.reconstruct_n(start, index.ntotal - start)
+
+
+def reconstruct_ids(index: faiss.Index, ids) -> np.ndarray:
+    """按向量ID取出向量（不加载整个索引的向量）"""
+    positions = {int(doc_id): position for position, doc_id in enumerate(index_ids(index))}
+    base = _base_index(index)
+    if _extract_ivf(base) is not None:
+        faiss.extract_index_ivf(base).make_direct_map()
+    vectors = np.empty((len(ids), index.d), dtype=np.float32)
+    for row, doc_id in enumerate(ids):
+        vectors[row] = base.reconstruct(positions[int(doc_id)])
+    return vectors
+
+
+def migrate_index(src_path: str, dst_path: str, index_type: str) -> faiss.Index:
+    """
+    离线迁移：读取已有索引的全部向量，按新类型训练并重建。
+    向量连同原ID一起写入，映射无需修改。
+    """
+    src_index = faiss.read_index(src_path)
+    vectors = reconstruct_all(src_index)
+    ids = index_ids(src_index)
+    logger.info(f"Migrating {len(vectors)} vectors from {src_path} to {index_type}")
+
+    dst_index = create_index(src_index.d, index_type, train_vectors=vectors)
+    if len(vectors):
+        dst_index.add_with_ids(vectors, ids)
+
+    temp_path = f"{dst_path}.tmp"
+    faiss.write_index(dst_index, temp_path)
+    os.replace(temp_path, dst_path)
+    logger.info(f"Migrated index written to {dst_path} (ntotal={dst_index.ntotal})")
+    return dst_index
+
+
+def _extract_ivf(index: faiss.Index):
+    try:
+        return faiss.extract_index_ivf(index)
+    except RuntimeError:
+        return None
+
+
+def _extract_hnsw(index: faiss.Index):
+    index = faiss.downcast_index(_base_index(index))
+    return index if isinstance(index, faiss.IndexHNSW) else None
+
+
+def _base_index(index: faiss.Index) -> faiss.Index:
+    """去掉 IndexIDMap 外层，返回实际存储向量的索引"""
+    return faiss.downcast_index(index).index if has_id_map(index) else index
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrate a FAISS index to another index type offline")
+    parser.add_argument("src", help="source index path")
+    parser.add_argument("dst", help="destination index path (may equal src)")
+    parser.add_argument("--type", default=FAISS_INDEX_TYPE, choices=INDEX_TYPES, help="target index type")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    migrate_index(args.src, args.dst, args.type)
@@ -1,20 +1,71 @@
+import json
 import logging
-import openai
+from typing import AsyncIterator, Optional
 
-# 设置 OpenAI API 密钥和 base_url
-BASE_URL = "https://api.deepseek.com"  # 可以设置为自定义的 URL
+import aiohttp
 
-openai.api_base = BASE_URL  # 设置 base_url
+from config import (LLM_BASE_URL, LLM_MODEL, LLM_TIMEOUT, LLM_CONNECT_TIMEOUT,
+                    LLM_POOL_SIZE, LLM_KEEPALIVE_TIMEOUT)
 
 # 配置日志
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
 
-def call_llm_query(query: str, openApiKey:str) -> str:
-    # 创建 OpenAI 客户端
-    openai.api_key = openApiKey
-    """调用 OpenAI LLM 处理查询，支持自定义消息"""
-    logging.info(f"Calling LLM with query: {query}")
+# 进程内共享的 HTTP 会话（长连接池）
+_session: Optional[aiohttp.ClientSession] = None
+
+
+def _get_session() -> aiohttp.ClientSession:
+    """获取共享会话，首次调用时在当前事件循环中创建"""
+    global _session
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(limit=LLM_POOL_SIZE, keepalive_timeout=LLM_KEEPALIVE_TIMEOUT)
+        timeout = aiohttp.ClientTimeout(total=LLM_TIMEOUT, sock_connect=LLM_CONNECT_TIMEOUT)
+        _session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+    return _session
+
+
+async def close_llm_session():
+    """关闭共享会话（服务停止时调用）"""
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+
+async def _chat_completion(messages: list, openApiKey: str, temperature: float = 0.6, max_tokens: int = 512) -> str:
+    """调用 OpenAI 兼容的 chat/completions 接口"""
+    payload = {
+        "model": LLM_MODEL,
+        "messages": messages,
+        "temperature": temperature,  # 设置生成文本的随机性
+        "max_tokens": max_tokens  # 设置回答的最大长度
+    }
+    headers = {"Authorization": f"Bearer {openApiKey}"}
+
+    async with _get_session().post(f"{LLM_BASE_URL}/chat/completions", json=payload, headers=headers) as response:
+        data = await response.json(content_type=None)
+        if response.status != 200:
+            raise Exception(f"LLM API returned {response.status}: {data}")
+
+    # 检查响应
+    if 'choices' not in data or len(data['choices']) == 0:
+        raise Exception("No response choices returned from LLM API")
+
+    # 返回模型生成的答案
+    return data['choices'][0]['message']['content'].strip()
+
+
+def _context_size(content) -> int:
+    """上下文字符数（兼容单个字符串与文档列表）"""
+    if isinstance(content, str):
+        return len(content)
+    return sum(len(part) for part in content)
+
+
+async def call_llm_query(query: str, openApiKey: str) -> str:
+    """调用 LLM 将问题解析为关键词"""
+    logger.info(f"Calling LLM with query: {query}")
     try:
         custom_messages = [
             {
@@ -30,65 +81,94 @@ def call_llm_query(query: str, openApiKey:str) -> str:
             },
             {"role": "user", "content": f"Question: {query}"}
         ]
-
-        # 调用 OpenAI API 生成回答
-        response = openai.ChatCompletion.create(
-            model="deepseek-chat",  # 使用传入的模型名称
-            messages=custom_messages,  # 使用自定义的消息
-            temperature=0.6,  # 设置生成文本的随机性
-            max_tokens=512  # 设置回答的最大长度
-        )
-
-        # 检查响应
-        if 'choices' not in response or len(response['choices']) == 0:
-            raise Exception("No response choices returned from LLM API")
-
-        # 返回模型生成的答案
-        return response['choices'][0]['message']['content'].strip()
+        return await _chat_completion(custom_messages, openApiKey)
 
     except Exception as e:
         # 改进错误处理，捕获并返回详细的错误信息
         return f"Error calling LLM: {str(e)}"
 
-def call_llm(query: str, relevant_doc_content: str,openApiKey:str) -> str:
-    # 创建 OpenAI 客户端
-    openai.api_key = openApiKey
-    """调用 OpenAI LLM 处理查询，支持自定义消息"""
-    logging.info(f"Calling LLM with query: {query}")
-    logging.info(f"Relevant document content: {relevant_doc_content}")
-    try:
-        custom_messages = [
-            {
-                "role": "system",
-                "content": (
-                    "你是一名电力系统、电力市场研究专家，请严格根据提供的文档内容回答问题。"
-                    "遵循以下规则：\n"
-                    "1. 回答需基于文档事实，优先使用列表和结构化格式\n"
-                    "2. 如果文档信息不足，明确说明缺失信息\n"
-                    "3. 对不确定的内容标注置信度\n"
-                    "4. 保持回答简洁专业，避免冗余解释\n"
-                    "5. 保持保证学术、专业、数据支撑"
-                )
-            },
-            {"role": "user", "content": f"Document: {relevant_doc_content}"},
-            {"role": "user", "content": f"Question: {query}"}
-        ]
 
-        # 调用 OpenAI API 生成回答
-        response = openai.ChatCompletion.create(
-            model="deepseek-chat",  # 使用传入的模型名称
-            messages=custom_messages,  # 使用自定义的消息
-            temperature=0.6,  # 设置生成文本的随机性
-            max_tokens=512  # 设置回答的最大长度
-        )
+def format_context(content) -> str:
+    """将上下文段落拼接为提示词文本：每段带编号标题、段间空行（兼容单个字符串）"""
+    if isinstance(content, str):
+        return content
+    return "\n\n".join(f"[片段 {number}]\n{passage}" for number, passage in enumerate(content, 1))
+
 
-        # 检查响应
-        if 'choices' not in response or len(response['choices']) == 0:
-            raise Exception("No response choices returned from LLM API")
+def _answer_messages(query: str, relevant_doc_content) -> list:
+    """根据文档内容回答问题的提示词"""
+    return [
+        {
+            "role": "system",
+            "content": (
+                "你是一名电力系统、电力市场研究专家，请严格根据提供的文档内容回答问题。"
+                "遵循以下规则：\n"
+                "1. 回答需基于文档事实，优先使用列表和结构化格式\n"
+                "2. 如果文档信息不足，明确说明缺失信息\n"
+                "3. 对不确定的内容标注置信度\n"
+                "4. 保持回答简洁专业，避免冗余解释\n"
+                "5. 保持保证学术、专业、数据支撑"
+            )
+        },
+        {"role": "user", "content": f"Document:\n{format_context(relevant_doc_content)}"},
+        {"role": "user", "content": f"Question: {query}"}
+    ]
 
-        # 返回模型生成的答案
-        return response['choices'][0]['message']['content'].strip()
+
+async def call_llm(query: str, relevant_doc_content: str, openApiKey: str) -> str:
+    """调用 LLM 根据文档内容回答问题"""
+    logger.info(f"Calling LLM with query: {query}")
+    # 只记录上下文规模，不在日志中输出文档全文
+    logger.info(f"Relevant document content: {_context_size(relevant_doc_content)} characters")
+    try:
+        return await _chat_completion(_answer_messages(query, relevant_doc_content), openApiKey)
 
     except Exception as e:
         # 改进错误处理，捕获并返回详细的错误信息
         return f"Error calling LLM: {str(e)}"
+
+
+async def stream_llm(query: str, relevant_doc_content, openApiKey: str,
+                     temperature: float = 0.6, max_tokens: int = 512) -> AsyncIterator[str]:
+    """
+    流式调用 LLM（stream=True），逐段产出生成的文本。
+
+    调用方停止迭代或任务被取消时立即关闭上游连接，不再等待剩余生成内容；
+    出错时抛出异常，由调用方决定如何通知客户端。
+    """
+    logger.info(f"Streaming LLM answer for query: {query}")
+    logger.info(f"Relevant document content: {_context_size(relevant_doc_content)} characters")
+    payload = {
+        "model": LLM_MODEL,
+        "messages": _answer_messages(query, relevant_doc_content),
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+        "stream": True
+    }
+    headers = {"Authorization": f"Bearer {openApiKey}", "Accept": "text/event-stream"}
+
+    response = await _get_session().post(f"{LLM_BASE_URL}/chat/completions", json=payload, headers=headers)
+    finished = False
+    try:
+        if response.status != 200:
+            raise Exception(f"LLM API returned {response.status}: {await response.text()}")
+
+        # OpenAI 兼容的 SSE：每行 "data: {...}"，以 "data: [DONE]" 结束，":" 开头的行为保活注释
+        async for raw_line in response.content:
+            line = raw_line.decode("utf-8").strip()
+            if not line.startswith("data:"):
+                continue
+            data = line[len("data:"):].strip()
+            if data == "[DONE]":
+                break
+            choices = json.loads(data).get("choices") or []
+            delta = choices[0].get("delta", {}).get("content") if choices else None
+            if delta:
+                yield delta
+        finished = True
+    finally:
+        if finished:
+            response.release()
+        else:
+            # 未读完（客户端断开、取消或出错）时直接断开连接，终止上游生成
+            response.close()
@@ -1,19 +1,30 @@
+import atexit
 import hashlib
-import json
 import logging
 import os
+import re
 import threading
 from pathlib import Path
-from typing import Dict, Optional
-import jieba
+from typing import Dict, List, Optional, Set, Tuple
 import faiss
 import numpy as np
-import portalocker
 import unicodedata
 
-from utils.faiss_utils import load_faiss_index, save_faiss_index
-from config import FILES_PATH, MAPPING_PATH
-from utils.sentence_model import get_model, encode_text
+from utils.faiss_utils import acquire_writer_lock, load_faiss_index, save_faiss_index
+from config import (FILES_PATH, MAPPING_DB_PATH, FAISS_INDEX_PATH, INDEX_GRANULARITY, CHUNK_INDEX_PATH, CHUNK_MAP_PATH,
+                    COMPACT_MIN_TOMBSTONES, COMPACT_TOMBSTONE_RATIO, HYBRID_SEARCH, CHUNKER)
+from utils.answer_cache import answer_cache
+from utils.bm25_index import get_bm25_index, tokenize_terms
+from utils.chunk_map import ChunkMap
+from utils.chunker import sentence_chunk_spans
+from utils.commit_log import CommitScheduler
+from utils.content_store import ContentStore
+from utils.file_manifest import FileManifest, fingerprint
+from utils.index_factory import (has_id_map, ensure_id_map, index_ids, remove_vectors, reconstruct_all,
+                                 apply_search_params)
+from utils.mapping_store import get_mapping_store
+from utils.metrics import INGEST_STAGE_SECONDS, record_ingest_result
+from utils.batch_encoder import encode_chunks
 from utils.text_processing import extract_file_content
 
 # 获取日志记录器
@@ -34,7 +45,7 @@ def calculate_md5_from_text(text: str,
     - text: 输入文本
     - normalization_form: Unicode标准化形式 (可选：NFC, NFD, NFKC, NFKD)
     - strip_whitespace: 是否移除首尾空白字符
-    - chunk_size: 流式处理块大小（字节）
+    - chunk_size: 流式处理块大小（字符），逐块编码，不生成整段文本的字节副本
 
     返回：
     - MD5哈希字符串（小写），或 None（输入无效时）
@@ -55,13 +66,10 @@ def calculate_md5_from_text(text: str,
         if not processed_text:
             raise ValueError("Normalized text is empty after processing")
 
-        # 流式处理大文本
+        # 流式处理大文本（按字符切分后分别编码，结果与整体编码相同）
         md5_hash = hashlib.md5()
-        buffer = processed_text.encode('utf-8')
-
-        for i in range(0, len(buffer), chunk_size):
-            chunk = buffer[i:i + chunk_size]
-            md5_hash.update(chunk)
+        for i in range(0, len(processed_text), chunk_size):
+            md5_hash.update(processed_text[i:i + chunk_size].encode('utf-8'))
 
         return md5_hash.hexdigest().lower()
 
@@ -73,6 +81,10 @@ def calculate_md5_from_text(text: str,
         return None
 
 
+class IndexWriterBusy(RuntimeError):
+    """索引写入锁由其他进程持有（多进程部署中本进程只提供查询）"""
+
+
 class FileIndexState:
     """管理索引状态的单例类"""
     _instance = None
@@ -81,6 +93,9 @@ class FileIndexState:
     def __new__(cls):
         with cls._lock:
             if cls._instance is None:
+                # 多进程部署时只有持有写入锁的进程可以修改索引
+                if not acquire_writer_lock():
+                    raise IndexWriterBusy("Index writer lock is held by another process")
                 cls._instance = super().__new__(cls)
                 cls._instance._initialize()
             return cls._instance
@@ -90,202 +105,599 @@ class FileIndexState:
         self.file_id_map: Dict[int, str] = {}
         self.file_path_map: Dict[str, str] = {}
         self.faiss_index: Optional[faiss.Index] = None
+        self.chunk_map: Optional[ChunkMap] = ChunkMap.load(CHUNK_MAP_PATH) if INDEX_GRANULARITY == "chunk" else None
+        self.index_path = CHUNK_INDEX_PATH if self.chunk_map is not None else FAISS_INDEX_PATH
+        self.scope = "chunk" if self.chunk_map is not None else "document"
+        self.next_id = 0  # 下一个可分配的向量ID，写入方首次加载索引时确定
+        self._compact_lock = threading.Lock()
+        # 倒排索引与向量索引使用相同的ID
+        self.lexical = get_bm25_index(self.scope) if HYBRID_SEARCH else None
+
+        # 已删除但尚未压缩的向量ID
+        self.tombstones: Set[int] = get_mapping_store().get_tombstones(self.scope)
+        if self.chunk_map is not None:
+            self.chunk_map.discard_ids(self.tombstones)
         self.load_mappings()
 
+        # 升级后首次启动时为已有文档建立倒排索引
+        _backfill_lexical_index(self)
+
+        # 组提交：回放上次检查点之后的日志，退出时提交剩余文档
+        self.commit = CommitScheduler(self)
+        self.commit.replay(lambda record, vectors: _replay_record(self, record, vectors))
+        atexit.register(self.commit.close)
+
+    def persist(self):
+        """将索引、块映射与文档映射整体落盘（调用方持有 _lock）"""
+        # 倒排索引先落盘：其后步骤失败时日志回放按ID跳过已落盘的文档，不会丢失词项
+        if self.lexical is not None:
+            self.lexical.flush()
+        if self.faiss_index is not None:
+            save_faiss_index(self.faiss_index, self.index_path)
+        if self.chunk_map is not None:
+            self.chunk_map.save(CHUNK_MAP_PATH)
+        self._write_mappings()
+        if self.faiss_index is not None:
+            get_mapping_store().set_meta(f"next_id_{self.scope}", self.next_id)
+
+    def is_indexed(self, md5: str) -> bool:
+        """判断文档是否已写入当前粒度的索引"""
+        if self.chunk_map is not None:
+            return md5 in self.chunk_map
+        return md5 in self.file_path_map
+
     def load_mappings(self):
-        """加载映射关系"""
+        """从映射存储加载映射关系"""
         try:
-            logger.debug(f"Attempting to load mappings from: {MAPPING_PATH}")
-
-            # 检查文件是否存在
-            if Path(MAPPING_PATH).exists():
-                # 检查文件读取权限
-                if not os.access(MAPPING_PATH, os.R_OK):
-                    logger.error(f"File {MAPPING_PATH} is not readable due to permission issues.")
-                    raise PermissionError(f"File {MAPPING_PATH} is not readable due to permission issues.")
-
-                try:
-                    # 读取文件内容作为字符串
-                    with open(MAPPING_PATH, 'r', encoding='utf-8') as file:
-                        content = file.read()
-
-                    # 输出内容以检查文件格式
-                    logger.debug(f"File content: {content}")
-
-                    # 尝试解析 JSON
-                    data = json.loads(content)
-
-                    # 解析文件内容
-                    self.file_id_map = {int(k): v for k, v in data['file_id_map'].items()}
-                    self.file_path_map = data['file_path_map']
-
-                    logger.info("Mappings loaded successfully")
-
-                except json.JSONDecodeError as json_error:
-                    logger.error(f"Failed to decode JSON from {MAPPING_PATH}: {json_error}")
-                    self._create_new_mappings()
-                except Exception as e:
-                    logger.error(f"Failed to load mappings: {str(e)}")
-                    self._create_new_mappings()
-            else:
-                self._create_new_mappings()
-
-        except portalocker.LockException as lock_error:
-            logger.error(f"Failed to acquire lock for {MAPPING_PATH}: {lock_error}")
-            raise lock_error
+            logger.debug(f"Attempting to load mappings from: {MAPPING_DB_PATH}")
+            self.file_id_map, self.file_path_map = get_mapping_store().load_all()
+            logger.info(f"Mappings loaded successfully ({len(self.file_path_map)} documents)")
+        except Exception as e:
+            logger.error(f"Failed to load mappings: {str(e)}")
+            self._create_new_mappings()
+        self._dirty_ids = set()
+        self._dirty_md5s = set()
 
     def _create_new_mappings(self):
-        """创建新的映射文件"""
+        """创建新的映射"""
         self.file_id_map = {}
         self.file_path_map = {}
-        self.save_mappings()
         logger.info("New mappings created")
 
     def save_mappings(self):
         """保存当前状态到磁盘"""
         try:
-            with portalocker.Lock(MAPPING_PATH, mode='w', timeout=5) as f:
-                json.dump({
-                    'file_id_map': self.file_id_map,
-                    'file_path_map': self.file_path_map
-                }, f, indent=2)
-            logger.info("Mappings saved successfully")
+            self._write_mappings()
         except Exception as e:
             logger.error(f"Failed to save mappings: {str(e)}")
 
+    def _write_mappings(self):
+        """将上次落盘后新增的映射批量写入存储"""
+        if not self._dirty_ids and not self._dirty_md5s:
+            return
+        get_mapping_store().bulk_upsert(
+            {doc_id: self.file_id_map[doc_id] for doc_id in self._dirty_ids},
+            {md5: self.file_path_map[md5] for md5 in self._dirty_md5s}
+        )
+        logger.info(f"Mappings saved successfully ({len(self._dirty_md5s)} documents)")
+        self._dirty_ids.clear()
+        self._dirty_md5s.clear()
+
 
 def process_local_file(state, file_path: str) -> dict:
     filename = os.path.basename(file_path)
 
     try:
-        # 文本提取与验证
-        content = extract_file_content(file_path)
-        logger.info(f"Extracted content from {content}")
-        if not content:
-            return {"status": "skipped", "reason": "empty_content", "file": filename}
-
-        # MD5计算与重复检查
-        file_md5 = calculate_md5_from_text(content)
-        logger.info(f"Calculated MD5: {file_md5}")
-        if file_md5 in state.file_path_map:
-            logger.info(f"File exists: {filename} (MD5: {file_md5})")
-            return {"status": "exists", "md5": file_md5, "file": filename}
-
-        # 处理长文本
-        chunks = chunk_text(content)  # 长文本拆分成多个块
-        embeddings = []
-
-        # 为每个文本块生成嵌入
-        for chunk in chunks:
-            vector = _encode_file_content(chunk)  # 处理每个文本块
-            embeddings.append(vector)
+        # 文件清单中未变化的文件无需重新提取
+        manifest = FileManifest()
+        if not manifest.changed_files([file_path], state.is_indexed):
+            result = {"status": "unchanged", "file": filename}
+            record_ingest_result(result)
+            return result
+
+        with INGEST_STAGE_SECONDS.time(stage="extract"):
+            extracted = extract_and_chunk(file_path)
+        prepared = _register_extracted(state, extracted)
+        if "status" not in prepared:
+            # 批量编码所有文本块
+            with INGEST_STAGE_SECONDS.time(stage="embed"):
+                embeddings = encode_chunks(prepared["chunks"])
+            with INGEST_STAGE_SECONDS.time(stage="write"):
+                prepared = _finalize_file(state, prepared, embeddings)
+
+        _record_manifest(manifest, extracted, prepared)
+        manifest.flush()
+        record_ingest_result(prepared)
+        return prepared
 
-        # 聚合多个块的嵌入
-        aggregated_vector = aggregate_embeddings(embeddings)
+    except Exception as e:
+        logger.error(f"Error processing {filename}: {str(e)}", exc_info=True)
+        result = {"status": "error", "reason": str(e), "file": filename}
+        record_ingest_result(result)
+        return result
 
-        # 索引更新
-        doc_id = _update_index(state, aggregated_vector, file_md5, file_path)
 
-        return {"status": "success", "md5": file_md5, "id": doc_id, "file": filename}
+def extract_and_chunk(file_path: str) -> dict:
+    """提取文本、计算MD5并分块（不访问共享状态，可在子进程中执行）"""
+    filename = os.path.basename(file_path)
 
-    except Exception as e:
-        logger.error(f"Error processing {filename}: {str(e)}", exc_info=True)
-        return {"status": "error", "reason": str(e), "file": filename}
+    # 原始文件指纹（写入文件清单，下次同步时跳过未变化的文件）
+    file_fingerprint = fingerprint(file_path)
 
+    # 文本提取与验证
+    content = extract_file_content(file_path)
+    logger.info(f"Extracted content from {filename} ({len(content)} chars)")
+    if not content:
+        return {"status": "skipped", "reason": "empty_content", "file": filename, "path": file_path,
+                "fingerprint": file_fingerprint}
 
-def _encode_file_content(content: str) -> np.ndarray:
-    """编码文本内容并进行 L2 归一化"""
-    model = get_model()
+    # MD5计算
+    file_md5 = calculate_md5_from_text(content)
+    if file_md5 is None:
+        # 无法计算MD5时不入库、不记入文件清单（下次同步重试）
+        return {"status": "error", "reason": "md5_failed", "file": filename, "path": file_path}
+    logger.info(f"Calculated MD5: {file_md5}")
 
-    # 对中文文本进行分词
-    tokenized_text = " ".join(jieba.cut(content))  # 使用jieba分词
+    # 处理长文本
+    chunks, spans = chunk_text_with_spans(content)  # 长文本拆分成多个块
 
-    # 将分词后的文本输入模型进行嵌入
-    vector = encode_text(model, tokenized_text)
-    vector = np.array(vector, dtype=np.float32).reshape(1, -1)  # 确保返回的是二维数组
-    vector = vector / np.linalg.norm(vector, axis=1, keepdims=True)  # L2 normalization
-    return vector
+    # 倒排索引词频：与向量索引粒度一致（整篇文档或每个文本块）
+    terms = None
+    if HYBRID_SEARCH:
+        terms = [tokenize_terms(chunk) for chunk in chunks] if INDEX_GRANULARITY == "chunk" else [tokenize_terms(content)]
 
+    return {"md5": file_md5, "file": filename, "path": file_path, "content": content,
+            "chunks": chunks, "spans": spans, "terms": terms, "fingerprint": file_fingerprint}
 
-def chunk_text(text: str, max_tokens: int = 128) -> list:
-    """滑动窗口分块函数 (改进版)
 
-    参数：
-    - text: 输入文本
-    - max_tokens: 窗口大小（每个块的token数量）
+def _register_extracted(state, extracted: dict, in_flight: Optional[set] = None) -> dict:
+    """保存提取文本并做重复检查；返回带 status 的字典表示无需继续编码"""
+    if "status" in extracted:
+        if extracted.get("reason") == "empty_content":
+            # 文件被清空：删除该路径之前的版本
+            _retire_stale_versions(state, extracted["path"], None)
+        return extracted
 
-    返回：
-    - 包含文本块的列表，相邻块有50%重叠
+    file_md5 = extracted["md5"]
+    content = extracted.pop("content")
 
-    示例：
-    输入: "a b c d e f g", max_tokens=4
-    输出: ["a b c d", "c d e f", "e f g"]
+    # 保存提取后的文本，查询时直接读取无需重新解析文件
+    content_store = ContentStore()
+    if file_md5 and not content_store.contains(file_md5):
+        content_store.put(file_md5, content)
+
+    if state.is_indexed(file_md5) or (in_flight is not None and file_md5 in in_flight):
+        logger.info(f"File exists: {extracted['file']} (MD5: {file_md5})")
+        _retire_stale_versions(state, extracted["path"], file_md5)
+        return {"status": "exists", "md5": file_md5, "file": extracted["file"]}
+
+    return extracted
+
+
+def _record_manifest(manifest, extracted: dict, result: dict):
+    """文件处理成功、已存在或内容为空时记入文件清单（出错的文件下次重试）"""
+    if result.get("status") not in ("success", "exists", "skipped") or "path" not in extracted:
+        return
+    if result.get("status") != "skipped" and not extracted.get("md5"):
+        logger.warning(f"Not recording {extracted['path']} in manifest: missing MD5")
+        return
+    manifest.record(extracted["path"], extracted.get("fingerprint"), extracted.get("md5"))
+
+
+def _finalize_file(state, prepared: dict, embeddings: np.ndarray) -> dict:
+    """聚合文本块向量并写入索引"""
+    if state.chunk_map is not None:
+        # 块级索引：每个文本块单独入库
+        first_id = _update_chunk_index(state, embeddings, prepared["md5"], prepared["path"], prepared["spans"],
+                                       prepared.get("terms"))
+        result = {"status": "success", "md5": prepared["md5"], "id": first_id,
+                  "chunks": len(prepared["spans"]), "file": prepared["file"]}
+    else:
+        # 聚合多个块的嵌入
+        aggregated_vector = aggregate_embeddings(embeddings)
+
+        # 索引更新
+        doc_id = _update_index(state, aggregated_vector, prepared["md5"], prepared["path"], prepared.get("terms"))
+        result = {"status": "success", "md5": prepared["md5"], "id": doc_id, "file": prepared["file"]}
+
+    # 文件内容变化时新版本入库后删除旧版本
+    _retire_stale_versions(state, prepared["path"], prepared["md5"])
+    return result
+
+
+def _encode_file_content(content: str) -> np.ndarray:
+    """编码文本内容并进行 L2 归一化"""
+    return encode_chunks([content])
+
+
+def chunk_spans(text: str, max_tokens: int = 128) -> List[Tuple[int, int]]:
+    """滑动窗口分块，返回每个块在原文中的字符区间 (start, end)
+
+    分块规则与 chunk_text 一致，相邻块有50%重叠
     """
-    tokens = text.split()
-    chunks = []
-    total_tokens = len(tokens)
+    token_spans = [match.span() for match in re.finditer(r'\S+', text)]
+    total_tokens = len(token_spans)
 
     # 自动计算重叠步长（默认50%重叠）
     step_size = max(max_tokens // 2, 1)  # 保证最小步长为1
 
     # 边界情况处理
+    if total_tokens == 0:
+        return [(0, 0)]
     if total_tokens <= max_tokens:
-        return [" ".join(tokens)]
+        return [(token_spans[0][0], token_spans[-1][1])]
 
     # 生成滑动窗口块
+    spans = []
     start_idx = 0
     while start_idx < total_tokens:
         end_idx = min(start_idx + max_tokens, total_tokens)
-        current_chunk = tokens[start_idx:end_idx]
+        window_start = start_idx
 
         # 当剩余token不足时，向前扩展窗口
-        if len(current_chunk) < max_tokens and start_idx > 0:
-            required = max_tokens - len(current_chunk)
-            current_chunk = tokens[max(0, start_idx - required):end_idx]
+        if end_idx - start_idx < max_tokens and start_idx > 0:
+            required = max_tokens - (end_idx - start_idx)
+            window_start = max(0, start_idx - required)
 
-        chunks.append(" ".join(current_chunk))
+        spans.append((token_spans[window_start][0], token_spans[end_idx - 1][1]))
         start_idx += step_size
 
         # 防止最后一个块重复
         if end_idx == total_tokens:
             break
 
-    return chunks
+    return spans
+
+
+def document_chunk_spans(text: str, max_tokens: int = 128, chunker: str = CHUNKER) -> List[Tuple[int, int]]:
+    """
+    按配置的分块方式返回字符区间：sentence 按句切分并以模型分词器计数（窗口由 CHUNK_MAX_TOKENS
+    与模型最大序列长度决定，忽略 max_tokens）；whitespace 为按空白分词的滑动窗口
+    """
+    if chunker == "sentence":
+        return sentence_chunk_spans(text)
+    return chunk_spans(text, max_tokens)
+
+
+def chunk_text_with_spans(text: str, max_tokens: int = 128,
+                          chunker: str = CHUNKER) -> Tuple[List[str], List[Tuple[int, int]]]:
+    """分块并同时返回块文本与字符区间"""
+    spans = document_chunk_spans(text, max_tokens, chunker)
+    chunks = [" ".join(text[start:end].split()) for start, end in spans]
+    return chunks, spans
+
+
+def chunk_text(text: str, max_tokens: int = 128) -> list:
+    """滑动窗口分块函数 (改进版)
+
+    参数：
+    - text: 输入文本
+    - max_tokens: 窗口大小（每个块的token数量）
+
+    返回：
+    - 包含文本块的列表，相邻块有50%重叠
+
+    示例：
+    输入: "a b c d e f g", max_tokens=4
+    输出: ["a b c d", "c d e f", "e f g"]
+    """
+    return chunk_text_with_spans(text, max_tokens, chunker="whitespace")[0]
 
 def aggregate_embeddings(embeddings: list) -> np.ndarray:
     """对多个嵌入进行平均池化合并"""
     return np.mean(np.vstack(embeddings), axis=0)
 
-def _update_index(state, vector, file_md5, file_path) -> int:
-    """更新索引和映射"""
-    if state.faiss_index is None:
-        state.faiss_index = load_faiss_index()
+def _writable_index(state) -> faiss.Index:
+    """返回写入方的可写索引（调用方持有 state._lock），首次调用时加载并确定下一个可分配ID"""
+    if state.faiss_index is not None:
+        return state.faiss_index
+
+    # 写入方持有独立的可写副本，不与查询路径共享缓存
+    index = load_faiss_index(use_cache=False, index_path=state.index_path)
+    if not has_id_map(index):
+        # 旧版索引以位置为ID，包装为 IndexIDMap2 后立即落盘，映射保持不变
+        index = ensure_id_map(index)
+        if index.ntotal:
+            save_faiss_index(index, state.index_path)
+    state.faiss_index = index
+
+    if state.chunk_map is not None:
+        # 块ID即文本块在映射中的位置（失效块保留位置）
+        state.next_id = len(state.chunk_map)
+    else:
+        ids = index_ids(index)
+        state.next_id = max(get_mapping_store().get_meta(f"next_id_{state.scope}", 0),
+                            int(ids.max()) + 1 if len(ids) else 0,
+                            max(state.file_id_map, default=-1) + 1)
+    return index
+
+
+def _apply_to_index(state, vectors: np.ndarray, file_md5: str, file_path: str, spans=None,
+                    first_id: Optional[int] = None, terms: Optional[List[Dict[str, int]]] = None) -> int:
+    """在内存中写入向量、映射与倒排词频（调用方持有 state._lock），返回文档ID或首个块ID"""
+    index = _writable_index(state)
+    if state.chunk_map is not None:
+        first_id = len(state.chunk_map)
+    elif first_id is None:
+        first_id = state.next_id
+
+    index.add_with_ids(vectors, np.arange(first_id, first_id + len(vectors), dtype=np.int64))
+    state.next_id = max(state.next_id, first_id + len(vectors))
+
+    if state.chunk_map is not None:
+        state.chunk_map.add(file_md5, spans)
+    else:
+        state.file_id_map[first_id] = file_md5
+        state._dirty_ids.add(first_id)
+
+    if state.lexical is not None and terms is not None:
+        state.lexical.add(range(first_id, first_id + len(vectors)), terms)
+
+    state.file_path_map[file_md5] = file_path
+    state._dirty_md5s.add(file_md5)
+
+    # 文档重新入库后，引用它的缓存答案失效
+    answer_cache.invalidate_documents([file_md5])
+    return first_id
+
+
+def _replay_record(state, record: dict, vectors: np.ndarray) -> bool:
+    """回放一条提交日志记录，已存在的文档跳过"""
+    if state.is_indexed(record["md5"]):
+        return False
+    if state.chunk_map is not None and "spans" not in record:
+        logger.warning(f"Skipping document-level log record in chunk mode: {record['md5']}")
+        return False
+
+    first_id = record.get("first_id")
+    terms = _lexical_terms(record["md5"], record["path"], record.get("spans")) if state.lexical is not None else None
+    _apply_to_index(state, vectors, record["md5"], record["path"], record.get("spans"), first_id, terms)
+    if first_id is not None and first_id in state.tombstones:
+        # 写入日志后文档已被删除：按原ID写入以保持后续ID一致，再标记为已删除
+        _forget_document(state, record["md5"])
+    return True
+
+
+def _lexical_terms(file_md5: str, file_path: str, spans=None) -> Optional[List[Dict[str, int]]]:
+    """从文本存储重新计算倒排词频（日志回放与倒排索引回填时使用）"""
+    content = ContentStore().get(file_md5)
+    if content is None and os.path.exists(file_path):
+        content = extract_file_content(file_path)
+        if calculate_md5_from_text(content) != file_md5:
+            content = None
+    if content is None:
+        logger.warning(f"Content unavailable for lexical index: {file_path} (MD5: {file_md5})")
+        return None
+    if spans is None:
+        return [tokenize_terms(content)]
+    return [tokenize_terms(content[start:end]) for start, end in spans]
+
+
+def _backfill_lexical_index(state) -> int:
+    """
+    倒排索引为空而向量索引已有文档时（如升级后首次启动），从文本存储回填。
+    在状态初始化、日志回放之前执行（此时已持有 state._lock），保证回填的ID早于回放文档。
+    回填后记录标记，没有可恢复的文本时也不会在每次启动重复扫描。
+    """
+    if state.lexical is None or state.lexical.is_backfilled() or state.lexical.doc_count() > 0:
+        return 0
+
+    if state.chunk_map is not None:
+        documents = [(md5, state.chunk_map.ids_for(md5)) for md5 in dict.fromkeys(state.chunk_map.md5s)
+                     if md5 in state.chunk_map]
+    else:
+        documents = [(md5, np.array([doc_id])) for doc_id, md5 in sorted(state.file_id_map.items())]
+    if not documents:
+        state.lexical.mark_backfilled()
+        return 0
+
+    entries = []
+    for md5, ids in documents:
+        spans = None
+        if state.chunk_map is not None:
+            spans = [(int(state.chunk_map.offsets[i]), int(state.chunk_map.offsets[i] + state.chunk_map.lengths[i]))
+                     for i in ids]
+        terms = _lexical_terms(md5, state.file_path_map.get(md5, ""), spans)
+        if terms is not None:
+            entries.extend(zip(ids.tolist(), terms))
+
+    # 倒排列表要求ID递增
+    entries.sort(key=lambda entry: entry[0])
+    state.lexical.add([doc_id for doc_id, _ in entries], [terms for _, terms in entries])
+    state.lexical.flush()
+    state.lexical.mark_backfilled()
+    logger.info(f"Lexical index backfilled with {len(documents)} documents ({len(entries)} entries)")
+    return len(documents)
+
+
+def _forget_document(state, file_md5: str) -> Optional[Tuple[Optional[str], List[int]]]:
+    """从内存状态中移除文档（调用方持有 state._lock），返回 (文件路径, 向量ID列表)"""
+    if not state.is_indexed(file_md5):
+        return None
+
+    path = state.file_path_map.pop(file_md5, None)
+    state._dirty_md5s.discard(file_md5)
+    if state.chunk_map is not None:
+        ids = state.chunk_map.discard(file_md5).tolist()
+    else:
+        ids = [doc_id for doc_id, md5 in state.file_id_map.items() if md5 == file_md5]
+        for doc_id in ids:
+            del state.file_id_map[doc_id]
+            state._dirty_ids.discard(doc_id)
+    return path, ids
+
+
+def delete_document(state, file_md5: str) -> dict:
+    """
+    删除文档：映射立即删除并记录墓碑（查询方随即过滤这些ID），
+    向量在墓碑数量超过阈值后由后台压缩从索引中移除。
+    """
+    with state._lock:
+        forgotten = _forget_document(state, file_md5)
+        if forgotten is None:
+            return {"status": "not_found", "md5": file_md5}
+        path, ids = forgotten
+        state.tombstones.update(ids)
+        get_mapping_store().delete_documents(state.scope, [file_md5], ids)
+
+    answer_cache.invalidate_documents([file_md5])
+    ContentStore().remove(file_md5)
+    logger.info(f"Document deleted: {path} (MD5: {file_md5}, vectors={len(ids)})")
+
+    maybe_compact(state)
+    return {"status": "deleted", "md5": file_md5, "file": path, "vectors": len(ids)}
+
 
+def update_document(state, file_path: str) -> dict:
+    """重新入库单个文件：内容变化时写入新版本并删除旧版本，文件不存在时删除其文档"""
+    filename = os.path.basename(file_path)
+    if not os.path.exists(file_path):
+        removed = _retire_stale_versions(state, file_path, None)
+        FileManifest().forget([file_path])
+        return {"status": "deleted" if removed else "not_found", "file": filename, "removed": removed}
+
+    result = process_local_file(state, file_path)
+    # 立即落盘，查询方无需等待下一次组提交
+    state.commit.checkpoint()
+    return result
+
+
+def _retire_stale_versions(state, file_path: str, current_md5: Optional[str]) -> List[str]:
+    """删除同一文件路径下除 current_md5 以外的旧版本文档，返回被删除的MD5"""
+    candidates = set(get_mapping_store().get_md5s_for_path(file_path))
+    with state._lock:
+        candidates.update(md5 for md5 in state._dirty_md5s if state.file_path_map.get(md5) == file_path)
+        stale = [md5 for md5 in candidates if md5 != current_md5 and state.file_path_map.get(md5) == file_path]
+
+    for md5 in stale:
+        logger.info(f"Retiring stale version of {file_path} (MD5: {md5})")
+        delete_document(state, md5)
+    return stale
+
+
+def maybe_compact(state) -> bool:
+    """墓碑数量超过阈值时在后台线程压缩索引"""
+    with state._lock:
+        total = state.faiss_index.ntotal if state.faiss_index is not None else len(state.tombstones)
+        count = len(state.tombstones)
+        if count < COMPACT_MIN_TOMBSTONES or count < COMPACT_TOMBSTONE_RATIO * total:
+            return False
+    if state._compact_lock.locked():
+        return False
+
+    threading.Thread(target=compact_index, args=(state,), name="index-compaction", daemon=True).start()
+    return True
+
+
+# 压缩切换前持锁补入的新增向量上限，超过时先在锁外补入
+_COMPACT_CATCHUP_BATCH = 256
+
+
+def compact_index(state) -> dict:
+    """
+    从索引中移除全部墓碑向量，落盘后清除墓碑
+
+    持锁时只克隆索引快照，移除与重建（HNSW / IVF 为整体重建）在锁外进行，不阻塞入库与更新；
+    重建期间新增的向量在切换前补入新索引，期间新产生的墓碑不在本次清除范围内，留待下次压缩。
+    """
+    with state._compact_lock:
+        try:
+            with state._lock:
+                ids = set(state.tombstones)
+                if not ids:
+                    return {"removed": 0, "ntotal": state.faiss_index.ntotal if state.faiss_index is not None else 0}
+                index = _writable_index(state)
+                before = index.ntotal
+                snapshot = faiss.clone_index(index)
+
+            compacted = remove_vectors(snapshot, ids)
+
+            # 压缩期间追加的向量位于存储末尾（只有压缩会删除向量，且压缩互斥）：
+            # 持锁只取出新增部分，在锁外补入新索引，直到剩余量很小时再持锁补齐并切换
+            position = before
+            while True:
+                with state._lock:
+                    if state.faiss_index is not index:
+                        raise RuntimeError("Writable index was replaced during compaction")
+                    vectors, added_ids = reconstruct_all(index, position), index_ids(index)[position:]
+                    position = index.ntotal
+                    if len(added_ids) <= _COMPACT_CATCHUP_BATCH:
+                        if len(added_ids):
+                            compacted.add_with_ids(vectors, added_ids)
+                        apply_search_params(compacted)
+                        state.faiss_index = compacted
+                        ntotal = compacted.ntotal
+                        before = index.ntotal
+                        break
+                compacted.add_with_ids(vectors, added_ids)
+
+            # 先落盘压缩后的索引再清除墓碑；两步之间崩溃时墓碑仍在，查询照常过滤
+            state.commit.checkpoint(force=True)
+            if state.lexical is not None:
+                # 倒排索引内部串行化落盘与删除，不占用状态锁
+                state.lexical.remove_documents(ids)
+            get_mapping_store().clear_tombstones(state.scope, ids)
+            with state._lock:
+                state.tombstones.difference_update(ids)
+        except Exception as e:
+            logger.error(f"Index compaction failed: {str(e)}", exc_info=True)
+            return {"removed": 0, "error": str(e)}
+
+    logger.info(f"Index compacted: removed {before - ntotal} vectors, {ntotal} remaining")
+    return {"removed": before - ntotal, "ntotal": ntotal}
+
+
+def _update_index(state, vector, file_md5, file_path, terms=None) -> int:
+    """更新索引和映射（由组提交调度器统一落盘）"""
     # 确保向量是二维的 (n, d)
     if vector.ndim == 1:
         vector = vector.reshape(1, -1)  # 将一维向量转换为二维数组
-
-    state.faiss_index.add(vector)
-    doc_id = state.faiss_index.ntotal - 1
+    vector = np.asarray(vector, dtype=np.float32)
 
     with state._lock:
-        state.file_id_map[doc_id] = file_md5
-        state.file_path_map[file_md5] = file_path
-        state.save_mappings()
+        doc_id = _apply_to_index(state, vector, file_md5, file_path, terms=terms)
+        state.commit.append(file_md5, file_path, vector, first_id=doc_id)
 
-    save_faiss_index(state.faiss_index)
+    state.commit.maybe_checkpoint()
     return doc_id
 
 
-def process_files_in_directory(state, directory_path: str) -> None:
-    """处理文件夹中的所有文件"""
+def _update_chunk_index(state, vectors: np.ndarray, file_md5: str, file_path: str, spans, terms=None) -> int:
+    """块级索引：写入文本块向量及 chunk_id -> (md5, offset, length) 映射"""
+    vectors = np.asarray(vectors, dtype=np.float32).reshape(len(spans), -1)
+
+    with state._lock:
+        first_id = _apply_to_index(state, vectors, file_md5, file_path, spans, terms=terms)
+        state.commit.append(file_md5, file_path, vectors, spans, first_id=first_id)
+
+    state.commit.maybe_checkpoint()
+    return first_id
+
+
+def process_files_in_directory(state, directory_path: str) -> Optional[dict]:
+    """处理文件夹中的所有文件（提取、编码、写入分阶段并行执行），返回流水线统计"""
     if not os.path.isdir(directory_path):
         logger.error(f"The provided path is not a valid directory: {directory_path}")
-        return
+        return None
 
     logger.info(f"Processing files in directory: {directory_path}")
-    for root, _, files in os.walk(directory_path):
-        for file in files:
-            file_path = os.path.join(root, file)
-            result = process_local_file(state, file_path)
-            logger.info(f"Processing result for {file}: {result}")
+    file_paths = [os.path.join(root, file) for root, _, files in os.walk(directory_path) for file in files]
+
+    # 已从目录中删除的文件：删除对应文档
+    manifest = FileManifest()
+    missing_paths = manifest.missing_paths(directory_path, file_paths)
+    for file_path in missing_paths:
+        _retire_stale_versions(state, file_path, None)
+    manifest.forget(missing_paths)
+
+    # 先比对文件清单，只有新增或变化的文件进入提取流程
+    changed_paths = manifest.changed_files(file_paths, state.is_indexed)
+
+    from utils.pipeline import IngestionPipeline  # 延迟导入避免循环依赖
+    stats = IngestionPipeline(state, manifest=manifest).run(changed_paths)
+    stats["results"]["unchanged"] = len(file_paths) - len(changed_paths)
+    stats["results"]["removed"] = len(missing_paths)
+    state.commit.checkpoint()
+    maybe_compact(state)
+    logger.info(f"Directory processing finished: {stats}")
+    return stats
@@ -0,0 +1,221 @@
+import json
+import logging
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from config import MAPPING_DB_PATH, MAPPING_PATH
+
+# 获取日志记录器
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS doc_ids (
+    id INTEGER PRIMARY KEY,
+    md5 TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS doc_paths (
+    md5 TEXT PRIMARY KEY,
+    path TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_doc_paths_path ON doc_paths (path);
+CREATE TABLE IF NOT EXISTS tombstones (
+    scope TEXT NOT NULL,
+    id INTEGER NOT NULL,
+    PRIMARY KEY (scope, id)
+);
+CREATE TABLE IF NOT EXISTS file_manifest (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    raw_hash TEXT NOT NULL,
+    md5 TEXT
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO meta (key, value) VALUES ('version', 0);
+"""
+
+# SQLite 单条语句的参数数量上限较低，批量查询时分段
+_QUERY_BATCH = 500
+
+_stores: Dict[str, "MappingStore"] = {}
+_stores_lock = threading.Lock()
+
+
+class MappingStore:
+    """
+    文档映射的嵌入式存储（SQLite，WAL 模式）
+
+    - doc_ids:   向量ID -> 文档MD5
+    - doc_paths: 文档MD5 -> 文件路径
+    - tombstones: 已删除但向量尚未从索引中压缩掉的ID（按 document / chunk 索引区分）
+    - file_manifest: 文件路径 -> (大小, mtime_ns, 原始字节哈希, 文本MD5)，增量同步时跳过未变化的文件
+    - meta.version: 每次写入 doc_ids / doc_paths / tombstones 递增，供进程内缓存判断是否失效
+    - meta.next_id_<scope>: 下一个可分配的向量ID，删除后的ID不再复用
+
+    WAL 模式下读写互不阻塞，查询进程可以在入库进程写入时并发点查。
+    每个线程使用独立连接。
+    """
+
+    def __init__(self, db_path: str = MAPPING_DB_PATH):
+        self.db_path = db_path
+        self._local = threading.local()
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        with self._connection() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def version(self) -> int:
+        row = self._connection().execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        return row[0] if row else 0
+
+    def count(self) -> int:
+        return self._connection().execute("SELECT COUNT(*) FROM doc_paths").fetchone()[0]
+
+    def get_md5(self, doc_id: int) -> Optional[str]:
+        row = self._connection().execute("SELECT md5 FROM doc_ids WHERE id = ?", (int(doc_id),)).fetchone()
+        return row[0] if row else None
+
+    def get_path(self, md5: str) -> Optional[str]:
+        row = self._connection().execute("SELECT path FROM doc_paths WHERE md5 = ?", (md5,)).fetchone()
+        return row[0] if row else None
+
+    def get_md5s(self, doc_ids: Iterable[int]) -> Dict[int, str]:
+        """批量查询向量ID对应的MD5"""
+        return {int(k): v for k, v in self._select_in("SELECT id, md5 FROM doc_ids WHERE id IN ({})",
+                                                      [int(i) for i in doc_ids])}
+
+    def get_paths(self, md5s: Iterable[str]) -> Dict[str, str]:
+        """批量查询MD5对应的文件路径"""
+        return dict(self._select_in("SELECT md5, path FROM doc_paths WHERE md5 IN ({})", list(md5s)))
+
+    def load_all(self) -> Tuple[Dict[int, str], Dict[str, str]]:
+        """读取全部映射"""
+        conn = self._connection()
+        file_id_map = dict(conn.execute("SELECT id, md5 FROM doc_ids"))
+        file_path_map = dict(conn.execute("SELECT md5, path FROM doc_paths"))
+        return file_id_map, file_path_map
+
+    def bulk_upsert(self, id_entries: Dict[int, str], path_entries: Dict[str, str]):
+        """在一个事务中批量写入映射并递增版本号"""
+        conn = self._connection()
+        with conn:
+            conn.executemany("INSERT OR REPLACE INTO doc_ids (id, md5) VALUES (?, ?)",
+                             [(int(k), v) for k, v in id_entries.items()])
+            conn.executemany("INSERT OR REPLACE INTO doc_paths (md5, path) VALUES (?, ?)",
+                             list(path_entries.items()))
+            conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'version'")
+
+    def replace_all(self, file_id_map: Dict[int, str], file_path_map: Dict[str, str]):
+        """用给定映射整体替换存储内容"""
+        conn = self._connection()
+        with conn:
+            conn.execute("DELETE FROM doc_ids")
+            conn.execute("DELETE FROM doc_paths")
+            conn.executemany("INSERT INTO doc_ids (id, md5) VALUES (?, ?)",
+                             [(int(k), v) for k, v in file_id_map.items()])
+            conn.executemany("INSERT INTO doc_paths (md5, path) VALUES (?, ?)", list(file_path_map.items()))
+            conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'version'")
+
+    def get_md5s_for_path(self, path: str) -> List[str]:
+        """查询映射到给定文件路径的全部文档MD5"""
+        return [row[0] for row in self._connection().execute("SELECT md5 FROM doc_paths WHERE path = ?", (path,))]
+
+    def get_meta(self, key: str, default: int = 0) -> int:
+        row = self._connection().execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key: str, value: int):
+        conn = self._connection()
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, int(value)))
+
+    def get_tombstones(self, scope: str) -> Set[int]:
+        """查询尚未压缩的已删除向量ID"""
+        return {row[0] for row in self._connection().execute("SELECT id FROM tombstones WHERE scope = ?", (scope,))}
+
+    def delete_documents(self, scope: str, md5s: Iterable[str], ids: Iterable[int]):
+        """在一个事务中删除文档映射并记录墓碑，查询方立即可见"""
+        ids = [int(i) for i in ids]
+        conn = self._connection()
+        with conn:
+            conn.executemany("INSERT OR IGNORE INTO tombstones (scope, id) VALUES (?, ?)", [(scope, i) for i in ids])
+            conn.executemany("DELETE FROM doc_ids WHERE id = ?", [(i,) for i in ids])
+            conn.executemany("DELETE FROM doc_paths WHERE md5 = ?", [(md5,) for md5 in md5s])
+            conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'version'")
+
+    def clear_tombstones(self, scope: str, ids: Iterable[int]):
+        """索引压缩并落盘后清除对应墓碑"""
+        conn = self._connection()
+        with conn:
+            conn.executemany("DELETE FROM tombstones WHERE scope = ? AND id = ?", [(scope, int(i)) for i in ids])
+            conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'version'")
+
+    def get_manifest(self, paths: Iterable[str]) -> Dict[str, tuple]:
+        """批量查询文件清单，返回 path -> (size, mtime_ns, raw_hash, md5)"""
+        rows = self._select_in("SELECT path, size, mtime_ns, raw_hash, md5 FROM file_manifest WHERE path IN ({})",
+                               list(paths))
+        return {row[0]: row[1:] for row in rows}
+
+    def upsert_manifest(self, entries: Iterable[tuple]):
+        """批量写入文件清单条目 (path, size, mtime_ns, raw_hash, md5)"""
+        conn = self._connection()
+        with conn:
+            conn.executemany("INSERT OR REPLACE INTO file_manifest (path, size, mtime_ns, raw_hash, md5) "
+                             "VALUES (?, ?, ?, ?, ?)", list(entries))
+
+    def manifest_paths(self) -> List[str]:
+        """文件清单中的全部路径"""
+        return [row[0] for row in self._connection().execute("SELECT path FROM file_manifest")]
+
+    def delete_manifest(self, paths: Iterable[str]):
+        conn = self._connection()
+        with conn:
+            conn.executemany("DELETE FROM file_manifest WHERE path = ?", [(path,) for path in paths])
+
+    def import_legacy_json(self, json_path: str = MAPPING_PATH) -> bool:
+        """存储为空且存在旧版 JSON 映射文件时，一次性导入"""
+        if self.count() > 0 or not Path(json_path).exists():
+            return False
+        try:
+            with open(json_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.replace_all({int(k): v for k, v in data['file_id_map'].items()}, data['file_path_map'])
+            logger.info(f"Imported legacy mappings from {json_path} ({len(data['file_path_map'])} documents)")
+            return True
+        except Exception as e:
+            logger.error(f"Legacy mapping import failed: {str(e)}")
+            return False
+
+    def _select_in(self, sql: str, keys: list):
+        conn = self._connection()
+        rows = []
+        for i in range(0, len(keys), _QUERY_BATCH):
+            batch = keys[i:i + _QUERY_BATCH]
+            rows.extend(conn.execute(sql.format(",".join("?" * len(batch))), batch))
+        return rows
+
+
+def get_mapping_store(db_path: str = MAPPING_DB_PATH) -> MappingStore:
+    """获取进程内共享的映射存储实例（首次打开时导入旧版 JSON）"""
+    store = _stores.get(db_path)
+    if store is None:
+        with _stores_lock:
+            store = _stores.get(db_path)
+            if store is None:
+                store = MappingStore(db_path)
+                store.import_legacy_json()
+                _stores[db_path] = store
+    return store
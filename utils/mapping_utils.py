@@ -1,121 +1,80 @@
-import json
 import logging
-import os
+import threading
 from pathlib import Path
-from typing import Tuple, Dict
-import portalocker
-from config import MAPPING_PATH
+from typing import Tuple, Dict, Optional, Set
+
+from utils.mapping_store import get_mapping_store
 
 # 获取日志记录器
 logger = logging.getLogger(__name__)
 
+# 进程内缓存：映射存储版本号未变化时直接复用
+_cache_lock = threading.Lock()
+_cached_version: Optional[int] = None
+_cached_maps: Tuple[Dict[int, str], Dict[str, str]] = ({}, {})
+_tombstone_cache: Dict[str, Tuple[int, Set[int]]] = {}
+
+
 def load_mappings() -> Tuple[Dict[int, str], Dict[str, str]]:
-    """安全加载映射文件，支持自动恢复"""
-    mapping_path = Path(MAPPING_PATH)
-    temp_path = mapping_path.with_suffix('.tmp')
-
-    for retry in range(3):
-        try:
-            if not mapping_path.exists():
-                return {}, {}
-
-            # 带锁读取
-            with portalocker.Lock(mapping_path, 'r', timeout=5) as f:
-                raw_data = f.read()
-                data = json.loads(raw_data)
-
-            # 验证数据结构
-            if not isinstance(data, dict) or 'file_id_map' not in data or 'file_path_map' not in data:
-                raise ValueError("Invalid mapping structure")
-
-            file_id_map = {int(k): v for k, v in data['file_id_map'].items()}
-            file_path_map = data['file_path_map']
-
-            # 验证映射一致性
-            for doc_id, md5 in file_id_map.items():
-                if md5 not in file_path_map:
-                    raise ValueError(f"Inconsistent mapping at doc_id={doc_id}")
-
-            return file_id_map, file_path_map
-
-        except (json.JSONDecodeError, ValueError) as e:
-            logger.error(f"Mapping validation failed: {str(e)}")
-            if retry == 0 and mapping_path.exists():
-                _attempt_mapping_recovery(mapping_path, temp_path)
-            else:
-                break
-        except Exception as e:
-            logger.error(f"Unexpected mapping error: {str(e)}")
-            break
+    """加载全部映射，存储版本未变化时返回缓存（调用方不应修改返回的字典）"""
+    global _cached_version, _cached_maps
+
+    try:
+        store = get_mapping_store()
+        version = store.version()
+        if version == _cached_version:
+            return _cached_maps
+
+        with _cache_lock:
+            if version != _cached_version:
+                _cached_maps = store.load_all()
+                _cached_version = version
+                logger.info(f"Mappings loaded (version={version}, ids={len(_cached_maps[0])})")
+            return _cached_maps
+
+    except Exception as e:
+        logger.error(f"Unexpected mapping error: {str(e)}")
 
     logger.critical("Failed to load mappings, returning empty")
     return {}, {}
 
 
-def save_mappings(file_id_map: Dict[int, str], file_path_map: Dict[str, str]):
-    """原子化保存映射文件"""
-    mapping_path = Path(MAPPING_PATH)
-    temp_path = mapping_path.with_suffix('.tmp')
-
+def load_tombstones(scope: str) -> Set[int]:
+    """加载尚未压缩的已删除向量ID，存储版本未变化时返回缓存"""
     try:
-        # 先写入临时文件
-        data = {
-            'file_id_map': {str(k): v for k, v in file_id_map.items()},
-            'file_path_map': file_path_map
-        }
-        json_str = json.dumps(data, indent=2)
+        store = get_mapping_store()
+        version = store.version()
+        cached = _tombstone_cache.get(scope)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        tombstones = store.get_tombstones(scope)
+        _tombstone_cache[scope] = (version, tombstones)
+        return tombstones
+    except Exception as e:
+        logger.error(f"Failed to load tombstones: {str(e)}")
+        return set()
 
-        with portalocker.Lock(temp_path, 'w', timeout=10) as f:
-            f.write(json_str)
 
-        # 原子替换
-        with portalocker.Lock(mapping_path, 'w', timeout=10) as f:
-            os.replace(temp_path, mapping_path)
+def lookup_documents(doc_ids) -> Tuple[Dict[int, str], Dict[str, str]]:
+    """按向量ID批量点查 (id -> md5, md5 -> path)，无需加载全部映射"""
+    store = get_mapping_store()
+    file_id_map = store.get_md5s(doc_ids)
+    return file_id_map, store.get_paths(set(file_id_map.values()))
 
-        logger.info(f"Mappings saved (ids={len(file_id_map)}, paths={len(file_path_map)})")
 
-    except Exception as e:
-        logger.error(f"Mapping save failed: {str(e)}")
-        if temp_path.exists():
-            os.remove(temp_path)
-        raise
+def lookup_paths(md5s) -> Dict[str, str]:
+    """按MD5批量点查文件路径"""
+    return get_mapping_store().get_paths(set(md5s))
 
 
-def _attempt_mapping_recovery(mapping_path: Path, temp_path: Path):
-    """尝试恢复损坏的映射文件"""
-    logger.warning("Attempting mapping recovery...")
+def save_mappings(file_id_map: Dict[int, str], file_path_map: Dict[str, str]):
+    """原子化保存映射（整体替换）"""
     try:
-        # 读取原始数据
-        with open(mapping_path, 'r') as f:
-            raw_data = f.read()
-
-        # 尝试渐进式修复
-        repaired = False
-        try:
-            data = json.loads(raw_data)
-            repaired = True
-        except json.JSONDecodeError:
-            # 尝试补全结尾
-            if raw_data.strip().endswith(('}', ']')):
-                pass
-            else:
-                raw_data += '}'
-                data = json.loads(raw_data)
-                repaired = True
-
-        if repaired:
-            backup_path = mapping_path.with_suffix('.bak')
-            os.replace(mapping_path, backup_path)
-            save_mappings(
-                {int(k): v for k, v in data.get('file_id_map', {}).items()},
-                data.get('file_path_map', {})
-            )
-            logger.info("Mapping recovery successful")
-        else:
-            logger.error("Automatic recovery failed")
-
+        get_mapping_store().replace_all(file_id_map, file_path_map)
+        logger.info(f"Mappings saved (ids={len(file_id_map)}, paths={len(file_path_map)})")
     except Exception as e:
-        logger.error(f"Recovery attempt failed: {str(e)}")
+        logger.error(f"Mapping save failed: {str(e)}")
+        raise
 
 
 def validate_mappings(file_id_map: Dict[int, str], file_path_map: Dict[str, str]) -> bool:
@@ -134,4 +93,4 @@ def validate_mappings(file_id_map: Dict[int, str], file_path_map: Dict[str, str]
     if missing_files:
         logger.warning(f"Missing {len(missing_files)} mapped files")
 
-    return True
\ No newline at end of file
+    return True
@@ -0,0 +1,275 @@
+import logging
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# 获取日志记录器
+logger = logging.getLogger(__name__)
+
+# 默认延迟分桶（秒），覆盖从毫秒级检索到数十秒的 LLM 调用
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# (指标名, 类型, 说明, [(标签, 值)])
+MetricFamily = Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    escaped = (f'{key}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+               for key, value in labels.items())
+    return "{" + ",".join(escaped) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, key: tuple) -> Dict[str, str]:
+        return dict(zip(self.labelnames, key))
+
+
+class Counter(_Metric):
+    """单调递增计数器"""
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def collect(self) -> List[MetricFamily]:
+        with self._lock:
+            samples = [(self._labels(key), value) for key, value in self._values.items()]
+        return [(self.name, self.kind, self.documentation, samples)]
+
+
+class Gauge(Counter):
+    """可增可减的瞬时值"""
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    """累积分桶直方图（Prometheus 语义：le 为上界，含 +Inf 桶、_sum 与 _count）"""
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # [各分桶计数..., +Inf 计数, 总和]
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[bisect_left(self.buckets, value)] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """计时上下文：退出时（包括异常退出）记录耗时"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def collect(self) -> List[MetricFamily]:
+        samples = []
+        with self._lock:
+            series_items = [(key, list(series)) for key, series in self._series.items()]
+        for key, series in series_items:
+            labels = self._labels(key)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series[:-1]):
+                cumulative += count
+                samples.append(({**labels, "le": _format_value(bound)}, cumulative, "_bucket"))
+            samples.append((labels, series[-1], "_sum"))
+            samples.append((labels, cumulative, "_count"))
+        return [(self.name, self.kind, self.documentation, samples)]
+
+
+class MetricsRegistry:
+    """指标注册表：固定指标 + 抓取时计算的回调指标（缓存统计、索引大小、内存等）"""
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Callable[[], Iterable[MetricFamily]]] = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector: Callable[[], Iterable[MetricFamily]]):
+        with self._lock:
+            self._collectors.append(collector)
+        return collector
+
+    def render(self) -> str:
+        """Prometheus 文本格式（0.0.4）"""
+        with self._lock:
+            metrics, collectors = list(self._metrics), list(self._collectors)
+
+        families: List[MetricFamily] = []
+        for metric in metrics:
+            families.extend(metric.collect())
+        for collector in collectors:
+            try:
+                families.extend(collector())
+            except Exception as e:
+                # 单个回调失败不影响其余指标输出
+                logger.warning(f"Metrics collector {getattr(collector, '__name__', collector)} failed: {str(e)}")
+
+        lines = []
+        for name, kind, documentation, samples in families:
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} {kind}")
+            for sample in samples:
+                labels, value = sample[0], sample[1]
+                suffix = sample[2] if len(sample) > 2 else ""
+                lines.append(f"{name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+QUERY_STAGE_SECONDS = registry.register(Histogram(
+    "cognisync_query_stage_seconds", "Latency of each /query stage", ["stage"]))
+QUERY_SECONDS = registry.register(Histogram(
+    "cognisync_query_seconds", "End-to-end query latency", ["endpoint", "status"]))
+INGEST_FILES = registry.register(Counter(
+    "cognisync_ingest_files_total", "Ingestion results by status", ["status"]))
+INGEST_STAGE_SECONDS = registry.register(Histogram(
+    "cognisync_ingest_stage_seconds", "Per-file ingestion latency by stage", ["stage"]))
+
+
+def stage_timer(stage: str):
+    """查询阶段计时：with stage_timer("encode"): ..."""
+    return QUERY_STAGE_SECONDS.time(stage=stage)
+
+
+def record_ingest_result(result: dict):
+    INGEST_FILES.inc(status=result.get("status", "error"))
+
+
+def _cache_metrics() -> List[MetricFamily]:
+    """各级缓存的命中统计（读取缓存对象自身维护的计数）"""
+    from utils.answer_cache import answer_cache
+    from utils.query_cache import keyword_cache, vector_cache
+
+    caches = {"keyword": keyword_cache.stats(), "query_vector": vector_cache.stats(), "answer": answer_cache.stats()}
+    content_store = sys.modules.get("utils.content_store")
+    if content_store is not None and content_store.ContentStore._instance is not None:
+        caches["content"] = content_store.ContentStore._instance.stats()
+
+    hits, misses, entries = [], [], []
+    for cache, stats in caches.items():
+        labels = {"cache": cache}
+        hits.append((labels, stats.get("hits", 0) + stats.get("disk_hits", 0)))
+        misses.append((labels, stats.get("misses", 0)))
+        entries.append((labels, stats.get("entries", stats.get("cached_documents", 0))))
+    return [
+        ("cognisync_cache_hits_total", "counter", "Cache hits", hits),
+        ("cognisync_cache_misses_total", "counter", "Cache misses", misses),
+        ("cognisync_cache_entries", "gauge", "Entries held in memory", entries),
+    ]
+
+
+def _index_metrics() -> List[MetricFamily]:
+    """已加载索引的向量数与待压缩的墓碑数（不为抓取指标而触发索引加载）"""
+    families = []
+    faiss_utils = sys.modules.get("utils.faiss_utils")
+    if faiss_utils is not None:
+        metadata = faiss_utils.get_cache_metadata()
+        samples = [({"index": os.path.basename(path)}, meta["size"]) for path, meta in metadata.items()]
+        families.append(("cognisync_index_vectors", "gauge", "Vectors in loaded FAISS indexes", samples))
+        samples = [({"index": os.path.basename(path)}, meta.get("generation", 0)) for path, meta in metadata.items()]
+        families.append(("cognisync_index_generation", "gauge", "Snapshot generation of loaded FAISS indexes",
+                         samples))
+
+    mapping_utils = sys.modules.get("utils.mapping_utils")
+    if mapping_utils is not None:
+        from config import INDEX_GRANULARITY
+        families.append(("cognisync_index_tombstones", "gauge", "Deleted vectors awaiting compaction",
+                         [({}, len(mapping_utils.load_tombstones(INDEX_GRANULARITY)))]))
+    return families
+
+
+def _process_metrics() -> List[MetricFamily]:
+    """进程内存与模型参数占用"""
+    families = []
+    rss = _resident_memory_bytes()
+    if rss is not None:
+        families.append(("cognisync_process_resident_memory_bytes", "gauge", "Resident memory", [({}, rss)]))
+    try:
+        import resource
+        scale = 1 if sys.platform == "darwin" else 1024
+        families.append(("cognisync_process_peak_resident_memory_bytes", "gauge", "Peak resident memory",
+                         [({}, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale)]))
+    except ImportError:
+        pass
+
+    sentence_model = sys.modules.get("utils.sentence_model")
+    if sentence_model is not None:
+        samples = [({"model": path}, stats.get("param_bytes", 0))
+                   for path, stats in sentence_model.get_model_stats().items()]
+        families.append(("cognisync_model_parameter_bytes", "gauge", "Embedding model parameter memory", samples))
+
+    from utils import readiness
+    families.append(("cognisync_component_ready", "gauge", "Whether a component finished warming up",
+                     [({"component": name}, 1 if entry["state"] == readiness.READY else 0)
+                      for name, entry in readiness.snapshot().items()]))
+    return families
+
+
+def _resident_memory_bytes() -> Optional[int]:
+    """当前常驻内存（Linux 读取 /proc，其他平台不提供）"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+registry.register_collector(_cache_metrics)
+registry.register_collector(_index_metrics)
+registry.register_collector(_process_metrics)
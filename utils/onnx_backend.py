@@ -0,0 +1,314 @@
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from typing import List, Optional, Union
+
+import numpy as np
+
+from config import (LOCAL_MODEL_PATH, ONNX_MODEL_PATH, ONNX_QUANTIZE, ONNX_THREADS, ONNX_PARITY_MIN_COSINE,
+                    INDEX_GRANULARITY, FAISS_INDEX_PATH, CHUNK_INDEX_PATH, CHUNK_MAP_PATH, CHUNKER)
+
+# 获取日志记录器
+logger = logging.getLogger(__name__)
+
+# 导出时的输入顺序与 BERT 系模型 forward 的位置参数一致
+_INPUT_NAMES = ("input_ids", "attention_mask", "token_type_ids")
+
+
+class OnnxSentenceEncoder:
+    """
+    ONNX Runtime 推理的句向量模型，接口与 SentenceTransformer 中被本项目使用的部分保持一致
+
+    ONNX 图只包含 Transformer 主体（输出 last_hidden_state），池化与归一化按本地模型的
+    Sentence-Transformers 配置在 numpy 中完成，与 PyTorch 路径的结果一致（量化误差除外）。
+    """
+
+    def __init__(self, session, tokenizer, max_seq_length: int, dimension: int,
+                 pooling: str = "mean", normalize: bool = False, model_bytes: int = 0):
+        self.session = session
+        self.tokenizer = tokenizer
+        self.max_seq_length = max_seq_length
+        self.dimension = dimension
+        self.pooling = pooling
+        self.normalize = normalize
+        self.model_bytes = model_bytes
+        self._input_names = [node.name for node in session.get_inputs()]
+        # fast tokenizer 并发调用会报 "Already borrowed"，分词串行执行，推理可并发
+        self._tokenizer_lock = threading.Lock()
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dimension
+
+    def encode(self, sentences: Union[str, List[str]], batch_size: int = 32, **kwargs) -> np.ndarray:
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        embeddings = np.empty((len(texts), self.dimension), dtype=np.float32)
+
+        # 按长度排序后分批，减少填充
+        order = np.argsort([-len(text) for text in texts], kind="stable")
+        for i in range(0, len(texts), batch_size):
+            rows = order[i:i + batch_size]
+            embeddings[rows] = self._encode_batch([texts[row] for row in rows])
+        return embeddings[0] if single else embeddings
+
+    def parameters(self):
+        return []
+
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        with self._tokenizer_lock:
+            encoded = self.tokenizer(texts, padding=True, truncation=True, max_length=self.max_seq_length,
+                                     return_tensors="np")
+        attention_mask = encoded["attention_mask"].astype(np.int64)
+        feeds = {}
+        for name in self._input_names:
+            if name in encoded:
+                feeds[name] = encoded[name].astype(np.int64)
+            else:
+                feeds[name] = np.zeros_like(attention_mask)
+        hidden = self.session.run(None, feeds)[0]
+
+        if self.pooling == "cls":
+            pooled = hidden[:, 0]
+        elif self.pooling == "max":
+            masked = np.where(attention_mask[..., None] > 0, hidden, -1e9)
+            pooled = masked.max(axis=1)
+        else:
+            mask = attention_mask[..., None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        if self.normalize:
+            pooled = pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+        return pooled.astype(np.float32)
+
+
+def model_file(onnx_path: str = ONNX_MODEL_PATH, quantize: str = ONNX_QUANTIZE) -> str:
+    """导出的模型文件路径（fp32 与 int8 分别保存）"""
+    return os.path.join(onnx_path, "model_int8.onnx" if quantize == "int8" else "model.onnx")
+
+
+def export_onnx(local_model_path: str = LOCAL_MODEL_PATH, onnx_path: str = ONNX_MODEL_PATH,
+                quantize: str = ONNX_QUANTIZE) -> str:
+    """
+    将本地 Sentence-BERT 模型的 Transformer 主体导出为 ONNX（batch 与序列长度为动态维度），
+    quantize="int8" 时再做动态量化（权重 int8，激活在推理时量化）。返回模型文件路径。
+    """
+    import torch  # 延迟导入，只在导出时需要
+    from transformers import AutoModel, AutoTokenizer
+
+    os.makedirs(onnx_path, exist_ok=True)
+    fp32_path = model_file(onnx_path, "none")
+    if not os.path.exists(fp32_path):
+        tokenizer = AutoTokenizer.from_pretrained(local_model_path)
+        model = AutoModel.from_pretrained(local_model_path)
+        model.config.return_dict = False
+        model.eval()
+
+        sample = tokenizer(["模型导出 export"], return_tensors="pt")
+        input_names = [name for name in _INPUT_NAMES if name in sample]
+        dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+        dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+        temp_path = f"{fp32_path}.tmp"
+        with torch.no_grad():
+            torch.onnx.export(model, tuple(sample[name] for name in input_names), temp_path,
+                              input_names=input_names, output_names=["last_hidden_state"],
+                              dynamic_axes=dynamic_axes, opset_version=14, do_constant_folding=True)
+        os.replace(temp_path, fp32_path)
+        logger.info(f"Exported ONNX model to {fp32_path}")
+
+    if quantize != "int8":
+        return fp32_path
+
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    int8_path = model_file(onnx_path, "int8")
+    temp_path = f"{int8_path}.tmp"
+    quantize_dynamic(fp32_path, temp_path, weight_type=QuantType.QInt8)
+    os.replace(temp_path, int8_path)
+    logger.info(f"Quantized ONNX model written to {int8_path}")
+    return int8_path
+
+
+def load_onnx_model(local_model_path: str = LOCAL_MODEL_PATH, onnx_path: str = ONNX_MODEL_PATH,
+                    quantize: str = ONNX_QUANTIZE, threads: int = ONNX_THREADS) -> OnnxSentenceEncoder:
+    """加载（必要时先导出）ONNX 模型，分词器、池化方式与最大序列长度取自本地模型目录"""
+    import onnxruntime as ort  # 延迟导入，加快服务启动
+    from transformers import AutoTokenizer
+
+    path = model_file(onnx_path, quantize)
+    if not os.path.exists(path):
+        path = export_onnx(local_model_path, onnx_path, quantize)
+
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    options.inter_op_num_threads = 1
+    if threads > 0:
+        options.intra_op_num_threads = threads
+    session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+
+    settings = _sentence_transformer_settings(local_model_path)
+    encoder = OnnxSentenceEncoder(
+        session,
+        AutoTokenizer.from_pretrained(local_model_path, use_fast=True),
+        max_seq_length=settings["max_seq_length"],
+        dimension=settings["dimension"] or session.get_outputs()[0].shape[-1],
+        pooling=settings["pooling"],
+        normalize=settings["normalize"],
+        model_bytes=os.path.getsize(path)
+    )
+    logger.info(f"Loaded ONNX model {path} (quantize={quantize}, threads={threads or 'default'}, "
+                f"pooling={encoder.pooling})")
+    return encoder
+
+
+def _sentence_transformer_settings(local_model_path: str) -> dict:
+    """读取 Sentence-Transformers 的模块配置：最大序列长度、向量维度、池化方式与是否归一化"""
+    def read_json(*parts) -> dict:
+        try:
+            with open(os.path.join(local_model_path, *parts), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    settings = {
+        "max_seq_length": read_json("sentence_bert_config.json").get("max_seq_length", 128),
+        "dimension": read_json("config.json").get("hidden_size"),
+        "pooling": "mean",
+        "normalize": False
+    }
+
+    modules = read_json("modules.json") or []
+    for module in modules:
+        module_type = module.get("type", "")
+        if module_type.endswith("Pooling"):
+            pooling = read_json(module.get("path", ""), "config.json")
+            settings["dimension"] = pooling.get("word_embedding_dimension", settings["dimension"])
+            if pooling.get("pooling_mode_cls_token"):
+                settings["pooling"] = "cls"
+            elif pooling.get("pooling_mode_max_tokens"):
+                settings["pooling"] = "max"
+        elif module_type.endswith("Normalize"):
+            settings["normalize"] = True
+    return settings
+
+
+def parity_report(encoder, sample: int = 200, index_path: Optional[str] = None,
+                  granularity: str = INDEX_GRANULARITY, chunker: str = CHUNKER, seed: int = 42,
+                  reference=None) -> dict:
+    """
+    一致性检查：从索引中抽样向量，用 encoder 对相同文本重新编码，统计与索引中 fp32 向量的余弦相似度
+
+    块级索引按块映射还原块文本，结果只反映推理后端的差异；文档级索引的向量是各块向量的均值，
+    需按入库时的分块方式（chunker）重新分块。reference 为 PyTorch 模型时同时报告两者的编码耗时。
+    """
+    import faiss
+    from utils.batch_encoder import l2_normalize, tokenize_for_model
+    from utils.content_store import ContentStore
+    from utils.index_factory import index_ids, reconstruct_ids
+    from utils.mapping_utils import load_tombstones, lookup_documents
+
+    index_path = index_path or (CHUNK_INDEX_PATH if granularity == "chunk" else FAISS_INDEX_PATH)
+    index = faiss.read_index(index_path)
+    tombstones = load_tombstones(granularity)
+    live_ids = [int(doc_id) for doc_id in index_ids(index) if int(doc_id) not in tombstones]
+    candidates = random.Random(seed).sample(live_ids, len(live_ids))
+
+    # 还原每个抽样向量对应的模型输入（块级为单个块，文档级为全部块）
+    content_store = ContentStore()
+    groups, ids = [], []
+    if granularity == "chunk":
+        from utils.chunk_map import ChunkMap
+        chunk_map = ChunkMap.load(CHUNK_MAP_PATH)
+        for chunk_id in candidates:
+            entry = chunk_map.lookup(chunk_id)
+            content = content_store.get(entry[0]) if entry else None
+            if content is not None:
+                groups.append([" ".join(content[entry[1]:entry[1] + entry[2]].split())])
+                ids.append(chunk_id)
+            if len(ids) >= sample:
+                break
+    else:
+        from utils.load import chunk_text_with_spans
+        candidates = candidates[:sample * 2]
+        file_id_map, _ = lookup_documents(candidates)
+        for doc_id in candidates:
+            content = content_store.get(file_id_map[doc_id]) if doc_id in file_id_map else None
+            if content is not None:
+                groups.append(chunk_text_with_spans(content, chunker=chunker)[0])
+                ids.append(doc_id)
+            if len(ids) >= sample:
+                break
+    if not ids:
+        raise ValueError(f"No vectors with stored content found in {index_path}")
+
+    texts = [tokenize_for_model(text) for group in groups for text in group]
+    bounds = np.cumsum([0] + [len(group) for group in groups])
+
+    def encode(model) -> tuple:
+        start = time.perf_counter()
+        vectors = l2_normalize(model.encode(texts, batch_size=32))
+        seconds = time.perf_counter() - start
+        return np.vstack([vectors[bounds[i]:bounds[i + 1]].mean(axis=0) for i in range(len(ids))]), seconds
+
+    def cosine(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+        return (a * b).sum(axis=1) / np.clip(np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1), 1e-12, None)
+
+    def summary(similarities: np.ndarray) -> dict:
+        return {"min": round(float(similarities.min()), 5), "p1": round(float(np.percentile(similarities, 1)), 5),
+                "mean": round(float(similarities.mean()), 5)}
+
+    stored = reconstruct_ids(index, ids)
+    vectors, seconds = encode(encoder)
+    similarities = cosine(vectors, stored)
+    report = {
+        "index": index_path,
+        "granularity": granularity,
+        "samples": len(ids),
+        "texts": len(texts),
+        "cosine_vs_index": summary(similarities),
+        "min_cosine": ONNX_PARITY_MIN_COSINE,
+        "passed": bool(similarities.min() >= ONNX_PARITY_MIN_COSINE),
+        "encode_seconds": round(seconds, 3)
+    }
+    if reference is not None:
+        reference_vectors, reference_seconds = encode(reference)
+        report["reference"] = {
+            "cosine_vs_index": summary(cosine(reference_vectors, stored)),
+            "cosine_vs_encoder": summary(cosine(reference_vectors, vectors)),
+            "encode_seconds": round(reference_seconds, 3),
+            "speedup": round(reference_seconds / seconds, 2) if seconds > 0 else None
+        }
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the embedding model to ONNX and check parity with the index")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    export_parser = subcommands.add_parser("export", help="export (and quantize) the local model")
+    export_parser.add_argument("--quantize", default=ONNX_QUANTIZE, choices=("int8", "none"))
+    parity_parser = subcommands.add_parser("parity", help="compare ONNX vectors with the fp32 vectors in the index")
+    parity_parser.add_argument("--quantize", default=ONNX_QUANTIZE, choices=("int8", "none"))
+    parity_parser.add_argument("--sample", type=int, default=200, help="number of index vectors to re-encode")
+    parity_parser.add_argument("--index", help="index path (defaults to the configured granularity)")
+    parity_parser.add_argument("--granularity", default=INDEX_GRANULARITY, choices=("document", "chunk"))
+    parity_parser.add_argument("--chunker", default=CHUNKER, choices=("sentence", "whitespace"),
+                               help="chunker the document index was built with")
+    parity_parser.add_argument("--threads", type=int, default=ONNX_THREADS)
+    parity_parser.add_argument("--no-reference", action="store_true", help="skip the PyTorch timing comparison")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    if args.command == "export":
+        export_onnx(quantize=args.quantize)
+    else:
+        reference_model = None
+        if not args.no_reference:
+            from utils.sentence_model import load_torch_model
+            reference_model = load_torch_model()
+        result = parity_report(load_onnx_model(quantize=args.quantize, threads=args.threads), args.sample,
+                               args.index, args.granularity, args.chunker, reference=reference_model)
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+        sys.exit(0 if result["passed"] else 1)
@@ -0,0 +1,244 @@
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Iterable, Optional
+
+from config import (EMBED_BATCH_SIZE, EMBED_MAX_WAIT, EMBED_MAX_PENDING_DOCS,
+                    INGEST_EXTRACT_WORKERS, INGEST_EXTRACT_QUEUE, INGEST_MP_START_METHOD)
+from utils.batch_encoder import ChunkEmbeddingBatcher
+from utils.file_manifest import FileManifest
+from utils.load import extract_and_chunk, _register_extracted, _finalize_file, _record_manifest
+from utils.metrics import INGEST_STAGE_SECONDS, record_ingest_result
+
+# 获取日志记录器
+logger = logging.getLogger(__name__)
+
+# 写入阶段停止信号
+_STOP = object()
+
+
+def _extract_task(file_path: str) -> tuple:
+    """提取进程执行的任务：返回 (提取结果, 耗时)"""
+    start = time.perf_counter()
+    try:
+        result = extract_and_chunk(file_path)
+    except Exception as e:
+        result = {"status": "error", "reason": str(e), "file": os.path.basename(file_path)}
+    return result, time.perf_counter() - start
+
+
+class StageStats:
+    """单个流水线阶段的吞吐统计"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.items = 0
+        self.busy_seconds = 0.0
+
+    def record(self, seconds: float, items: int = 1):
+        self.items += items
+        self.busy_seconds += seconds
+
+    def summary(self, elapsed: float) -> dict:
+        return {
+            "items": self.items,
+            "busy_seconds": round(self.busy_seconds, 3),
+            "items_per_second": round(self.items / elapsed, 2) if elapsed > 0 else 0.0
+        }
+
+
+class IngestionPipeline:
+    """
+    分阶段并行入库流水线
+
+    1. 提取：进程池并行执行 PDF/DOCX 解析、MD5 计算与分块
+    2. 编码：ChunkEmbeddingBatcher 跨文档合并文本块批量编码
+    3. 写入：单一写线程独占 FAISS 索引与映射
+
+    阶段之间使用有界队列，下游变慢时上游自动阻塞（背压）。
+    处理完成的文件记入文件清单，下次同步时跳过。
+    提取子进程异常退出（如被 OOM 终止）时重建进程池，受影响的文件逐个重试，
+    再次导致子进程退出的文件记为错误并跳过，不中断整个目录的同步。
+    """
+
+    def __init__(self, state,
+                 manifest: Optional[FileManifest] = None,
+                 extract_workers: int = INGEST_EXTRACT_WORKERS,
+                 extract_queue: int = INGEST_EXTRACT_QUEUE,
+                 write_queue: int = EMBED_MAX_PENDING_DOCS,
+                 batch_size: int = EMBED_BATCH_SIZE,
+                 max_wait: float = EMBED_MAX_WAIT):
+        self.state = state
+        self.manifest = manifest or FileManifest()
+        self.extract_workers = max(extract_workers, 1)
+        self.extract_queue = max(extract_queue, 1)
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self._write_queue: queue.Queue = queue.Queue(maxsize=max(write_queue, 1))
+        self._in_flight = set()
+        self._in_flight_lock = threading.Lock()
+        self.results = {"success": 0, "exists": 0, "skipped": 0, "error": 0}
+        self._results_lock = threading.Lock()
+        self.extract_stats = StageStats("extract")
+        self.write_stats = StageStats("write")
+        self._mp_context = multiprocessing.get_context(INGEST_MP_START_METHOD)
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self.pool_restarts = 0
+
+    def run(self, file_paths: Iterable[str]) -> dict:
+        """处理所有文件，返回各阶段吞吐统计"""
+        start = time.perf_counter()
+        writer = threading.Thread(target=self._write_loop, name="ingest-writer", daemon=True)
+        self._pool = self._new_pool()
+
+        with ChunkEmbeddingBatcher(self.batch_size, self.max_wait) as batcher:
+            writer.start()
+            try:
+                pending = deque()  # (文件路径, Future)，均属于当前进程池
+                for file_path in file_paths:
+                    self._submit(pending, file_path, batcher)
+                    # 限制进程池中排队的文件数量
+                    while len(pending) >= self.extract_queue:
+                        self._collect(pending, batcher)
+                while pending:
+                    self._collect(pending, batcher)
+            finally:
+                self._write_queue.put(_STOP)
+                writer.join()
+                self.manifest.flush()
+                self._pool.shutdown(wait=False, cancel_futures=True)
+
+            embed_summary = {
+                "items": batcher.chunks,
+                "batches": batcher.batches,
+                "busy_seconds": round(batcher.busy_seconds, 3)
+            }
+
+        elapsed = time.perf_counter() - start
+        embed_summary["items_per_second"] = round(batcher.chunks / elapsed, 2) if elapsed > 0 else 0.0
+        stats = {
+            "elapsed_seconds": round(elapsed, 3),
+            "results": dict(self.results),
+            "extract_pool_restarts": self.pool_restarts,
+            "stages": {
+                "extract": self.extract_stats.summary(elapsed),
+                "embed": embed_summary,
+                "write": self.write_stats.summary(elapsed)
+            }
+        }
+        logger.info(f"Ingestion pipeline stats: {stats}")
+        return stats
+
+    def _new_pool(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(max_workers=self.extract_workers, mp_context=self._mp_context)
+
+    def _restart_pool(self):
+        """丢弃不可用的进程池并新建"""
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        self._pool = self._new_pool()
+        self.pool_restarts += 1
+
+    def _submit(self, pending: deque, file_path: str, batcher: ChunkEmbeddingBatcher):
+        try:
+            pending.append((file_path, self._pool.submit(_extract_task, file_path)))
+        except BrokenProcessPool:
+            self._recover(pending, batcher, [file_path])
+
+    def _collect(self, pending: deque, batcher: ChunkEmbeddingBatcher):
+        """等待最早提交的文件提取完成并分发结果"""
+        _, future = pending[0]
+        try:
+            task_result = future.result()
+        except BrokenProcessPool:
+            self._recover(pending, batcher)
+            return
+        pending.popleft()
+        self._dispatch(task_result, batcher)
+
+    def _recover(self, pending: deque, batcher: ChunkEmbeddingBatcher, extra: Iterable[str] = ()):
+        """
+        进程池因子进程异常退出而不可用：重建进程池，已完成的结果照常分发，
+        其余文件逐个单独提取，以便定位并跳过导致子进程退出的文件
+        """
+        items = list(pending)
+        pending.clear()
+        logger.warning(f"Extraction process pool broke, restarting and retrying {len(items)} pending files")
+        self._restart_pool()
+
+        retry = []
+        for file_path, future in items:
+            # _extract_task 自身捕获了全部异常，Future 带异常即表示子进程异常退出
+            if future.done() and not future.cancelled() and future.exception() is None:
+                self._dispatch(future.result(), batcher)
+            else:
+                retry.append(file_path)
+        for file_path in retry + list(extra):
+            self._dispatch(self._extract_alone(file_path), batcher)
+
+    def _extract_alone(self, file_path: str) -> tuple:
+        """单独提取一个文件；子进程再次异常退出时记为错误（不记入文件清单，下次同步重试）"""
+        try:
+            return self._pool.submit(_extract_task, file_path).result()
+        except BrokenProcessPool:
+            logger.error(f"Extraction process died while processing {file_path}, skipping file")
+            self._restart_pool()
+            return {"status": "error", "reason": "extraction_process_died", "file": os.path.basename(file_path)}, 0.0
+
+    def _dispatch(self, task_result: tuple, batcher: ChunkEmbeddingBatcher):
+        """提取结果去重后送入编码阶段，再排入写入队列"""
+        extracted, seconds = task_result
+        self.extract_stats.record(seconds)
+        INGEST_STAGE_SECONDS.observe(seconds, stage="extract")
+
+        try:
+            with self._in_flight_lock:
+                prepared = _register_extracted(self.state, extracted, self._in_flight)
+                if "status" not in prepared:
+                    self._in_flight.add(prepared["md5"])
+        except Exception as e:
+            prepared = {"status": "error", "reason": str(e), "file": extracted.get("file")}
+
+        if "status" in prepared:
+            _record_manifest(self.manifest, extracted, prepared)
+            self._record_result(prepared)
+            return
+
+        # 写入队列已满时阻塞，形成背压
+        self._write_queue.put((prepared, batcher.submit(prepared["chunks"])))
+
+    def _write_loop(self):
+        """单一写线程：等待编码结果并写入索引与映射"""
+        while True:
+            item = self._write_queue.get()
+            if item is _STOP:
+                break
+
+            prepared, future = item
+            try:
+                embeddings = future.result()
+                start = time.perf_counter()
+                result = _finalize_file(self.state, prepared, embeddings)
+                self.write_stats.record(time.perf_counter() - start)
+                INGEST_STAGE_SECONDS.observe(time.perf_counter() - start, stage="write")
+            except Exception as e:
+                logger.error(f"Error processing {prepared['file']}: {str(e)}", exc_info=True)
+                result = {"status": "error", "reason": str(e), "file": prepared["file"]}
+            finally:
+                with self._in_flight_lock:
+                    self._in_flight.discard(prepared["md5"])
+
+            _record_manifest(self.manifest, prepared, result)
+            self._record_result(result)
+
+    def _record_result(self, result: dict):
+        status = result.get("status", "error")
+        with self._results_lock:
+            self.results[status] = self.results.get(status, 0) + 1
+        record_ingest_result(result)
+        logger.info(f"Processing result for {result.get('file')}: {result}")
@@ -0,0 +1,172 @@
+import logging
+import pickle
+import re
+import sqlite3
+import sys
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Optional, Tuple
+
+import numpy as np
+
+from config import (KEYWORD_CACHE_SIZE, KEYWORD_CACHE_TTL, VECTOR_CACHE_SIZE, VECTOR_CACHE_TTL,
+                    QUERY_CACHE_MAX_BYTES, QUERY_CACHE_DISK_PATH, MODEL_NAME)
+
+# 获取日志记录器
+logger = logging.getLogger(__name__)
+
+
+def normalize_question(question: str) -> str:
+    """问题归一化：全角转半角、合并空白、统一小写"""
+    question = unicodedata.normalize('NFKC', question)
+    return re.sub(r'\s+', ' ', question).strip().lower()
+
+
+def _sizeof(value: Any) -> int:
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    return sys.getsizeof(value)
+
+
+class TTLCache:
+    """
+    带过期时间与容量上限的 LRU 缓存，可选 SQLite 磁盘层
+
+    内存层按条目数与字节数双重限制淘汰；磁盘层在进程重启后仍然有效，
+    内存未命中时回查磁盘并回填内存。
+    """
+
+    def __init__(self, name: str, max_entries: int, ttl: float,
+                 max_bytes: int = QUERY_CACHE_MAX_BYTES, disk_path: Optional[str] = None):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (expires_at, value, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._disk_path = disk_path
+        self._disk_local = threading.local()
+        if disk_path:
+            Path(disk_path).parent.mkdir(parents=True, exist_ok=True)
+            with self._disk() as conn:
+                conn.execute(f"CREATE TABLE IF NOT EXISTS {self.name} "
+                             f"(key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL NOT NULL)")
+
+    def get(self, key: str) -> Optional[Any]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                self._drop(key)
+
+        entry = self._disk_get(key, now)
+        if entry is not None:
+            # 回填内存时沿用磁盘条目的过期时间，避免反复回填使条目超出 TTL 仍然有效
+            value, expires_at = entry
+            self.disk_hits += 1
+            self._remember(key, value, expires_at)
+            return value
+
+        self.misses += 1
+        return None
+
+    def put(self, key: str, value: Any):
+        expires_at = time.time() + self.ttl
+        self._remember(key, value, expires_at)
+        self._disk_put(key, value, expires_at)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+        if self._disk_path:
+            with self._disk() as conn:
+                conn.execute(f"DELETE FROM {self.name}")
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round((self.hits + self.disk_hits) / lookups, 4) if lookups else 0.0
+        }
+
+    def _remember(self, key: str, value: Any, expires_at: float):
+        size = _sizeof(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (expires_at, value, size)
+            self._bytes += size
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self.evictions += 1
+
+    def _drop(self, key: str):
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+    def _disk(self) -> sqlite3.Connection:
+        conn = getattr(self._disk_local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self._disk_path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._disk_local.conn = conn
+        return conn
+
+    def _disk_get(self, key: str, now: float) -> Optional[Tuple[Any, float]]:
+        """磁盘层未过期的条目，返回 (值, 过期时间)"""
+        if not self._disk_path:
+            return None
+        try:
+            row = self._disk().execute(
+                f"SELECT value, expires_at FROM {self.name} WHERE key = ? AND expires_at > ?", (key, now)).fetchone()
+            return (pickle.loads(row[0]), row[1]) if row else None
+        except Exception as e:
+            logger.warning(f"Cache {self.name} disk read failed: {str(e)}")
+            return None
+
+    def _disk_put(self, key: str, value: Any, expires_at: float):
+        if not self._disk_path:
+            return
+        try:
+            with self._disk() as conn:
+                conn.execute(f"INSERT OR REPLACE INTO {self.name} (key, value, expires_at) VALUES (?, ?, ?)",
+                             (key, pickle.dumps(value), expires_at))
+        except Exception as e:
+            logger.warning(f"Cache {self.name} disk write failed: {str(e)}")
+
+
+# 问题 -> 扩展关键词（命中时省去一次 LLM 调用）
+keyword_cache = TTLCache("keyword_cache", KEYWORD_CACHE_SIZE, KEYWORD_CACHE_TTL, disk_path=QUERY_CACHE_DISK_PATH)
+# 关键词 -> 查询向量（命中时省去一次模型前向计算）
+vector_cache = TTLCache("vector_cache", VECTOR_CACHE_SIZE, VECTOR_CACHE_TTL, disk_path=QUERY_CACHE_DISK_PATH)
+
+
+def vector_cache_key(keyword: str) -> str:
+    """向量缓存键包含模型名，切换模型后旧向量自动失效"""
+    return f"{MODEL_NAME}:{keyword}"
+
+
+def get_cache_stats() -> dict:
+    return {"keywords": keyword_cache.stats(), "query_vectors": vector_cache.stats()}
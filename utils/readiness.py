@@ -0,0 +1,66 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, Optional
+
+# 获取日志记录器
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+WARMING = "warming"
+READY = "ready"
+FAILED = "failed"
+
+# 服务可以接收查询前必须就绪的组件（知识库同步在后台进行，不阻塞就绪）
+REQUIRED_COMPONENTS = ("model", "mappings", "index")
+
+_started_at = time.time()
+_lock = threading.Lock()
+_components: Dict[str, dict] = {name: {"state": PENDING} for name in REQUIRED_COMPONENTS + ("sync",)}
+
+
+def set_state(name: str, state: str, detail: Optional[str] = None, seconds: Optional[float] = None):
+    """更新组件状态"""
+    entry = {"state": state, "updated_at": round(time.time(), 3)}
+    if detail is not None:
+        entry["detail"] = detail
+    if seconds is not None:
+        entry["seconds"] = round(seconds, 3)
+    with _lock:
+        _components[name] = entry
+
+
+@contextmanager
+def track(name: str):
+    """
+    跟踪组件预热过程：进入时标记 warming，正常结束标记 ready，
+    出错时标记 failed 并记录日志（异常不向外传播，后续组件继续预热）
+    """
+    set_state(name, WARMING)
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        set_state(name, FAILED, detail=str(e), seconds=time.perf_counter() - start)
+        logger.error(f"Component {name} failed to warm up: {str(e)}", exc_info=True)
+    else:
+        seconds = time.perf_counter() - start
+        set_state(name, READY, seconds=seconds)
+        logger.info(f"Component {name} ready in {seconds:.2f}s")
+
+
+def snapshot() -> Dict[str, dict]:
+    """返回全部组件状态的副本"""
+    with _lock:
+        return {name: dict(entry) for name, entry in _components.items()}
+
+
+def is_ready(components: Iterable[str] = REQUIRED_COMPONENTS) -> bool:
+    """给定组件是否全部就绪"""
+    with _lock:
+        return all(_components.get(name, {}).get("state") == READY for name in components)
+
+
+def uptime_seconds() -> float:
+    return round(time.time() - _started_at, 3)
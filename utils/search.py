@@ -1,6 +1,7 @@
 import faiss
 import numpy as np
-from config import SIMILARITY_THRESHOLD
+from config import SIMILARITY_THRESHOLD, FAISS_INDEX_TYPE
+from utils.index_factory import create_index
 from typing import List, Tuple
 
 def search_in_faiss(query_vector: np.ndarray, index: faiss.Index, threshold=SIMILARITY_THRESHOLD, k=5) -> List[Tuple[int, float]]:
@@ -42,23 +43,24 @@ def load_faiss_index(index_path: str) -> faiss.Index:
         raise Exception(f"Error loading FAISS index from {index_path}: {str(e)}")
 
 
-def build_faiss_index(vectors: np.ndarray, index_path: str) -> faiss.Index:
+def build_faiss_index(vectors: np.ndarray, index_path: str, index_type: str = FAISS_INDEX_TYPE) -> faiss.Index:
     """
     构建并保存 FAISS 索引。
 
     :param vectors: 要索引的文档向量 (N, D)，N 为文档数量，D 为向量维度
     :param index_path: 索引保存的路径
+    :param index_type: 索引类型（flat / hnsw / ivfflat / ivfpq），IVF 类索引使用 vectors 训练
     :return: 返回构建的 FAISS 索引
     """
     try:
         # 获取向量的维度
         dim = vectors.shape[1]
 
-        # 使用 L2 距离创建 FAISS 索引
-        index = faiss.IndexFlatL2(dim)
+        # 按配置类型创建索引（内积度量，向量需 L2 归一化）
+        index = create_index(dim, index_type, train_vectors=vectors)
 
-        # 将向量添加到索引中
-        index.add(vectors)
+        # 将向量添加到索引中（向量ID即其在 vectors 中的位置）
+        index.add_with_ids(vectors, np.arange(len(vectors), dtype=np.int64))
 
         # 保存索引到磁盘
         faiss.write_index(index, index_path)
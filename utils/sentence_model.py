@@ -1,24 +1,56 @@
-from sentence_transformers import SentenceTransformer
+import logging
+import os
+import threading
+import time
+from typing import Dict
 
-from config import LOCAL_MODEL_PATH, MODEL_NAME
+from config import LOCAL_MODEL_PATH, MODEL_NAME, MODEL_WARMUP_TEXT, EMBEDDING_BACKEND
+
+# 获取日志记录器
+logger = logging.getLogger(__name__)
+
+# 进程级模型注册表：每个模型路径只加载一次
+_model_registry: Dict[str, object] = {}
+_model_stats: Dict[str, dict] = {}
+_registry_lock = threading.Lock()
 
 
 # 加载模型并缓存到本地
-def load_model(local_model_path=LOCAL_MODEL_PATH):
+def load_model(local_model_path=LOCAL_MODEL_PATH, backend=EMBEDDING_BACKEND):
+    """
+    按配置的推理后端加载模型：onnx 使用 ONNX Runtime（首次使用时从本地模型导出），
+    导出或加载失败时回退到 PyTorch（SentenceTransformer）。
+    """
+    if backend == "onnx":
+        try:
+            from utils.onnx_backend import load_onnx_model
+
+            if not os.path.isdir(local_model_path):
+                # 首次运行先下载并缓存模型，再从本地模型导出
+                load_torch_model(local_model_path)
+            return load_onnx_model(local_model_path)
+        except Exception as e:
+            logger.warning(f"ONNX backend unavailable, falling back to PyTorch: {str(e)}", exc_info=True)
+    return load_torch_model(local_model_path)
+
+
+def load_torch_model(local_model_path=LOCAL_MODEL_PATH):
     """
     加载本地或远程 Sentence-BERT 模型。
     如果模型在本地已下载，则加载本地模型，否则从 Hugging Face 下载模型。
     """
+    from sentence_transformers import SentenceTransformer  # 延迟导入，加快服务启动
+
     try:
         # 尝试加载本地模型
         model = SentenceTransformer(local_model_path)
-        print(f"Loaded model from local path: {local_model_path}")
+        logger.info(f"Loaded model from local path: {local_model_path}")
     except Exception as e:
         # 如果加载本地模型失败，则从远程下载模型
-        print(f"Loading model from remote. Error: {e}")
+        logger.warning(f"Loading model from remote. Error: {e}")
         model = SentenceTransformer(MODEL_NAME)  # 使用指定的模型
         model.save(local_model_path)  # 将模型缓存到本地
-        print(f"Model downloaded and cached to: {local_model_path}")
+        logger.info(f"Model downloaded and cached to: {local_model_path}")
 
     return model
 
@@ -45,9 +77,71 @@ def encode_texts(model, texts: list):
     return vectors
 
 # 获取已加载的模型
-def get_model():
+def get_model(local_model_path=LOCAL_MODEL_PATH):
     """
     获取已加载的模型实例（如果没有加载，则进行加载）
+
+    同一进程内每个模型路径只加载一次，后续调用直接返回共享实例。
     """
-    model = load_model()  # 使用默认本地路径加载
-    return model
\ No newline at end of file
+    model = _model_registry.get(local_model_path)
+    if model is not None:
+        return model
+
+    with _registry_lock:
+        # 双重检查，避免并发时重复加载
+        model = _model_registry.get(local_model_path)
+        if model is None:
+            start = time.perf_counter()
+            model = load_model(local_model_path)
+            load_seconds = time.perf_counter() - start
+
+            _model_stats[local_model_path] = {
+                'load_seconds': round(load_seconds, 3),
+                'param_bytes': _estimate_model_bytes(model),
+                'warmed_up': False
+            }
+            _model_registry[local_model_path] = model
+            logger.info(
+                f"Model registered: {local_model_path} "
+                f"(load={load_seconds:.2f}s, params={_model_stats[local_model_path]['param_bytes'] / 1024 ** 2:.1f}MB)"
+            )
+    return model
+
+
+# 查询已加载的模型（不触发加载）
+def get_loaded_model(local_model_path=LOCAL_MODEL_PATH):
+    """返回本进程已加载的模型，未加载时返回 None（不触发加载）"""
+    return _model_registry.get(local_model_path)
+
+
+def warmup_model(local_model_path=LOCAL_MODEL_PATH):
+    """
+    预热模型：在服务启动时加载模型并执行一次空跑编码，
+    避免首个请求承担模型加载和算子初始化的开销。
+    """
+    model = get_model(local_model_path)
+    start = time.perf_counter()
+    encode_texts(model, [MODEL_WARMUP_TEXT])
+    warmup_seconds = time.perf_counter() - start
+
+    stats = _model_stats.setdefault(local_model_path, {})
+    stats['warmup_seconds'] = round(warmup_seconds, 3)
+    stats['warmed_up'] = True
+    logger.info(f"Model warmed up: {local_model_path} (warmup={warmup_seconds:.2f}s)")
+    return model
+
+
+def get_model_stats() -> Dict[str, dict]:
+    """返回已加载模型的加载耗时与内存占用统计"""
+    return {path: dict(stats) for path, stats in _model_stats.items()}
+
+
+def _estimate_model_bytes(model) -> int:
+    """估算模型参数占用的内存（字节）"""
+    if hasattr(model, "model_bytes"):
+        # ONNX 模型按模型文件大小估算
+        return model.model_bytes
+    try:
+        return sum(p.numel() * p.element_size() for p in model.parameters())
+    except Exception:
+        return 0
@@ -1,16 +1,13 @@
 import logging
 import os
+import re
 import warnings
-from io import BytesIO
+import zipfile
+from io import BytesIO, StringIO
 from pathlib import Path
-from typing import Union, Optional
-from docx import Document
-from docx.opc.exceptions import PackageNotFoundError
-from pdfminer.high_level import extract_text as pdfminer_extract_text
-from pdfminer.pdfparser import PDFSyntaxError
-import chardet
+from typing import Iterator, List, Tuple, Union, Optional
 
-from config import MAX_FILE_SIZE
+from config import MAX_FILE_SIZE, DOCX_EXTRACTOR, PDF_MAX_PAGES, PDF_MAX_CHARS, PDF_SCAN_CHECK_PAGES
 
 # 获取日志记录器
 logger = logging.getLogger(__name__)
@@ -46,10 +43,15 @@ def extract_file_content(file_path: str) -> str:
     return content.strip()
 
 
-def extract_text_from_docx(docx_file: Union[BytesIO, str, Path]) -> str:
+def extract_text_from_docx(docx_file: Union[BytesIO, str, Path], extractor: str = DOCX_EXTRACTOR) -> str:
     """
     增强版DOCX文本提取，支持表格内容提取和清理
+
+    extractor="stream" 时流式解析 document.xml（见 iter_docx_blocks），合并单元格只输出一次；
+    extractor="python-docx" 时构建完整对象模型。两者输出顺序相同：先正文段落，后表格单元格。
     """
+    from docx.opc.exceptions import PackageNotFoundError  # 延迟导入，加快服务启动
+
     try:
         # 统一处理路径对象
         if isinstance(docx_file, Path):
@@ -59,22 +61,10 @@ def extract_text_from_docx(docx_file: Union[BytesIO, str, Path]) -> str:
         if _check_file_size(docx_file):
             raise ValueError("File size exceeds limit")
 
-        doc = Document(docx_file)
-        text_content = []
-
-        # 提取段落文本并清理
-        for para in doc.paragraphs:
-            para_text = para.text.strip()
-            if para_text:  # 排除空段落
-                text_content.append(para_text)
-
-        # 提取表格内容并清理
-        for table in doc.tables:
-            for row in table.rows:
-                for cell in row.cells:
-                    cell_text = cell.text.strip()
-                    if cell_text:  # 排除空单元格
-                        text_content.append(cell_text)
+        if extractor == "stream":
+            text_content = _docx_blocks_in_order(docx_file)
+        else:
+            text_content = _docx_blocks_with_python_docx(docx_file)
 
         # 合并并清理文本
         full_text = "\n".join(text_content).strip()
@@ -87,17 +77,144 @@ def extract_text_from_docx(docx_file: Union[BytesIO, str, Path]) -> str:
 
         return cleaned_text
 
-    except PackageNotFoundError:
+    except (PackageNotFoundError, zipfile.BadZipFile, KeyError):
         raise ValueError("Invalid or corrupted DOCX file")
     except Exception as e:
         logger.error(f"DOCX processing failed: {str(e)}", exc_info=True)
         raise RuntimeError(f"Failed to process DOCX file: {str(e)}")
 
 
+def _docx_blocks_with_python_docx(docx_file: Union[BytesIO, str]) -> List[str]:
+    """python-docx 提取：段落与逐网格单元格文本（合并单元格按跨越的网格重复）"""
+    from docx import Document
+
+    doc = Document(docx_file)
+    text_content = []
+
+    # 提取段落文本并清理
+    for para in doc.paragraphs:
+        para_text = para.text.strip()
+        if para_text:  # 排除空段落
+            text_content.append(para_text)
+
+    # 提取表格内容并清理
+    for table in doc.tables:
+        for row in table.rows:
+            for cell in row.cells:
+                cell_text = cell.text.strip()
+                if cell_text:  # 排除空单元格
+                    text_content.append(cell_text)
+    return text_content
+
+
+def _docx_blocks_in_order(docx_file: Union[BytesIO, str]) -> List[str]:
+    """流式提取：先正文段落，后表格单元格（与 python-docx 提取的输出顺序一致）"""
+    paragraphs, cells = [], []
+    for kind, text in iter_docx_blocks(docx_file):
+        text = text.strip()
+        if text:
+            (paragraphs if kind == "paragraph" else cells).append(text)
+    return paragraphs + cells
+
+
+# WordprocessingML 命名空间
+_W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+_RELATIONSHIP_NS = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+_OFFICE_DOCUMENT = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"
+# 文本块内元素对应的文本（与 python-docx 一致）
+_RUN_TEXT = {_W + "tab": "\t", _W + "ptab": "\t", _W + "cr": "\n", _W + "noBreakHyphen": "-"}
+
+
+def iter_docx_blocks(docx_file: Union[BytesIO, str]) -> Iterator[Tuple[str, str]]:
+    """
+    按文档顺序产出 ("paragraph", 文本) 与 ("cell", 文本)
+
+    直接读取 zip 中的主文档部件并 iterparse：正文段落与顶层表格的每一行解析完即处理并释放，
+    内存占用与单行内容相当。文本规则与 python-docx 相同（w:r 与 w:hyperlink 下的 w:t、制表符、
+    换行等；不含修订标记与嵌套表格），但合并单元格只输出一次：
+    横向合并（gridSpan）的单元格本身只有一个 w:tc，纵向合并的后续单元格（vMerge continue）跳过。
+    """
+    from xml.etree.ElementTree import iterparse
+
+    with zipfile.ZipFile(docx_file) as package:
+        with package.open(_main_document_part(package)) as document:
+            stack = []
+            for event, element in iterparse(document, events=("start", "end")):
+                if event == "start":
+                    stack.append(element)
+                    continue
+                stack.pop()
+                parent = stack[-1] if stack else None
+                if parent is None:
+                    continue
+
+                if parent.tag == _W + "body":
+                    if element.tag == _W + "p":
+                        yield "paragraph", _paragraph_text(element)
+                    # 正文直接子元素处理完即从树中移除
+                    parent.remove(element)
+                elif element.tag == _W + "tr" and len(stack) >= 2 and stack[-2].tag == _W + "body":
+                    # 顶层表格的一行
+                    for tc in element.findall(_W + "tc"):
+                        if _is_merge_continuation(tc):
+                            continue
+                        yield "cell", "\n".join(_paragraph_text(p) for p in tc.findall(_W + "p"))
+                    parent.remove(element)
+
+
+def _main_document_part(package: zipfile.ZipFile) -> str:
+    """从包关系中找到主文档部件（通常为 word/document.xml）"""
+    from xml.etree.ElementTree import iterparse
+
+    try:
+        with package.open("_rels/.rels") as rels:
+            for _, element in iterparse(rels):
+                if element.tag == _RELATIONSHIP_NS + "Relationship" and element.get("Type") == _OFFICE_DOCUMENT:
+                    return element.get("Target").lstrip("/")
+    except KeyError:
+        pass
+    return "word/document.xml"
+
+
+def _paragraph_text(paragraph) -> str:
+    """段落文本：直接子元素 w:r 与 w:hyperlink 下的 w:r"""
+    parts = []
+    for child in paragraph:
+        if child.tag == _W + "r":
+            _append_run_text(child, parts)
+        elif child.tag == _W + "hyperlink":
+            for run in child.findall(_W + "r"):
+                _append_run_text(run, parts)
+    return "".join(parts)
+
+
+def _append_run_text(run, parts: List[str]):
+    for child in run:
+        if child.tag == _W + "t":
+            parts.append(child.text or "")
+        elif child.tag == _W + "br":
+            # 只有换行符类型的 w:br 产生换行，分页与分栏符不产生文本
+            if child.get(_W + "type", "textWrapping") == "textWrapping":
+                parts.append("\n")
+        elif child.tag in _RUN_TEXT:
+            parts.append(_RUN_TEXT[child.tag])
+
+
+def _is_merge_continuation(tc) -> bool:
+    """纵向合并的后续单元格：w:vMerge 存在且 val 不是 restart"""
+    merge = tc.find(f"{_W}tcPr/{_W}vMerge")
+    return merge is not None and merge.get(_W + "val", "continue") == "continue"
+
+
 def extract_text_from_pdf(pdf_file: Union[BytesIO, str, Path]) -> str:
     """
     增强版PDF文本提取，支持加密检测和备用解析器
+
+    逐页提取并清理，只在最后拼接一次，不保留整份原始输出；
+    页数或字符数达到 PDF_MAX_PAGES / PDF_MAX_CHARS 时保留已提取的页（与机器负载无关，同一文件结果确定）。
     """
+    from pdfminer.pdfparser import PDFSyntaxError  # 延迟导入，加快服务启动
+
     try:
         pdf_file = str(pdf_file) if isinstance(pdf_file, Path) else pdf_file
 
@@ -106,8 +223,7 @@ def extract_text_from_pdf(pdf_file: Union[BytesIO, str, Path]) -> str:
             raise ValueError("File size exceeds limit")
 
         # 尝试PDFMiner提取
-        text = pdfminer_extract_text(pdf_file)
-        clean_text = _clean_pdf_text(text)
+        clean_text = " ".join(page for page in iter_pdf_pages(pdf_file) if page)
 
         if clean_text:
             return clean_text
@@ -123,7 +239,7 @@ def extract_text_from_pdf(pdf_file: Union[BytesIO, str, Path]) -> str:
 
         # 最终检查
         if not clean_text:
-            if _is_scanned_pdf(pdf_file):
+            if _is_scanned_pdf(pdf_file, clean_text):
                 raise ValueError("Scanned PDF (image-based) not supported")
             raise ValueError("No extractable text found")
         return clean_text
@@ -135,8 +251,48 @@ def extract_text_from_pdf(pdf_file: Union[BytesIO, str, Path]) -> str:
         raise RuntimeError(f"Failed to process PDF file: {str(e)}")
 
 
+def iter_pdf_pages(pdf_file: Union[BytesIO, str], max_pages: int = PDF_MAX_PAGES,
+                   max_chars: int = PDF_MAX_CHARS) -> Iterator[str]:
+    """
+    逐页产出清理后的PDF文本（与 pdfminer extract_text 使用相同的版面参数）
+
+    每页处理完后清空输出缓冲区，内存占用与单页文本相当而非整份文档。
+    :param max_pages: 最多提取的页数，0 表示不限制
+    :param max_chars: 最多提取的字符数（按清理后的文本累计，达到后不再处理后续页），0 表示不限制
+    """
+    from pdfminer.converter import TextConverter
+    from pdfminer.layout import LAParams
+    from pdfminer.pdfinterp import PDFPageInterpreter, PDFResourceManager
+    from pdfminer.pdfpage import PDFPage
+    from pdfminer.utils import open_filename
+
+    number = 0
+    extracted = 0
+    with open_filename(pdf_file, "rb") as fp, StringIO() as output:
+        resource_manager = PDFResourceManager(caching=True)
+        device = TextConverter(resource_manager, output, codec="utf-8", laparams=LAParams())
+        interpreter = PDFPageInterpreter(resource_manager, device)
+        for number, page in enumerate(PDFPage.get_pages(fp, maxpages=max_pages), start=1):
+            interpreter.process_page(page)
+            text = output.getvalue()
+            output.seek(0)
+            output.truncate(0)
+            text = _clean_pdf_text(text)
+            yield text
+
+            extracted += len(text)
+            if max_chars and extracted >= max_chars:
+                logger.warning(f"PDF character limit ({max_chars}) reached after {number} pages, "
+                               f"remaining pages skipped")
+                return
+        if max_pages and number >= max_pages:
+            logger.info(f"PDF page limit ({max_pages}) reached, remaining pages skipped")
+
+
 def extract_text_from_txt(file_path: Union[str, Path], encodings: Optional[list] = None) -> str:
     """增强版TXT文件读取，支持自动编码检测"""
+    import chardet  # 延迟导入，加快服务启动
+
     default_encodings = ['utf-8', 'gbk', 'gb2312', 'latin-1']
     encodings = encodings or default_encodings
 
@@ -188,13 +344,55 @@ def _clean_pdf_text(text: str) -> str:
     return text.replace('\n', ' ').replace('  ', ' ').strip()
 
 
-def _is_scanned_pdf(pdf_path: str) -> bool:
-    """简单判断是否为扫描版PDF"""
+def _is_scanned_pdf(pdf_path: Union[str, BytesIO], extracted_text: str = "",
+                    check_pages: int = PDF_SCAN_CHECK_PAGES) -> bool:
+    """
+    判断是否为扫描版PDF：可提取文本极少（少于50字符）且前几页含图像
+
+    只解析前 check_pages 页的资源字典与内容流中的图像操作，不再做版面分析。
+    """
+    if len(extracted_text.strip()) >= 50:
+        return False
+
+    from pdfminer.pdfpage import PDFPage
+    from pdfminer.utils import open_filename
+
     try:
-        text = pdfminer_extract_text(pdf_path)
-        return len(text.strip()) < 50  # 假设可提取文本少于50字符视为扫描件
-    except:
+        with open_filename(pdf_path, "rb") as fp:
+            for page in PDFPage.get_pages(fp, maxpages=check_pages):
+                if _page_has_images(page):
+                    return True
+        return False
+    except Exception as e:
+        logger.warning(f"Scanned PDF check failed: {str(e)}")
+        return True
+
+
+# 内容流中的内联图像（BI ... ID ... EI）
+_INLINE_IMAGE_PATTERN = re.compile(rb'(?:^|\s)BI\s')
+
+
+def _page_has_images(page) -> bool:
+    """页面资源中是否引用图像 XObject（含一层 Form XObject），或内容流中是否有内联图像"""
+    from pdfminer.pdftypes import resolve1, stream_value
+
+    def has_image_xobject(resources, depth: int = 0) -> bool:
+        xobjects = resolve1(resolve1(resources or {}).get("XObject")) or {}
+        for xobject in xobjects.values():
+            xobject = stream_value(xobject)
+            subtype = getattr(xobject.get("Subtype"), "name", None)
+            if subtype == "Image":
+                return True
+            if subtype == "Form" and depth < 1 and has_image_xobject(xobject.get("Resources"), depth + 1):
+                return True
+        return False
+
+    if has_image_xobject(page.resources):
         return True
+    for content in page.contents:
+        if _INLINE_IMAGE_PATTERN.search(stream_value(content).get_data()):
+            return True
+    return False
 
 
 def _extract_with_pymupdf(pdf_file: Union[str, BytesIO]) -> str: